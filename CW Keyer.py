@@ -1,25 +1,37 @@
+import time
+STARTUP_START = time.perf_counter()
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog, filedialog
-import serial.tools.list_ports
 import serial
-import win32com.client
-import pythoncom
-import time
 import threading
+import bisect
+import string
+import csv
+import io
+import socket
+import functools
+import itertools
+import collections
+import hashlib
+import struct
+import sys
+import argparse
+from array import array
 from datetime import datetime, UTC
 import queue
 import json
 import os
-import webbrowser
-
-try:
-    import psutil
-    HAS_PSUTIL = True
-except ImportError:
-    HAS_PSUTIL = False
+import re
 
 # Global variables with defaults
 SETTINGS_FILE = "settings.json"
+settings_cache = None
+log_ready = threading.Event()
+startup_marks = [("imports", time.perf_counter())]
+startup_report_enabled = False
+JOURNAL_FILE = "qso_journal.jsonl"
+log_error = None
+headless_output_lock = threading.Lock()
 ser = None
 frequency_var = None
 callsign_var = None
@@ -28,11 +40,153 @@ rcv_var = None
 exchange_var = None
 speed_var = None
 qso_list = []
+frequency_ints = {}
 serial_number = 1
-log_tree = None
+serial_lock = threading.Lock()
+next_qso_id = 1
+journal_file = None
+journal_lock = threading.Lock()
+journal_pending = None
+dupe_index = {}
+scp_file = "MASTER.SCP"
+cty_file = "cty.dat"
+cty_index = None
+cty_records = {}
+scp_index = None
+log_fuzzy = None
+log_fuzzy_lock = threading.Lock()
+rate_meter = None
+score_engine = None
+log_fuzzy_pending = None
+reference_fuzzy = None
+log_view = None
 sent_text = None
+keyer_buffer = None
 frequency_queue = queue.Queue()
+rig_frequency = (0, 0.0)
+rig_backend = None
+serial_events = queue.Queue()
+serial_engine = None
 tune_state = None
+log_sync = None
+sync_hub = None
+sync_events = queue.Queue()
+diagnostics = None
+serial_capture = None
+BANDS = [
+    (1.8, 2.0, "160M"),
+    (3.5, 4.0, "80M"),
+    (5.3, 5.45, "60M"),
+    (7.0, 7.3, "40M"),
+    (10.1, 10.15, "30M"),
+    (14.0, 14.35, "20M"),
+    (18.068, 18.168, "17M"),
+    (21.0, 21.45, "15M"),
+    (24.89, 24.99, "12M"),
+    (28.0, 29.7, "10M"),
+    (50.0, 54.0, "6M")
+]
+SERIAL_POLL_MS = 10
+FREQUENCY_POLL_MS = 50
+RIG_POLL_INTERVAL = 0.05
+RIG_STALE_AFTER = 0.5
+RIG_RETRY_MIN = 0.5
+RIG_RETRY_MAX = 10.0
+RIGCTLD_TIMEOUT = 2.0
+OMNIRIG_MODES = {
+    0x00800000: "CW", 0x01000000: "CW-R", 0x02000000: "USB", 0x04000000: "LSB",
+    0x08000000: "RTTY-R", 0x10000000: "RTTY", 0x20000000: "AM", 0x40000000: "FM"
+}
+TX_QUEUE_SIZE = 64
+TX_COALESCE_BYTES = 256
+KEYER_FLUSH_MS = 60
+KEYER_HISTORY = 60
+REPEAT_POLL_MS = 20
+SCP_MAX_SHOWN = 60
+ADIF_CHUNK_SIZE = 65536
+ADIF_BATCH_SIZE = 1000
+ADIF_APPLY_SIZE = 100
+ADIF_QUEUE_SIZE = 4
+ADIF_SLICE_SECONDS = 0.03
+ADIF_POLL_MS = 10
+EXPORT_BATCH_SIZE = 2000
+EXPORT_BUFFER_SIZE = 1 << 20
+EXPORT_POLL_MS = 50
+EXPORT_FIELDS = ("serial", "datetime", "callsign", "rst_sent", "rst_received", "exchange_sent", "exchange_received", "frequency", "mode")
+CABRILLO_MODES = {"CW": "CW", "SSB": "PH", "USB": "PH", "LSB": "PH", "AM": "PH", "FM": "FM", "RTTY": "RY"}
+NPLUS1_MAX_SHOWN = 12
+SYNC_PORT = 7373
+SYNC_POLL_MS = 10
+SYNC_CONNECT_TIMEOUT = 3.0
+SYNC_RETRY_MIN = 0.5
+SYNC_RETRY_MAX = 5.0
+# Spare serials a station holds, enough to cover a burst of QSOs logged faster than the hub round trip
+SYNC_SERIAL_PREFETCH = 4
+# Offline, each station numbers from its own block, which the hub never hands out itself
+SYNC_LOCAL_SERIAL_BASE = 10000
+SYNC_LOCAL_SERIAL_BLOCK = 1000
+SYNC_LOCAL_SLOTS = 10
+SYNC_LOCAL_SERIAL_END = SYNC_LOCAL_SERIAL_BASE + SYNC_LOCAL_SERIAL_BLOCK * SYNC_LOCAL_SLOTS
+SYNC_OUTBOX_FILE = "sync_outbox.jsonl"
+# Histogram buckets from 10 us to 100 s, four per decade
+HISTOGRAM_BOUNDS_MS = tuple(0.01 * 10 ** (i / 4) for i in range(29))
+DIAG_PROBE_MS = 100
+DIAG_REFRESH_MS = 1000
+DIAG_PROCESS_SAMPLES = 600
+# Capture file: magic, (monotonic, wall clock) at the start, then (monotonic, direction, length) + bytes per record
+CAPTURE_MAGIC = b"MM3CAP1\n"
+CAPTURE_HEADER = struct.Struct("<dd")
+CAPTURE_RECORD = struct.Struct("<dBH")
+CAPTURE_TX = 0
+CAPTURE_RX = 1
+CAPTURE_RING_SIZE = 1 << 18
+CAPTURE_DRAIN_MS = 200
+# points: per new (call, band, mode), or the contest's table in ScoreEngine.qso_points; multiplier: what
+# counts as a mult; country: DXCC entities are mults as well; per_band: mults count again on each band
+CONTEST_RULES = {
+    "Generic": {"points": 1, "multiplier": None, "per_band": False},
+    "Serial Sprint": {"points": 1, "multiplier": None, "per_band": False},
+    "CQ WPX CW": {"points": "wpx", "multiplier": "prefix", "per_band": False},
+    "CQ WW CW": {"points": "cqww", "multiplier": "exchange", "country": True, "per_band": True},
+    "IARU HF": {"points": "iaru", "multiplier": "exchange", "per_band": True},
+    "ARRL Sweepstakes CW": {"points": 2, "multiplier": "section", "per_band": False},
+    "State QSO Party": {"points": 2, "multiplier": "exchange", "per_band": False}
+}
+WPX_SUFFIXES = {"P", "M", "MM", "AM", "QRP", "A"}
+LOW_BANDS = {"160M", "80M", "40M"}
+CTY_LOOKUP_CACHE = 4096
+MORSE_CODE = {
+    'A': '.-', 'B': '-...', 'C': '-.-.', 'D': '-..', 'E': '.', 'F': '..-.', 'G': '--.', 'H': '....',
+    'I': '..', 'J': '.---', 'K': '-.-', 'L': '.-..', 'M': '--', 'N': '-.', 'O': '---', 'P': '.--.',
+    'Q': '--.-', 'R': '.-.', 'S': '...', 'T': '-', 'U': '..-', 'V': '...-', 'W': '.--', 'X': '-..-',
+    'Y': '-.--', 'Z': '--..', '0': '-----', '1': '.----', '2': '..---', '3': '...--', '4': '....-',
+    '5': '.....', '6': '-....', '7': '--...', '8': '---..', '9': '----.', '.': '.-.-.-', ',': '--..--',
+    '?': '..--..', '/': '-..-.', '=': '-...-', '+': '.-.-.', '-': '-....-', '(': '-.--.', ')': '-.--.-',
+    ':': '---...', ';': '-.-.-.', "'": '.----.', '"': '.-..-.', '@': '.--.-.', '!': '-.-.--', '&': '.-...'
+}
+PROSIGNS = {
+    "<AR>": ".-.-.", "<AS>": ".-...", "<BK>": "-...-.-", "<BT>": "-...-", "<KN>": "-.--.",
+    "<SK>": "...-.-", "<SN>": "...-.", "<HH>": "........"
+}
+CW_CALIBRATION_MESSAGES = ["E", "TU", "5NN", "PARIS", "NR?", "CQ TEST", "PARIS PARIS", "5NN 001 TU", "CQ CQ TEST DE PARIS"]
+# A fit outside these comes from lost or mismatched echoes, not from the keyer
+CW_CALIBRATION_MIN_SAMPLES = 3
+CW_CALIBRATION_SCALE_RANGE = (0.5, 2.0)
+CW_CALIBRATION_MAX_OFFSET = 2.0
+MACRO_FIELDS = {
+    "callsign": "hiscall",
+    "rst": "hisrst",
+    "exchange": "exchange",
+    "mycall": "mycall",
+    "serial": "serial",
+    "rcvd": "hisexch",
+    "band": "band",
+    "frequency": "freq",
+    "name": "myname",
+    "lastcall": "lastcall"
+}
+LOG_COLUMNS = ("Nr", "DateTime", "Callsign", "RST Sent", "RST Rcvd", "Exch Sent", "Exch Rcvd", "Freq", "Mode")
+LOG_HEADINGS = ("Nr", "Date/Time (UTC)", "Callsign", "RST Sent", "RST Rcvd", "Exch Sent", "Exch Rcvd", "Freq", "Mode")
 macros = {
     "F1": "CQ CQ CQ DE {mycall} {mycall} K",
     "F2": "{callsign} {rst} {exchange}",
@@ -47,6 +201,7 @@ macros = {
     "F11": "",
     "F12": ""
 }
+compiled_macros = {}
 button_labels = {
     "F1": "CQ",
     "F2": "Exchange",
@@ -75,6 +230,27 @@ my_station = {
     "antenna": "",
     "power": ""
 }
+rig_config = {
+    "backend": "OmniRig" if sys.platform == "win32" else "rigctld",
+    "host": "localhost",
+    "port": 4532
+}
+sync_config = {
+    "role": "Off",
+    "host": "",
+    "port": SYNC_PORT,
+    "station": socket.gethostname()
+}
+keyer_options = {
+    "speed": 25,
+    "use_5nn": False,
+    "shorten_zeros": False
+}
+cw_timing_config = {
+    "scale": 1.0,
+    "offset": 0.0,
+    "farnsworth_wpm": 0
+}
 contest_config = {
     "contest_name": "",
     "operator": "Single Op",
@@ -83,67 +259,1285 @@ contest_config = {
     "transmitter": "One",
     "exchange": "",
     "use_serial_exchange": False,
-    "send_tu_on_log": False
+    "send_tu_on_log": False,
+    "nplus1_use_scp": True,
+    "rules": "Generic"
 }
 
 def load_settings():
-    global qso_list, serial_number, macros, button_labels, my_station, contest_config
+    # Parsed once; later callers get the same dict, which save_settings keeps current
+    global serial_number, macros, button_labels, my_station, contest_config, scp_file, cty_file, settings_cache
+    if settings_cache is not None:
+        return settings_cache
+    settings_cache = {}
     if os.path.exists(SETTINGS_FILE):
         try:
             with open(SETTINGS_FILE, 'r') as f:
                 settings = json.load(f)
-                qso_list = settings.get("qso_list", [])
-                serial_number = settings.get("serial_number", 1)
+                # The log itself lives in the journal, never let a stale settings file wind the serial back
+                serial_number = max(settings.get("serial_number", 1), serial_number)
                 macros.update(settings.get("macros", {}))
                 button_labels.update(settings.get("button_labels", {}))
                 my_station.update(settings.get("my_station", {}))
                 contest_config.update(settings.get("contest_config", {}))
-                return settings
+                cw_timing_config.update(settings.get("cw_timing", {}))
+                rig_config.update(settings.get("rig_config", {}))
+                sync_config.update(settings.get("sync_config", {}))
+                try:
+                    keyer_options["speed"] = int(settings.get("speed", keyer_options["speed"]))
+                except ValueError:
+                    pass
+                keyer_options["use_5nn"] = settings.get("use_5nn", keyer_options["use_5nn"])
+                keyer_options["shorten_zeros"] = settings.get("shorten_zeros", keyer_options["shorten_zeros"])
+                scp_file = settings.get("scp_file", scp_file)
+                cty_file = settings.get("cty_file", cty_file)
+                settings_cache = settings
         except Exception as e:
             pass  # Silently ignore errors
-    return {}
+    return settings_cache
 
 def save_settings():
+    global settings_cache
     settings = {
-        "qso_list": qso_list,
         "serial_number": serial_number,
         "macros": macros,
         "button_labels": button_labels,
         "my_station": my_station,
         "contest_config": contest_config,
+        "cw_timing": cw_timing_config,
+        "rig_config": rig_config,
+        "sync_config": sync_config,
+        "sync_session": log_sync.session if log_sync else settings_cache.get("sync_session", "") if settings_cache else "",
+        "sync_seq": log_sync.applied_seq if log_sync else settings_cache.get("sync_seq", 0) if settings_cache else 0,
+        "sync_slot": log_sync.slot if log_sync else settings_cache.get("sync_slot") if settings_cache else None,
+        "scp_file": scp_file,
+        "cty_file": cty_file,
         "main_window_geometry": key_window.winfo_geometry() if 'key_window' in globals() else "900x550+0+0",
         "log_window_geometry": log_window.winfo_geometry() if 'log_window' in globals() else "800x400+0+0",
-        "speed": speed_var.get() if speed_var else "25",
+        "speed": str(keyer_options["speed"]),
         "knob_mode": knob_mode.get() if 'knob_mode' in globals() else False,
         "sidetone_enabled": sidetone_enabled.get() if 'sidetone_enabled' in globals() else True,
         "repeat_enabled": repeat_enabled.get() if 'repeat_enabled' in globals() else False,
         "repeat_interval": repeat_interval.get() if 'repeat_interval' in globals() else "2.5",
-        "use_5nn": use_5nn.get() if 'use_5nn' in globals() else False,
-        "shorten_zeros": shorten_zeros.get() if 'shorten_zeros' in globals() else False
+        "use_5nn": keyer_options["use_5nn"],
+        "shorten_zeros": keyer_options["shorten_zeros"],
+        "keyer_word_mode": keyer_word_mode.get() if 'keyer_word_mode' in globals() else False
     }
+    if settings_cache and "qso_list" in settings_cache:
+        # A legacy log that has not made it into the journal yet
+        settings["qso_list"] = settings_cache["qso_list"]
+    settings_cache = settings
     try:
         with open(SETTINGS_FILE, 'w') as f:
             json.dump(settings, f, indent=4)
     except Exception as e:
         pass  # Silently ignore errors
 
+class Qso:
+    # One logged contact. Time is UTC epoch seconds and frequency is whole Hz, and the text
+    # fields that repeat are interned; the old dict of strings only exists at the edges
+    # (journal, edit dialog, CSV/JSON export)
+    __slots__ = ("id", "serial", "timestamp", "callsign", "rst_sent", "rst_received", "_exchange_sent", "exchange_received", "frequency_hz", "mode", "cty", "station")
+
+    def __init__(self, qso_id, serial, timestamp, callsign, rst_sent, rst_received, exchange_sent, exchange_received, frequency_hz, mode, cty=None, station=""):
+        self.id = qso_id
+        # The serial is usually the id and the sent exchange as well, so share one int
+        self.serial = qso_id if serial == qso_id else serial
+        self.timestamp = timestamp
+        self.callsign = sys.intern(callsign.upper())
+        self.rst_sent = sys.intern(rst_sent)
+        self.rst_received = sys.intern(rst_received)
+        self.exchange_sent = exchange_sent
+        self.exchange_received = sys.intern(exchange_received)
+        self.frequency_hz = frequency_ints.setdefault(frequency_hz, frequency_hz)
+        self.mode = sys.intern(mode)
+        # (country, continent, CQ zone, ITU zone), one shared tuple per entity
+        self.cty = cty
+        # Which station logged it when the log is shared, empty otherwise
+        self.station = sys.intern(station)
+
+    @property
+    def exchange_sent(self):
+        value = self._exchange_sent
+        return str(value) if value.__class__ is int else value
+
+    @exchange_sent.setter
+    def exchange_sent(self, value):
+        self._exchange_sent = self.serial if value == str(self.serial) else sys.intern(value)
+
+    @classmethod
+    def from_dict(cls, qso):
+        return cls(
+            qso.get("id", 0),
+            qso.get("serial", 0),
+            parse_timestamp(qso["datetime"]),
+            qso["callsign"],
+            qso.get("rst_sent", ""),
+            qso.get("rst_received", ""),
+            qso.get("exchange_sent", ""),
+            qso.get("exchange_received", ""),
+            parse_frequency_hz(qso.get("frequency", "")),
+            qso.get("mode", "CW"),
+            cty_record(qso["country"], qso.get("continent", ""), qso.get("cq_zone", 0), qso.get("itu_zone", 0)) if qso.get("country") else None,
+            qso.get("station", "")
+        )
+
+    def to_dict(self):
+        qso = {
+            "id": self.id,
+            "serial": self.serial,
+            "datetime": format_timestamp(self.timestamp),
+            "callsign": self.callsign,
+            "rst_sent": self.rst_sent,
+            "rst_received": self.rst_received,
+            "exchange_sent": self.exchange_sent,
+            "exchange_received": self.exchange_received,
+            "frequency": frequency_text(self.frequency_hz),
+            "mode": self.mode
+        }
+        if self.cty:
+            qso["country"], qso["continent"], qso["cq_zone"], qso["itu_zone"] = self.cty
+        if self.station:
+            qso["station"] = self.station
+        return qso
+
+def parse_timestamp(text):
+    return int(datetime.fromisoformat(text).replace(tzinfo=UTC).timestamp())
+
+def format_timestamp(timestamp):
+    day, seconds = divmod(timestamp, 86400)
+    return f"{utc_date(day)} {seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+@functools.lru_cache(maxsize=64)
+def utc_date(day, separator="-"):
+    return time.strftime(f"%Y{separator}%m{separator}%d", time.gmtime(day * 86400))
+
+def parse_frequency_hz(text):
+    try:
+        return round(float(text.split()[0]) * 1_000_000)
+    except (ValueError, IndexError):
+        return 0
+
+@functools.lru_cache(maxsize=1024)
+def frequency_text(frequency_hz):
+    # "N/A" is what the log has always shown for a QSO made with the rig offline
+    return f"{frequency_hz / 1_000_000:.6f}" if frequency_hz > 0 else "N/A"
+
+def journal_line(record):
+    return json.dumps(record, separators=(",", ":")) + "\n"
+
+def open_journal():
+    global journal_file
+    journal_file = open(JOURNAL_FILE, "a", encoding="utf-8")
+
+def write_journal(record):
+    # One record per change, flushed and fsynced so a crash never loses a logged QSO
+    line = journal_line(record)
+    with journal_lock:
+        if journal_file is None:
+            open_journal()
+        journal_file.write(line)
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+        if journal_pending is not None:
+            journal_pending.append(line)
+
+def write_journal_batch(records):
+    if not records:
+        return
+    lines = "".join(journal_line(record) for record in records)
+    with journal_lock:
+        if journal_file is None:
+            open_journal()
+        journal_file.write(lines)
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+        if journal_pending is not None:
+            journal_pending.append(lines)
+
+def replay_journal():
+    qsos = {}
+    torn = False
+    with open(JOURNAL_FILE, "r", encoding="utf-8") as f:
+        for line in f:
+            torn = not line.endswith("\n")
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Half-written record from a crash
+            op = record.get("op")
+            if op == "add":
+                qsos[record["qso"]["id"]] = record["qso"]
+            elif op == "edit":
+                if record["qso"]["id"] in qsos:
+                    qsos[record["qso"]["id"]] = record["qso"]
+            elif op == "delete":
+                qsos.pop(record["id"], None)
+            elif op == "clear":
+                qsos.clear()
+    if torn:
+        with open(JOURNAL_FILE, "a", encoding="utf-8") as f:
+            f.write("\n")
+    return [Qso.from_dict(qso) for qso in qsos.values()]
+
+def compact_journal():
+    global journal_file, journal_pending
+    # Changes made while the snapshot is written are also kept aside and appended before the swap
+    with journal_lock:
+        journal_pending = []
+        snapshot = list(qso_list)
+    tmp_file = JOURNAL_FILE + ".tmp"
+    try:
+        f = open(tmp_file, "w", encoding="utf-8")
+        for qso in snapshot:
+            f.write(journal_line({"op": "add", "qso": qso.to_dict()}))
+        with journal_lock:
+            f.writelines(journal_pending)
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            if journal_file is not None:
+                journal_file.close()
+                journal_file = None
+            os.replace(tmp_file, JOURNAL_FILE)
+            open_journal()
+            journal_pending = None
+    except Exception:
+        with journal_lock:
+            journal_pending = None
+        raise
+
+def compact_journal_in_background():
+    # The journal as it stands is still complete, so a failed compaction only costs disk space
+    try:
+        compact_journal()
+    except OSError as e:
+        print(f"Failed to compact {JOURNAL_FILE}: {e}", file=sys.stderr)
+
+def load_log(legacy_qsos=None):
+    global qso_list, serial_number, next_qso_id, log_error
+    if os.path.exists(JOURNAL_FILE):
+        try:
+            qso_list = replay_journal()
+        except Exception as e:
+            qso_list = []
+            log_error = f"Failed to read {JOURNAL_FILE}: {e}"
+    if legacy_qsos:
+        # Older versions kept the log inside settings.json. It stays there until the journal
+        # holds it, and QSOs an interrupted migration already moved are not added twice.
+        moved = {(qso.serial, qso.timestamp, qso.callsign) for qso in qso_list}
+        next_id = max((qso.id for qso in qso_list), default=0) + 1
+        for legacy_qso in legacy_qsos:
+            qso = Qso.from_dict(dict(legacy_qso, id=next_id))
+            if (qso.serial, qso.timestamp, qso.callsign) not in moved:
+                qso_list.append(qso)
+                next_id += 1
+        try:
+            compact_journal()
+            if settings_cache:
+                settings_cache.pop("qso_list", None)
+        except OSError as e:
+            log_error = f"Failed to move the log from {SETTINGS_FILE} to {JOURNAL_FILE}, it stays in {SETTINGS_FILE}: {e}"
+    elif os.path.exists(JOURNAL_FILE) and not log_error:
+        threading.Thread(target=compact_journal_in_background, daemon=True).start()
+    if qso_list:
+        next_qso_id = max(qso.id for qso in qso_list) + 1
+        serial_number = max(serial_number, max(qso.serial for qso in qso_list) + 1)
+    build_log_indexes()
+
+def load_log_in_background(legacy_qsos=None):
+    # Replaying a long journal overlaps with the port dialog instead of delaying it
+    def worker():
+        try:
+            load_log(legacy_qsos)
+        finally:
+            mark_startup(f"log loaded ({len(qso_list)} QSOs)")
+            log_ready.set()
+    threading.Thread(target=worker, daemon=True).start()
+
+def mark_startup(label):
+    startup_marks.append((label, time.perf_counter()))
+
+def print_startup_report():
+    if not startup_report_enabled:
+        return
+    previous = STARTUP_START
+    print("Startup timing (ms since the first import):", file=sys.stderr)
+    for label, at in sorted(startup_marks, key=lambda mark: mark[1]):
+        print(f"  {(at - STARTUP_START) * 1000:8.1f}  +{(at - previous) * 1000:7.1f}  {label}", file=sys.stderr)
+        previous = at
+    print("  Run with python -X importtime for a per-module import breakdown", file=sys.stderr)
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.high = 0.0
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.high:
+            self.high = ms
+
+    def percentile(self, fraction):
+        # Upper edge of the bucket holding the value, so it errs on the slow side
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(HISTOGRAM_BOUNDS_MS, self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.high)
+        return self.high
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(0.5), 3),
+            "p90_ms": round(self.percentile(0.9), 3),
+            "p99_ms": round(self.percentile(0.99), 3),
+            "max_ms": round(self.high, 3),
+            "buckets": [[round(bound, 3), count] for bound, count in zip(HISTOGRAM_BOUNDS_MS + (None,), self.counts) if count]
+        }
+
+class Diagnostics:
+    # Latency histograms fed by hooks that cost one global check while diagnostics are off
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.process = None
+        self.process_samples = collections.deque(maxlen=DIAG_PROCESS_SAMPLES)
+
+    def record(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(seconds * 1000)
+
+    def sample_process(self):
+        if self.process is None:
+            try:
+                import psutil
+                self.process = psutil.Process()
+                self.process.cpu_percent()
+            except Exception:
+                self.process = False  # psutil is optional
+        if not self.process:
+            return None
+        sample = (round(time.time() - self.started, 1), self.process.cpu_percent(), self.process.memory_info().rss)
+        self.process_samples.append(sample)
+        return sample
+
+    def snapshot(self):
+        sample = self.sample_process()
+        with self.lock:
+            histograms = {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+        return {
+            "started": datetime.fromtimestamp(self.started, UTC).strftime("%Y-%m-%d %H:%M:%S"),
+            "seconds": round(time.time() - self.started, 1),
+            "histograms": histograms,
+            "process": {"cpu_percent": sample[1], "rss_bytes": sample[2], "samples": list(self.process_samples)} if sample else None
+        }
+
+def set_diagnostics(enabled):
+    global diagnostics
+    if enabled and diagnostics is None:
+        diagnostics = Diagnostics()
+        if 'key_window' in globals():
+            key_window.after(DIAG_PROBE_MS, probe_event_loop, diagnostics, time.monotonic() + DIAG_PROBE_MS / 1000)
+    elif not enabled:
+        diagnostics = None
+
+def probe_event_loop(owner, expected_at):
+    # How late this after() callback runs is the Tk event loop lag
+    if owner is not diagnostics:
+        return
+    now = time.monotonic()
+    owner.record("tk_lag", max(0.0, now - expected_at))
+    key_window.after(DIAG_PROBE_MS, probe_event_loop, owner, now + DIAG_PROBE_MS / 1000)
+
+def show_diagnostics(event=None):
+    # Not on any menu; Ctrl+Shift+D opens it
+    dialog = tk.Toplevel(key_window)
+    dialog.title("Diagnostics")
+    dialog.geometry("640x420")
+    enabled_var = tk.BooleanVar(value=diagnostics is not None)
+    text = tk.Text(dialog, font=("Courier", 9), state="disabled")
+    text.pack(fill="both", expand=True, padx=5, pady=5)
+    button_frame = tk.Frame(dialog)
+    button_frame.pack(pady=5)
+
+    def refresh():
+        if not dialog.winfo_exists():
+            return
+        lines = []
+        if diagnostics is None:
+            lines.append("Recording is off.")
+        else:
+            snapshot = diagnostics.snapshot()
+            lines.append(f"{'ms':<20}{'count':>8}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+            for name, summary in snapshot["histograms"].items():
+                lines.append(f"{name:<20}{summary['count']:>8}{summary['mean_ms']:>10.2f}{summary['p50_ms']:>10.2f}{summary['p90_ms']:>10.2f}{summary['p99_ms']:>10.2f}{summary['max_ms']:>10.2f}")
+            process = snapshot["process"]
+            lines.append("")
+            lines.append(f"CPU {process['cpu_percent']:.1f}%  RSS {process['rss_bytes'] / 1048576:.1f} MB" if process else "CPU and memory need psutil")
+            lines.append(f"Recording for {snapshot['seconds']:.0f} s")
+        text.config(state="normal")
+        text.delete(1.0, tk.END)
+        text.insert(tk.END, "\n".join(lines))
+        text.config(state="disabled")
+        dialog.after(DIAG_REFRESH_MS, refresh)
+
+    def reset():
+        if diagnostics is not None:
+            set_diagnostics(False)
+            set_diagnostics(True)
+
+    def export():
+        if diagnostics is None:
+            messagebox.showinfo("Info", "Recording is off.", parent=dialog)
+            return
+        filename = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON Files", "*.json"), ("All Files", "*.*")], title="Export Diagnostics", parent=dialog)
+        if filename:
+            try:
+                with open(filename, "w") as f:
+                    json.dump(diagnostics.snapshot(), f, indent=2)
+            except OSError as e:
+                messagebox.showerror("Error", f"Failed to export diagnostics: {e}", parent=dialog)
+
+    tk.Checkbutton(button_frame, text="Record", variable=enabled_var, command=lambda: set_diagnostics(enabled_var.get())).pack(side="left", padx=5)
+    tk.Button(button_frame, text="Reset", command=reset).pack(side="left", padx=5)
+    tk.Button(button_frame, text="Export JSON", command=export).pack(side="left", padx=5)
+    tk.Button(button_frame, text="Close", command=dialog.destroy).pack(side="left", padx=5)
+    refresh()
+
+@functools.lru_cache(maxsize=1024)
+def frequency_to_band(frequency):
+    return frequency_hz_to_band(parse_frequency_hz(frequency))
+
+@functools.lru_cache(maxsize=1024)
+def frequency_hz_to_band(frequency_hz):
+    freq_mhz = frequency_hz / 1_000_000
+    for low, high, band in BANDS:
+        if low <= freq_mhz <= high:
+            return band
+    return ""
+
+class RateMeter:
+    # QSO counts per UTC minute, plus for every minute that has a QSO the count in the hour
+    # starting there. The best hour always starts on such a minute, and a histogram of those
+    # sums keeps it current, so adding or removing a QSO touches at most 60 minutes and a
+    # refresh at most 60 buckets however long the contest has run.
+    def __init__(self):
+        self.minutes = {}
+        self.hour_sums = {}
+        self.sum_counts = {}
+        self.best = 0
+
+    @classmethod
+    def from_timestamps(cls, timestamps):
+        meter = cls()
+        meter.minutes = dict(collections.Counter(timestamp // 60 for timestamp in timestamps))
+        occupied = sorted(meter.minutes)
+        totals = list(itertools.accumulate((meter.minutes[minute] for minute in occupied), initial=0))
+        for i, minute in enumerate(occupied):
+            meter.set_sum(minute, totals[bisect.bisect_left(occupied, minute + 60)] - totals[i])
+        return meter
+
+    def set_sum(self, start, total):
+        old = self.hour_sums.get(start)
+        if old is not None:
+            if self.sum_counts[old] == 1:
+                del self.sum_counts[old]
+            else:
+                self.sum_counts[old] -= 1
+        if total:
+            self.hour_sums[start] = total
+            self.sum_counts[total] = self.sum_counts.get(total, 0) + 1
+            self.best = max(self.best, total)
+        else:
+            self.hour_sums.pop(start, None)
+
+    def window(self, start, length):
+        return sum(self.minutes.get(minute, 0) for minute in range(start, start + length))
+
+    def add(self, timestamp):
+        minute = timestamp // 60
+        count = self.minutes.get(minute, 0)
+        self.minutes[minute] = count + 1
+        for start in range(minute - 59, minute):
+            if start in self.hour_sums:
+                self.set_sum(start, self.hour_sums[start] + 1)
+        self.set_sum(minute, self.hour_sums[minute] + 1 if count else self.window(minute, 60))
+
+    def remove(self, timestamp):
+        minute = timestamp // 60
+        count = self.minutes.get(minute, 0)
+        if not count:
+            return
+        if count == 1:
+            del self.minutes[minute]
+            self.set_sum(minute, 0)
+        else:
+            self.minutes[minute] = count - 1
+            self.set_sum(minute, self.hour_sums[minute] - 1)
+        for start in range(minute - 59, minute):
+            if start in self.hour_sums:
+                self.set_sum(start, self.hour_sums[start] - 1)
+        # Every sum dropped by at most one, so the best can only fall by one
+        while self.best and self.best not in self.sum_counts:
+            self.best -= 1
+
+    def rates(self, now):
+        # (last 10 minutes, last 60 minutes, hourly rate projected from the last 10, best 60)
+        minute = int(now) // 60
+        last_10 = self.window(minute - 9, 10)
+        return last_10, self.window(minute - 59, 60), last_10 * 6, self.best
+
+def wpx_prefix(callsign):
+    parts = [part for part in callsign.upper().split("/") if part and part not in WPX_SUFFIXES]
+    if not parts:
+        return ""
+    # The home call is taken to be the longest part, anything else is a portable designator
+    call = max(parts, key=len)
+    i = len(call)
+    while i and call[i - 1].isalpha():
+        i -= 1
+    prefix = call[:i] if i and call[i - 1].isdigit() else call[:2] + "0"
+    for designator in parts:
+        if designator is call:
+            continue
+        if designator.isdigit():
+            return prefix.rstrip("0123456789") + designator
+        return designator if any(c.isdigit() for c in designator) else designator + "0"
+    return prefix
+
+class ScoreEngine:
+    # Points and multipliers kept as running totals. Points come from new dupe keys, and
+    # every multiplier keeps a count of the QSOs giving it, so an edit or delete is just
+    # the reverse delta and "is this a new mult?" is one dict lookup.
+    def __init__(self, rules, home=None):
+        self.rules = rules
+        # Our own (country, continent, CQ zone, ITU zone), which the point tables score against
+        self.home = home
+        self.points = 0
+        self.mult_counts = {}
+        # With a point table: what each QSO of a dupe key is worth, the key scoring its best one
+        self.key_points = {}
+        # QSOs a point table could not score because their entity is unknown
+        self.unknown = 0
+
+    def multipliers(self, callsign, band, exchange, cty):
+        kind = self.rules["multiplier"]
+        if kind == "prefix":
+            value = wpx_prefix(callsign)
+        elif kind == "exchange":
+            value = exchange.strip().upper()
+        elif kind == "section":
+            value = exchange.split()[-1].upper() if exchange.split() else ""
+        else:
+            value = ""
+        scope = band if self.rules["per_band"] else ""
+        mults = [(scope, value)] if value else []
+        if self.rules.get("country") and cty:
+            mults.append((scope, cty[0]))
+        return mults
+
+    def qso_points(self, qso, band):
+        table = self.rules["points"]
+        if table.__class__ is int:
+            return table
+        if self.home is None or qso.cty is None:
+            return None
+        country, continent, _, itu_zone = qso.cty
+        home_country, home_continent, _, home_itu_zone = self.home
+        if table == "iaru":
+            exchange = qso.exchange_received.strip()
+            if exchange and not exchange.isdigit():
+                return 1  # HQ stations and IARU officials send their society instead of a zone
+            if (int(exchange) if exchange else itu_zone) == home_itu_zone:
+                return 1
+            return 3 if continent == home_continent else 5
+        if table == "cqww":
+            if country == home_country:
+                return 0
+            if continent != home_continent:
+                return 3
+            return 2 if continent == "NA" else 1
+        # CQ WPX: double points on the low bands, except within one's own country
+        if country == home_country:
+            return 1
+        if continent != home_continent:
+            points = 3
+        else:
+            points = 2 if continent == "NA" else 1
+        return points * 2 if band in LOW_BANDS else points
+
+    def add(self, qso, key, new_key):
+        points = self.qso_points(qso, key[1])
+        if self.rules["points"].__class__ is int:
+            if new_key:
+                self.points += points
+        else:
+            if points is None:
+                self.unknown += 1
+                points = 0
+            earned = self.key_points.setdefault(key, [])
+            best = max(earned, default=0)
+            earned.append(points)
+            self.points += max(best, points) - best
+        for mult in self.multipliers(qso.callsign, key[1], qso.exchange_received, qso.cty):
+            self.mult_counts[mult] = self.mult_counts.get(mult, 0) + 1
+
+    def remove(self, qso, key, last_key):
+        points = self.qso_points(qso, key[1])
+        if self.rules["points"].__class__ is int:
+            if last_key:
+                self.points -= points
+        else:
+            if points is None:
+                self.unknown -= 1
+                points = 0
+            earned = self.key_points[key]
+            best = max(earned)
+            earned.remove(points)
+            if earned:
+                self.points += max(earned) - best
+            else:
+                del self.key_points[key]
+                self.points -= best
+        for mult in self.multipliers(qso.callsign, key[1], qso.exchange_received, qso.cty):
+            count = self.mult_counts.get(mult, 0) - 1
+            if count > 0:
+                self.mult_counts[mult] = count
+            else:
+                self.mult_counts.pop(mult, None)
+
+    def is_new_multiplier(self, callsign, band, exchange):
+        cty = cty_lookup(callsign) if self.rules.get("country") else None
+        for mult in self.multipliers(callsign, band, exchange, cty):
+            if mult not in self.mult_counts:
+                return True, mult
+        return False, None
+
+    def exact(self):
+        # A point table needs cty.dat entities for us and for every QSO
+        return self.rules["points"].__class__ is int or (self.home is not None and not self.unknown)
+
+    def score(self):
+        mults = len(self.mult_counts)
+        return self.points, mults, self.points * mults if self.rules["multiplier"] else self.points
+
+def home_cty():
+    callsign = my_station["callsign"].strip()
+    return cty_lookup(callsign) if callsign else None
+
+def build_score():
+    global score_engine
+    engine = ScoreEngine(CONTEST_RULES.get(contest_config["rules"], CONTEST_RULES["Generic"]), home_cty())
+    seen = set()
+    for qso in qso_list:
+        key = dupe_key(qso)
+        engine.add(qso, key, key not in seen)
+        seen.add(key)
+    score_engine = engine
+
+def refresh_score_home():
+    # Our entity is only known once cty.dat has loaded, and changes with My Station
+    if score_engine.home != home_cty():
+        build_score()
+
+def dupe_key(qso):
+    return (qso.callsign, frequency_hz_to_band(qso.frequency_hz), qso.mode)
+
+def index_qso(qso):
+    key = dupe_key(qso)
+    count = dupe_index.get(key, 0)
+    dupe_index[key] = count + 1
+    update_log_fuzzy(key[0], True)
+    rate_meter.add(qso.timestamp)
+    score_engine.add(qso, key, count == 0)
+
+def unindex_qso(qso):
+    key = dupe_key(qso)
+    count = dupe_index.get(key, 0) - 1
+    if count > 0:
+        dupe_index[key] = count
+    else:
+        dupe_index.pop(key, None)
+    update_log_fuzzy(key[0], False)
+    rate_meter.remove(qso.timestamp)
+    score_engine.remove(qso, key, count <= 0)
+
+def update_log_fuzzy(call, add):
+    with log_fuzzy_lock:
+        if log_fuzzy_pending is not None:
+            log_fuzzy_pending.append((call, add))
+        elif add:
+            log_fuzzy.add(call)
+        else:
+            log_fuzzy.remove(call)
+
+def build_log_indexes():
+    global log_fuzzy, log_fuzzy_pending, rate_meter
+    dupe_index.clear()
+    calls = []
+    for qso in qso_list:
+        key = dupe_key(qso)
+        dupe_index[key] = dupe_index.get(key, 0) + 1
+        calls.append(key[0])
+    rate_meter = RateMeter.from_timestamps(qso.timestamp for qso in qso_list)
+    build_score()
+    # The N+1 index takes seconds for a big log, so it is built in the background and any
+    # change made meanwhile is queued, the same way compact_journal handles new journal lines
+    with log_fuzzy_lock:
+        log_fuzzy = None
+        log_fuzzy_pending = []
+        threading.Thread(target=build_log_fuzzy, args=(calls, log_fuzzy_pending), daemon=True).start()
+
+def build_log_fuzzy(calls, pending):
+    global log_fuzzy, log_fuzzy_pending
+    index = FuzzyIndex.from_calls(calls)
+    with log_fuzzy_lock:
+        # A newer build (New Contest) has taken over
+        if pending is not log_fuzzy_pending:
+            return
+        for call, add in pending:
+            if add:
+                index.add(call)
+            else:
+                index.remove(call)
+        log_fuzzy = index
+        log_fuzzy_pending = None
+
+def is_dupe(callsign, band, mode="CW"):
+    return (callsign.upper(), band, mode) in dupe_index
+
+def dupe_station(callsign, band, mode="CW"):
+    # Only called for a dupe, so walking back from the newest QSO ends early
+    key = (callsign.upper(), band, mode)
+    for qso in reversed(qso_list):
+        if qso.callsign == key[0] and dupe_key(qso) == key:
+            return qso.station
+    return ""
+
+class ScpIndex:
+    # Super Check Partial: postings lists of call numbers for every 2 and 3 letter gram.
+    # A query walks the shortest postings list of its grams and checks those calls only.
+    MAGIC = b"SCPX1"
+
+    def __init__(self, calls, postings):
+        self.calls = calls
+        self.postings = postings
+
+    @classmethod
+    def build(cls, calls):
+        calls = sorted(set(calls))
+        grams = {}
+        for number, call in enumerate(calls):
+            seen = set()
+            for size in (2, 3):
+                for i in range(len(call) - size + 1):
+                    seen.add(call[i:i + size])
+            for gram in seen:
+                grams.setdefault(gram, []).append(number)
+        return cls(calls, {gram: array("I", numbers) for gram, numbers in grams.items()})
+
+    def search(self, fragment):
+        fragment = fragment.upper()
+        if len(fragment) < 2:
+            return []
+        if len(fragment) == 2:
+            numbers = self.postings.get(fragment, ())
+            return [self.calls[number] for number in numbers]
+        shortest = None
+        for i in range(len(fragment) - 2):
+            numbers = self.postings.get(fragment[i:i + 3])
+            if numbers is None:
+                return []
+            if shortest is None or len(numbers) < len(shortest):
+                shortest = numbers
+        calls = self.calls
+        return [calls[number] for number in shortest if fragment in calls[number]]
+
+    def save(self, path, source_hash):
+        # Layout: magic, source hash, call blob, then (gram, count, uint32 call numbers) per gram
+        blob = "\n".join(self.calls).encode("ascii", errors="ignore")
+        with open(path, "wb") as f:
+            f.write(self.MAGIC + source_hash)
+            f.write(struct.pack("<II", len(blob), len(self.postings)))
+            f.write(blob)
+            for gram, numbers in self.postings.items():
+                if sys.byteorder == "big":
+                    numbers = array("I", numbers)
+                    numbers.byteswap()
+                f.write(struct.pack("<B", len(gram)) + gram.encode("ascii", errors="ignore") + struct.pack("<I", len(numbers)))
+                f.write(numbers.tobytes())
+
+    @classmethod
+    def load(cls, path, source_hash):
+        with open(path, "rb") as f:
+            data = f.read()
+        header = cls.MAGIC + source_hash
+        if not data.startswith(header):
+            return None
+        pos = len(header)
+        blob_size, gram_count = struct.unpack_from("<II", data, pos)
+        pos += 8
+        calls = data[pos:pos + blob_size].decode("ascii").split("\n")
+        pos += blob_size
+        postings = {}
+        for _ in range(gram_count):
+            size = data[pos]
+            gram = data[pos + 1:pos + 1 + size].decode("ascii")
+            pos += 1 + size
+            count, = struct.unpack_from("<I", data, pos)
+            pos += 4
+            numbers = array("I")
+            numbers.frombytes(data[pos:pos + 4 * count])
+            if sys.byteorder == "big":
+                numbers.byteswap()
+            postings[gram] = numbers
+            pos += 4 * count
+        return cls(calls, postings)
+
+def cty_record(country, continent, cq_zone, itu_zone):
+    record = (sys.intern(country), sys.intern(continent), int(cq_zone), int(itu_zone))
+    return cty_records.setdefault(record, record)
+
+class CtyIndex:
+    # cty.dat compiled to a prefix trie. Edges live in one dict keyed node * 64 + character
+    # and each node holds the record of the longest prefix ending there, so a lookup is one
+    # dict probe per character of the call. "=CALL" entries are exact-call overrides.
+    MAGIC = b"CTYX1"
+
+    def __init__(self, records, exact, edges, values):
+        self.records = records
+        self.exact = exact
+        self.edges = edges
+        self.values = values
+
+    @classmethod
+    def build(cls, text):
+        records = []
+        record_numbers = {}
+        exact = {}
+        edges = {}
+        values = array("i", [-1])
+
+        def number(record):
+            if record not in record_numbers:
+                record_numbers[record] = len(records)
+                records.append(record)
+            return record_numbers[record]
+
+        for block in text.split(";"):
+            fields = block.split(":")
+            if len(fields) < 9:
+                continue
+            country, cq_zone, itu_zone, continent = (field.strip() for field in fields[:4])
+            for alias in fields[8].replace("\n", "").split(","):
+                alias = alias.strip()
+                if not alias:
+                    continue
+                cq = re.search(r"\((\d+)\)", alias)
+                itu = re.search(r"\[(\d+)\]", alias)
+                cont = re.search(r"\{(\w+)\}", alias)
+                record = number(cty_record(country, cont.group(1) if cont else continent, cq.group(1) if cq else cq_zone, itu.group(1) if itu else itu_zone))
+                call = re.split(r"[(\[<{~]", alias)[0].upper()
+                if call.startswith("="):
+                    exact[call[1:]] = record
+                    continue
+                node = 0
+                for char in call:
+                    key = node * 64 + ord(char) - 32
+                    child = edges.get(key)
+                    if child is None:
+                        child = len(values)
+                        edges[key] = child
+                        values.append(-1)
+                    node = child
+                values[node] = record
+        return cls(records, exact, edges, values)
+
+    def resolve(self, call):
+        record = self.exact.get(call)
+        if record is not None:
+            return self.records[record]
+        edges = self.edges
+        values = self.values
+        node = 0
+        best = -1
+        for char in call:
+            if not " " <= char <= "_":
+                break
+            node = edges.get(node * 64 + ord(char) - 32)
+            if node is None:
+                break
+            if values[node] >= 0:
+                best = values[node]
+        return self.records[best] if best >= 0 else None
+
+    def save(self, path, source_hash):
+        # Layout: magic, source hash, JSON of records and exact calls, then the edge keys,
+        # edge targets and node values as little-endian 32 bit arrays
+        tables = json.dumps({"records": self.records, "exact": self.exact}, separators=(",", ":")).encode("utf-8")
+        keys = array("I", self.edges.keys())
+        targets = array("I", self.edges.values())
+        values = array("i", self.values)
+        if sys.byteorder == "big":
+            for numbers in (keys, targets, values):
+                numbers.byteswap()
+        with open(path, "wb") as f:
+            f.write(self.MAGIC + source_hash)
+            f.write(struct.pack("<III", len(tables), len(keys), len(values)))
+            f.write(tables)
+            f.write(keys.tobytes())
+            f.write(targets.tobytes())
+            f.write(values.tobytes())
+
+    @classmethod
+    def load(cls, path, source_hash):
+        with open(path, "rb") as f:
+            data = f.read()
+        header = cls.MAGIC + source_hash
+        if not data.startswith(header):
+            return None
+        pos = len(header)
+        table_size, edge_count, node_count = struct.unpack_from("<III", data, pos)
+        pos += 12
+        tables = json.loads(data[pos:pos + table_size])
+        pos += table_size
+        arrays = []
+        for typecode, count in (("I", edge_count), ("I", edge_count), ("i", node_count)):
+            numbers = array(typecode)
+            numbers.frombytes(data[pos:pos + 4 * count])
+            if sys.byteorder == "big":
+                numbers.byteswap()
+            arrays.append(numbers)
+            pos += 4 * count
+        keys, targets, values = arrays
+        records = [cty_record(*record) for record in tables["records"]]
+        return cls(records, tables["exact"], dict(zip(keys, targets)), values)
+
+def load_cty(path):
+    global cty_index
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        source_hash = hashlib.sha1(data).digest()
+        cache_file = path + ".idx"
+        index = None
+        if os.path.exists(cache_file):
+            try:
+                index = CtyIndex.load(cache_file, source_hash)
+            except Exception:
+                index = None
+        if index is None:
+            index = CtyIndex.build(data.decode("latin-1"))
+            try:
+                index.save(cache_file, source_hash)
+            except OSError:
+                pass
+        cty_index = index
+    except OSError:
+        cty_index = None
+    cty_lookup.cache_clear()
+
+@functools.lru_cache(maxsize=CTY_LOOKUP_CACHE)
+def cty_lookup(callsign):
+    # Returns (country, continent, CQ zone, ITU zone) or None
+    if cty_index is None:
+        return None
+    call = callsign.strip().upper()
+    record = cty_index.exact.get(call)
+    if record is not None:
+        return cty_index.records[record]
+    parts = [part for part in call.split("/") if part]
+    if len(parts) > 1:
+        if "MM" in parts[1:]:
+            return None  # Maritime mobile has no entity
+        # A prefix such as PA/ or /KH6 decides the entity; /P, /QRP and call-area digits do not
+        home = max(parts, key=len)
+        designators = [part for part in parts if part is not home and part not in WPX_SUFFIXES and not part.isdigit()]
+        call = designators[0] if designators else home
+    return cty_index.resolve(call)
+
+def format_cty(record):
+    country, continent, cq_zone, itu_zone = record
+    return f"{country} ({continent})  CQ {cq_zone}  ITU {itu_zone}"
+
+def read_call_list(path):
+    calls = []
+    with open(path, "r", encoding="ascii", errors="ignore") as f:
+        for line in f:
+            call = line.strip().upper()
+            if call and not call.startswith("#"):
+                calls.append(call)
+    return calls
+
+def load_scp(path):
+    global scp_index
+    try:
+        with open(path, "rb") as f:
+            source_hash = hashlib.sha1(f.read()).digest()
+        cache_file = path + ".idx"
+        index = None
+        if os.path.exists(cache_file):
+            try:
+                index = ScpIndex.load(cache_file, source_hash)
+            except Exception:
+                index = None
+        if index is None:
+            index = ScpIndex.build(read_call_list(path))
+            try:
+                index.save(cache_file, source_hash)
+            except OSError:
+                pass
+        scp_index = index
+    except OSError:
+        scp_index = None
+    build_reference_fuzzy()
+
+def deletion_variants(word, distance):
+    # Each step only deletes at or after the previous position, so no variant is built twice
+    variants = {word}
+    frontier = [(word, 0)]
+    for _ in range(distance):
+        frontier = [(w[:i] + w[i + 1:], i) for w, start in frontier for i in range(start, len(w))]
+        variants.update(variant for variant, _ in frontier)
+    return variants
+
+def edit_distance(a, b, limit):
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+class FuzzyIndex:
+    # Symmetric deletion index: two calls within edit distance d share a variant made by
+    # deleting at most d characters from each, so a lookup is a handful of dict hits plus
+    # an exact distance check on the candidates.
+    def __init__(self, max_distance=2):
+        self.max_distance = max_distance
+        self.counts = {}
+        self.variants = {}
+
+    @classmethod
+    def from_calls(cls, calls, max_distance=2):
+        index = cls(max_distance)
+        for call in calls:
+            index.add(call)
+        return index
+
+    def add(self, call):
+        count = self.counts.get(call, 0)
+        self.counts[call] = count + 1
+        if count:
+            return
+        variants = self.variants
+        for variant in deletion_variants(call, self.max_distance):
+            # Most variants belong to a single call, so keep a bare string until a second one arrives
+            calls = variants.get(variant)
+            if calls is None:
+                variants[variant] = call
+            elif type(calls) is str:
+                variants[variant] = [calls, call]
+            else:
+                calls.append(call)
+
+    def remove(self, call):
+        count = self.counts.get(call, 0)
+        if count > 1:
+            self.counts[call] = count - 1
+            return
+        if not count:
+            return
+        del self.counts[call]
+        variants = self.variants
+        for variant in deletion_variants(call, self.max_distance):
+            calls = variants.get(variant)
+            if calls == call:
+                del variants[variant]
+            elif type(calls) is list:
+                calls.remove(call)
+                if len(calls) == 1:
+                    variants[variant] = calls[0]
+
+    def search(self, call, distance):
+        distance = min(distance, self.max_distance)
+        candidates = set()
+        for variant in deletion_variants(call, distance):
+            calls = self.variants.get(variant)
+            if calls is None:
+                continue
+            if type(calls) is str:
+                candidates.add(calls)
+            else:
+                candidates.update(calls)
+        candidates.discard(call)
+        matches = []
+        for candidate in candidates:
+            d = edit_distance(call, candidate, distance)
+            if d <= distance:
+                matches.append((d, candidate))
+        return matches
+
+def busted_call_suggestions(callsign, limit=NPLUS1_MAX_SHOWN):
+    callsign = callsign.upper()
+    if len(callsign) < 3:
+        return []
+    # Short calls sit within two edits of far too many others to be useful
+    distance = 1 if len(callsign) < 5 else 2
+    matches = dict((call, d) for d, call in log_fuzzy.search(callsign, distance))
+    if reference_fuzzy and contest_config["nplus1_use_scp"]:
+        for d, call in reference_fuzzy.search(callsign, distance):
+            matches.setdefault(call, d)
+    return sorted(matches, key=lambda call: (matches[call], call not in log_fuzzy.counts, call))[:limit]
+
+def build_reference_fuzzy():
+    global reference_fuzzy
+    if scp_index and contest_config["nplus1_use_scp"]:
+        reference_fuzzy = FuzzyIndex.from_calls(scp_index.calls)
+
 def format_output(callsign, rst, received_exchange, mycall):
-    formatted_rst = "5NN" if use_5nn.get() and rst == "599" else rst
+    formatted_rst = "5NN" if keyer_options["use_5nn"] and rst == "599" else rst
     formatted_received_exchange = received_exchange
-    if shorten_zeros.get() and received_exchange.isdigit():
+    if keyer_options["shorten_zeros"] and received_exchange.isdigit():
         formatted_received_exchange = received_exchange.replace("0", "T")
     formatted_exchange = str(serial_number) if contest_config["use_serial_exchange"] else contest_config["exchange"]
     formatted_serial = str(serial_number)
     # Adjust serial number format for "Shorten 0 to T" when less than 100 QSOs
-    if shorten_zeros.get() and contest_config["use_serial_exchange"]:
+    if keyer_options["shorten_zeros"] and contest_config["use_serial_exchange"]:
         if len(qso_list) < 100:
             formatted_serial = f"{serial_number:03d}".replace("0", "T")
         else:
             formatted_serial = str(serial_number).replace("0", "T")
     return callsign, formatted_rst, formatted_received_exchange, mycall, formatted_exchange, formatted_serial
 
-def send_to_serial(message):
-    global ser, serial_number, speed_var
+def compile_macro(text):
+    # Turns "CQ {mycall} K" into ("CQ ", None), ("mycall", True), (" K", None): literals are
+    # upper-cased here once, fields are looked up when the macro is sent
+    tokens = []
+    try:
+        parts = list(string.Formatter().parse(text))
+    except ValueError as e:
+        raise ValueError(f"Unbalanced braces: {e}")
+    for literal, field, format_spec, conversion in parts:
+        if literal:
+            tokens.append((literal.upper(), None))
+        if field is None:
+            continue
+        if field not in MACRO_FIELDS:
+            raise ValueError(f"Unknown placeholder {{{field}}}. Valid placeholders: {', '.join('{' + name + '}' for name in MACRO_FIELDS)}")
+        if format_spec or conversion:
+            raise ValueError(f"Placeholder {{{field}}} cannot have a format or conversion")
+        tokens.append((field, True))
+    return tuple(tokens)
+
+def compile_all_macros():
+    compiled_macros.clear()
+    for f_key, text in macros.items():
+        try:
+            compiled_macros[f_key] = compile_macro(text)
+        except ValueError:
+            compiled_macros[f_key] = None
+
+def entry_values():
+    callsign = callsign_var.get().strip() if callsign_var else ""
+    rst = snt_var.get().strip() if snt_var else "599"
+    received_exchange = exchange_var.get().strip() if exchange_var else ""
+    return callsign, rst, received_exchange
+
+def macro_values(callsign, rst, received_exchange):
+    mycall = my_station["callsign"]
+
+    callsign, rst, received_exchange, mycall, exchange, serial = format_output(callsign, rst, received_exchange, mycall)
+    frequency = current_frequency()
+    khz = parse_frequency_hz(frequency) // 1000
+    return {
+        "callsign": callsign,
+        "rst": rst,
+        "exchange": exchange,
+        "mycall": mycall,
+        "serial": serial,
+        "rcvd": received_exchange,
+        "band": frequency_to_band(frequency),
+        "frequency": str(khz) if khz else "",
+        "name": my_station["name"],
+        "lastcall": qso_list[-1].callsign if qso_list else ""
+    }
+
+def expand_macro(tokens, values):
+    return "".join(values[text].upper() if is_field else text for text, is_field in tokens)
+
+TU_MACRO = compile_macro("TU")
+
+# Keyer service: nothing below reads Tk, so the window and the headless runner share it
+def transmit(message, pressed=None):
+    # Queues one line for the MM-3 and returns the estimated time to send it
+    if not serial_engine.send(message.encode('ascii') + b'\n', pressed):
+        raise queue.Full
+    return calculate_cw_duration(message, keyer_options["speed"])
+
+def mm3_command(command, terminator="*C709"):
+    data = b"\x03\n" + command.upper().encode('ascii') + b'\n'
+    if terminator:
+        data += terminator.encode('ascii') + b'\n'
+    return serial_engine.send(data)
+
+def set_keyer_speed(speed):
+    if not 1 <= speed <= 99:
+        raise ValueError(f"Speed must be between 1 and 99 WPM, not {speed}")
+    if not mm3_command(f"*6{speed:02d}"):
+        return False
+    keyer_options["speed"] = speed
+    return True
+
+def open_keyer_port(port_name):
+    global ser, serial_engine
+    ser = serial.Serial(
+        port=port_name,
+        baudrate=1200,
+        bytesize=serial.EIGHTBITS,
+        parity=serial.PARITY_NONE,
+        stopbits=serial.STOPBITS_ONE,
+        timeout=1
+    )
+    serial_engine = SerialEngine(ser)
+
+def open_replay_port(filename, speed):
+    global ser, serial_engine
+    ser = ReplayPort(filename, speed)
+    serial_engine = SerialEngine(ser)
+
+def start_serial_capture(filename):
+    global serial_capture
+    stop_serial_capture()
+    serial_capture = SerialCapture(filename)
+
+def stop_serial_capture():
+    global serial_capture
+    capture, serial_capture = serial_capture, None
+    if capture:
+        capture.close()
+    return capture
+
+def send_to_serial(tokens):
+    global ser
+    pressed = time.monotonic() if diagnostics else None
     if ser is None or not ser.is_open:
         messagebox.showerror("Error", "Serial port not connected. Please restart and select a port.")
         if 'key_window' in globals():
@@ -151,41 +1545,34 @@ def send_to_serial(message):
             show_port_selection()
         return 0
     
-    callsign = callsign_var.get().strip() if callsign_var else ""
-    rst = snt_var.get().strip() if snt_var else "599"
-    received_exchange = exchange_var.get().strip() if exchange_var else ""
-    mycall = my_station["callsign"]
-    
-    callsign, rst, received_exchange, mycall, exchange, serial = format_output(callsign, rst, received_exchange, mycall)
-    formatted_message = message.format(
-        callsign=callsign,
-        rst=rst,
-        exchange=exchange,
-        mycall=mycall,
-        serial=serial
-    ).upper()
+    formatted_message = expand_macro(tokens, macro_values(*entry_values()))
     try:
-        ser.write(formatted_message.encode('ascii') + b'\n')
-        time.sleep(0.1)
-        ser.reset_input_buffer()
-        wpm = int(speed_var.get()) if speed_var else 25
-        duration = calculate_cw_duration(formatted_message, wpm)
+        duration = transmit(formatted_message, pressed)
+        if diagnostics:
+            diagnostics.record("send_to_serial", time.monotonic() - pressed)
         return duration
-    except serial.SerialException as e:
-        messagebox.showerror("Error", f"Failed to send: {e}")
-        ser.close()
-        ser = None
-        if 'key_window' in globals():
-            key_window.destroy()
-            show_port_selection()
+    except queue.Full:
+        messagebox.showwarning("Warning", "Transmit queue is full, message not sent.")
         return 0
-    except ValueError as e:
-        messagebox.showerror("Error", f"Invalid WPM value: {speed_var.get() if speed_var else 'N/A'}: {e}")
+    except UnicodeEncodeError as e:
+        messagebox.showerror("Error", f"Message contains characters the keyer cannot send: {e}")
         return 0
     except Exception as e:
         messagebox.showerror("Error", f"Unexpected error: {e}")
         return 0
 
+def handle_serial_error(error):
+    global ser
+    messagebox.showerror("Error", f"Failed to send: {error}")
+    if serial_engine:
+        serial_engine.stop()
+    if ser is not None:
+        ser.close()
+        ser = None
+    if 'key_window' in globals():
+        key_window.destroy()
+        show_port_selection()
+
 def show_port_selection():
     root = tk.Tk()
     root.title("ZS6WAR AEA MM-3 Morse Machine Contest Keyer - v.0.4 Setup")
@@ -197,6 +1584,7 @@ def show_port_selection():
         pass  # Silently ignore icon errors
 
     def load_serial_ports():
+        import serial.tools.list_ports
         ports = [port.device for port in serial.tools.list_ports.comports()]
         if not ports:
             messagebox.showerror("Error", "No serial ports found!")
@@ -206,21 +1594,13 @@ def show_port_selection():
         return ports
 
     def select_port():
-        global ser
         selected_port = port_var.get()
         if selected_port == "No ports available":
             messagebox.showwarning("Warning", "Please connect a serial device!")
             return
         
         try:
-            ser = serial.Serial(
-                port=selected_port,
-                baudrate=1200,
-                bytesize=serial.EIGHTBITS,
-                parity=serial.PARITY_NONE,
-                stopbits=serial.STOPBITS_ONE,
-                timeout=1
-            )
+            open_keyer_port(selected_port)
             messagebox.showinfo("Success", f"Connected to {selected_port} (8N1, 1200 baud)")
             root.destroy()
             show_function_key_window()
@@ -236,103 +1616,873 @@ def show_port_selection():
     select_button = tk.Button(root, text="Select Port", command=select_port)
     select_button.pack(pady=10)
 
+    root.after_idle(mark_startup, "port dialog shown")
     root.mainloop()
 
-def get_omnirig_data():
-    while True:
+def format_frequency(frequency_hz):
+    return f"{frequency_hz / 1_000_000:.6f} MHz" if frequency_hz > 0 else "N/A"
+
+def publish_frequency(frequency_hz):
+    global rig_frequency
+    # Always refresh the timestamp so log_qso can tell how fresh the reading is, but only
+    # queue a UI update when the frequency actually moved
+    changed = frequency_hz != rig_frequency[0]
+    rig_frequency = (frequency_hz, time.monotonic())
+    if changed:
+        frequency_queue.put(format_frequency(frequency_hz))
+
+def current_frequency():
+    frequency_hz, read_at = rig_frequency
+    if frequency_hz > 0 and time.monotonic() - read_at <= RIG_STALE_AFTER:
+        return format_frequency(frequency_hz)
+    return frequency_var.get().strip() if frequency_var else "N/A"
+
+class RigBackend:
+    # Common poll bookkeeping; subclasses only implement connect(), read() and close()
+    name = "None"
+
+    def __init__(self):
+        self.polls = 0
+        self.errors = 0
+        self.last_latency = 0.0
+        self.total_latency = 0.0
+        self.connected_at = time.monotonic()
+        self.mode = ""
+
+    def connect(self):
+        self.connected_at = time.monotonic()
+        self.polls = 0
+        self.total_latency = 0.0
+
+    def close(self):
+        pass
+
+    def read(self):
+        raise NotImplementedError
+
+    def poll(self):
+        start = time.perf_counter()
         try:
-            pythoncom.CoInitialize()
-            omnirig = win32com.client.Dispatch("OmniRig.OmniRigX")
-            time.sleep(2)
-            
-            rig = omnirig.Rig1
-            status = rig.StatusStr if hasattr(rig, "StatusStr") else "Unknown"
-            
-            if status.lower() == "on-line":
+            frequency_hz, self.mode = self.read()
+        except Exception:
+            self.errors += 1
+            raise
+        self.last_latency = time.perf_counter() - start
+        self.total_latency += self.last_latency
+        self.polls += 1
+        return frequency_hz
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.connected_at, 1e-9)
+        return {
+            "backend": self.name,
+            "polls": self.polls,
+            "errors": self.errors,
+            "last_latency_ms": self.last_latency * 1000,
+            "mean_latency_ms": self.total_latency / self.polls * 1000 if self.polls else 0.0,
+            "polls_per_second": self.polls / elapsed
+        }
+
+class OmniRigBackend(RigBackend):
+    name = "OmniRig"
+
+    def connect(self):
+        # Imported here so the keyer still starts on machines without pywin32
+        import pythoncom
+        import win32com.client
+        self.pythoncom = pythoncom
+        pythoncom.CoInitialize()
+        try:
+            self.omnirig = win32com.client.Dispatch("OmniRig.OmniRigX")
+        except Exception:
+            # close() is only called for a connected backend, so balance the init here
+            pythoncom.CoUninitialize()
+            raise
+        super().connect()
+
+    def read(self):
+        rig = self.omnirig.Rig1
+        status = rig.StatusStr if hasattr(rig, "StatusStr") else "Unknown"
+        if status.lower() != "on-line":
+            return 0, ""
+        return max(0, int(rig.GetRxFrequency())), OMNIRIG_MODES.get(rig.Mode, "")
+
+    def close(self):
+        self.omnirig = None
+        self.pythoncom.CoUninitialize()
+
+class RigctldBackend(RigBackend):
+    # Hamlib rigctld over one persistent TCP connection, with the f and m queries sent together
+    name = "rigctld"
+
+    def __init__(self, host="localhost", port=4532):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.reply = None
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=RIGCTLD_TIMEOUT)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reply = self.sock.makefile("rb")
+        super().connect()
+
+    def reply_line(self):
+        line = self.reply.readline()
+        if not line:
+            raise ConnectionError("rigctld closed the connection")
+        line = line.strip().decode("ascii", errors="ignore")
+        if line.startswith("RPRT"):
+            raise ConnectionError(f"rigctld error {line[5:]}")
+        return line
+
+    def read(self):
+        self.sock.sendall(b"f\nm\n")
+        frequency_hz = int(float(self.reply_line()))
+        mode = self.reply_line()
+        self.reply_line()  # Passband
+        return frequency_hz, mode
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.reply.close()
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.reply = None
+
+class FakeRig(RigBackend):
+    name = "Fake"
+
+    def __init__(self, frequency_hz=14025000, mode="CW"):
+        super().__init__()
+        self.frequency_hz = frequency_hz
+        self.fake_mode = mode
+
+    def set_frequency(self, frequency_hz):
+        self.frequency_hz = frequency_hz
+
+    def read(self):
+        return self.frequency_hz, self.fake_mode
+
+def create_rig_backend(config):
+    if config["backend"] == "rigctld":
+        return RigctldBackend(config["host"], int(config["port"]))
+    if config["backend"] == "Fake":
+        return FakeRig()
+    return OmniRigBackend()
+
+def start_rig_polling():
+    global rig_backend
+    backend = create_rig_backend(rig_config)
+    rig_backend = backend
+    threading.Thread(target=get_rig_data, args=(backend,), daemon=True).start()
+
+def get_rig_data(backend):
+    # One session for the life of the backend, polled quickly; dropped and re-opened with
+    # a growing back-off if the rig goes away. Exits when another backend replaces it.
+    connected = False
+    backoff = RIG_RETRY_MIN
+    while backend is rig_backend:
+        try:
+            if not connected:
+                backend.connect()
+                connected = True
+            publish_frequency(backend.poll())
+            backoff = RIG_RETRY_MIN
+            time.sleep(RIG_POLL_INTERVAL)
+        except Exception:
+            if connected:
                 try:
-                    rx_freq_hz = rig.GetRxFrequency()
-                    if rx_freq_hz > 0:
-                        freq_mhz = rx_freq_hz / 1_000_000
-                        frequency_str = f"{freq_mhz:.6f} MHz"
-                    else:
-                        frequency_str = "N/A"
+                    backend.close()
                 except Exception:
-                    frequency_str = "N/A"
-            else:
-                frequency_str = "N/A"
-            
-            frequency_queue.put(frequency_str)
-            pythoncom.CoUninitialize()
-        
+                    pass
+                connected = False
+            publish_frequency(0)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, RIG_RETRY_MAX)
+    if connected:
+        try:
+            backend.close()
         except Exception:
-            frequency_queue.put("N/A")
-            pythoncom.CoUninitialize()
-        
-        time.sleep(1)
+            pass
 
 def update_frequency():
+    if diagnostics and rig_frequency[0] > 0:
+        diagnostics.record("rig_poll_age", time.monotonic() - rig_frequency[1])
+    try:
+        while not frequency_queue.empty():
+            frequency_str = frequency_queue.get_nowait()
+            frequency_var.set(frequency_str)
+    except queue.Empty:
+        pass
+    key_window.after(FREQUENCY_POLL_MS, update_frequency)
+
+def morse_units(code):
+    # Dits are 1 unit, dahs 3, with a 1 unit gap between elements
+    return sum(1 if element == "." else 3 for element in code) + len(code) - 1
+
+CHARACTER_UNITS = {char: morse_units(code) for char, code in MORSE_CODE.items()}
+PROSIGN_UNITS = {prosign: morse_units(code) for prosign, code in PROSIGNS.items()}
+
+def split_cw_words(message):
+    words = []
+    for word in message.upper().split():
+        characters = []
+        i = 0
+        while i < len(word):
+            if word[i] == "<":
+                end = word.find(">", i)
+                if end != -1 and word[i:end + 1] in PROSIGN_UNITS:
+                    characters.append(PROSIGN_UNITS[word[i:end + 1]])
+                    i = end + 1
+                    continue
+            units = CHARACTER_UNITS.get(word[i])
+            if units is not None:
+                characters.append(units)
+            i += 1
+        if characters:
+            words.append(characters)
+    return words
+
+@functools.lru_cache(maxsize=512)
+def cw_timing(message, wpm, farnsworth_wpm=0):
+    dit_time = 1.2 / wpm
+    words = split_cw_words(message)
+    mark_units = sum(sum(word) for word in words)
+    char_gaps = sum(len(word) - 1 for word in words)
+    word_gaps = max(0, len(words) - 1)
+    if farnsworth_wpm and farnsworth_wpm < wpm:
+        # ARRL Farnsworth timing: characters at full speed, the spacing stretched to the slower rate
+        spacing_unit = (60 * wpm - 37.2 * farnsworth_wpm) / (farnsworth_wpm * wpm) / 19
+        return mark_units * dit_time + (char_gaps * 3 + word_gaps * 7) * spacing_unit
+    return (mark_units + char_gaps * 3 + word_gaps * 7) * dit_time
+
+def calculate_cw_duration(message, wpm):
+    duration = cw_timing(message, wpm, cw_timing_config["farnsworth_wpm"])
+    return duration * cw_timing_config["scale"] + cw_timing_config["offset"]
+
+def fit_cw_calibration(samples):
+    # Least squares fit of measured = scale * estimate + offset, or None without enough echoes
+    n = len(samples)
+    if n < CW_CALIBRATION_MIN_SAMPLES:
+        return None
+    mean_estimate = sum(estimate for estimate, _ in samples) / n
+    mean_measured = sum(measured for _, measured in samples) / n
+    variance = sum((estimate - mean_estimate) ** 2 for estimate, _ in samples)
+    if variance == 0:
+        return 1.0, mean_measured - mean_estimate
+    scale = sum((estimate - mean_estimate) * (measured - mean_measured) for estimate, measured in samples) / variance
+    return scale, mean_measured - scale * mean_estimate
+
+def cw_calibration_plausible(scale, offset):
+    return CW_CALIBRATION_SCALE_RANGE[0] <= scale <= CW_CALIBRATION_SCALE_RANGE[1] and abs(offset) <= CW_CALIBRATION_MAX_OFFSET
+
+# Log service: every change to the log goes through these so the indexes and the journal
+# stay in step whichever front end made it
+def allocate_serial():
+    global serial_number
+    with serial_lock:
+        serial = serial_number
+        serial_number = log_sync.next_serial() if log_sync else serial + 1
+    return serial
+
+def local_serial_range(serial):
+    return SYNC_LOCAL_SERIAL_BASE <= serial < SYNC_LOCAL_SERIAL_END
+
+def record_qso(callsign, rst_sent, rst_received, exchange_received, frequency):
+    global next_qso_id
+    serial = allocate_serial()
+    exchange_sent = str(serial) if contest_config["use_serial_exchange"] else contest_config["exchange"]
+    qso = Qso(next_qso_id, serial, int(time.time()), callsign, rst_sent, rst_received, exchange_sent, exchange_received, parse_frequency_hz(frequency), "CW", cty_lookup(callsign), log_sync.station if log_sync else "")
+    if log_sync:
+        # The master numbers it and sends it back to every station, this one included
+        log_sync.submit([{"op": "add", "qso": qso.to_dict()}])
+        return qso
+    qso_list.append(qso)
+    index_qso(qso)
+    next_qso_id += 1
+    write_journal({"op": "add", "qso": qso.to_dict()})
+    return qso
+
+def remove_qso(qso_id):
+    index = find_qso_index(qso_id)
+    if index is None:
+        return None
+    if log_sync:
+        log_sync.submit([{"op": "delete", "id": qso_id}])
+        return qso_list[index]
+    qso = qso_list.pop(index)
+    unindex_qso(qso)
+    write_journal({"op": "delete", "id": qso_id})
+    return qso
+
+def replace_qso(edited):
+    index = find_qso_index(edited.id)
+    if index is None:
+        return False
+    if log_sync:
+        log_sync.submit([{"op": "edit", "qso": edited.to_dict()}])
+        return True
+    unindex_qso(qso_list[index])
+    qso_list[index] = edited
+    index_qso(edited)
+    write_journal({"op": "edit", "qso": edited.to_dict()})
+    return True
+
+def clear_log():
+    global qso_list, serial_number
+    if log_sync:
+        log_sync.submit([{"op": "clear"}])
+        return
+    qso_list = []
+    with serial_lock:
+        serial_number = 1
+    build_log_indexes()
+    write_journal({"op": "clear"})
+
+# Log sync for multi-op: one station runs a SyncHub and every station, the master included,
+# talks to it with a LogSync. Changes are journal records; the hub numbers them and sends
+# them to all stations in the same order, and each station applies them on its UI thread.
+# Lines are JSON, one message each:
+#   station -> hub  {"type": "hello", "station", "session", "seq", "slot"}  {"type": "op", "uid", "station", "record"}  {"type": "serial"}
+#   hub -> station  {"type": "welcome", "session", "seq", "reset", "slot"}  {"type": "op", "seq", "uid", "station", "record"}  {"type": "serial", "serial"}
+# Serials are only ever handed out by the hub. A station that is offline numbers from its own
+# block in the local serial range instead; the slot picking the block is granted by the hub.
+class SyncHub:
+    def __init__(self, port, qsos, next_id, next_serial):
+        self.session = os.urandom(8).hex()
+        # Sent lines are kept so a station joining late, or coming back, only gets what it missed
+        self.history = [journal_line({"type": "op", "seq": seq, "uid": None, "station": qso.station, "record": {"op": "add", "qso": qso.to_dict()}}) for seq, qso in enumerate(qsos, 1)]
+        self.next_id = next_id
+        # QSOs logged offline in a local block do not move the shared count on
+        self.next_serial = max([1] + [qso.serial + 1 for qso in qsos if not local_serial_range(qso.serial)] + ([] if local_serial_range(next_serial - 1) else [next_serial]))
+        self.slots = {}
+        self.seen = set()
+        self.clients = []
+        self.lock = threading.Lock()
+        self.server = socket.create_server(("", port))
+
+    def start(self):
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def stop(self):
+        # shutdown() wakes the accept() still waiting in the other thread, close() alone does not
+        try:
+            self.server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.server.close()
+        with self.lock:
+            for outgoing in self.clients:
+                outgoing.put(None)
+            self.clients = []
+
+    def accept(self):
+        while True:
+            try:
+                conn, address = self.server.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+
+    def serve(self, conn):
+        # A writer thread per station, so one stuck station cannot hold up the others
+        outgoing = queue.Queue()
+        threading.Thread(target=self.write, args=(conn, outgoing), daemon=True).start()
+        try:
+            for line in conn.makefile("r", encoding="utf-8"):
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                kind = message.get("type")
+                if kind == "hello":
+                    self.welcome(outgoing, message)
+                elif kind == "op":
+                    self.publish(message)
+                elif kind == "serial":
+                    with self.lock:
+                        serial = self.take_serial()
+                    outgoing.put(journal_line({"type": "serial", "serial": serial}))
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.lock:
+                if outgoing in self.clients:
+                    self.clients.remove(outgoing)
+            outgoing.put(None)
+
+    def write(self, conn, outgoing):
+        try:
+            while True:
+                lines = [outgoing.get()]
+                while not outgoing.empty():
+                    lines.append(outgoing.get_nowait())
+                if None in lines:
+                    return
+                conn.sendall("".join(lines).encode("utf-8"))
+        except OSError:
+            pass
+        finally:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            conn.close()
+
+    def take_serial(self):
+        # Called under self.lock
+        if local_serial_range(self.next_serial):
+            self.next_serial = SYNC_LOCAL_SERIAL_END
+        serial = self.next_serial
+        self.next_serial += 1
+        return serial
+
+    def assign_slot(self, station, wanted):
+        # Called under self.lock. A station keeps its slot; a new one gets the slot it asks for if free
+        if station in self.slots:
+            return self.slots[station]
+        taken = set(self.slots.values())
+        free = [slot for slot in range(SYNC_LOCAL_SLOTS) if slot not in taken]
+        if not free:
+            return wanted  # More stations than blocks, the best left is the station's own choice
+        slot = wanted if wanted in free else free[0]
+        self.slots[station] = slot
+        return slot
+
+    def welcome(self, outgoing, message):
+        with self.lock:
+            seq = message.get("seq", 0)
+            reset = message.get("session") != self.session or not 0 <= seq <= len(self.history)
+            start = 0 if reset else seq
+            slot = self.assign_slot(message.get("station", ""), message.get("slot"))
+            outgoing.put(journal_line({"type": "welcome", "session": self.session, "seq": len(self.history), "reset": reset, "slot": slot}))
+            if start < len(self.history):
+                outgoing.put("".join(self.history[start:]))
+            self.clients.append(outgoing)
+
+    def publish(self, message):
+        with self.lock:
+            # A station resends what it has not seen come back after a reconnect
+            uid = message.get("uid")
+            if uid in self.seen:
+                return
+            self.seen.add(uid)
+            record = message["record"]
+            if record["op"] == "add":
+                record["qso"]["id"] = self.next_id
+                self.next_id += 1
+                serial = record["qso"].get("serial", 0)
+                if not local_serial_range(serial):
+                    self.next_serial = max(self.next_serial, serial + 1)
+            elif record["op"] == "clear":
+                self.next_serial = 1
+            line = journal_line({"type": "op", "seq": len(self.history) + 1, "uid": uid, "station": message.get("station", ""), "record": record})
+            self.history.append(line)
+            for outgoing in self.clients:
+                outgoing.put(line)
+
+class LogSync:
+    def __init__(self, host, port, station, session="", seq=0, slot=None):
+        self.host = host
+        self.port = port
+        self.station = station
+        self.session = session
+        self.seq = seq
+        self.applied_seq = seq
+        # Filled by the reader thread ahead of time, so logging a QSO never waits for the hub
+        self.spares = collections.deque()
+        self.spares_lock = threading.Lock()
+        # The serial in the entry fields has to come from the hub too; until it has, it is a local one
+        self.take_current = True
+        self.slot = slot if slot is not None else int(hashlib.md5(station.encode("utf-8")).hexdigest(), 16) % SYNC_LOCAL_SLOTS
+        self.sock = None
+        self.send_lock = threading.Lock()
+        # Sent by the writer thread, so a slow or stuck hub cannot block the UI thread
+        self.outgoing = queue.Queue()
+        self.running = True
+        self.status = "connecting"
+        self.uid_prefix = f"{station}-{os.urandom(4).hex()}"
+        self.uid_counter = itertools.count(1)
+        # Changes not yet seen back from the hub, kept on disk so a crash or a dropped link loses nothing
+        self.outbox = {}
+        if os.path.exists(SYNC_OUTBOX_FILE):
+            try:
+                with open(SYNC_OUTBOX_FILE, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            message = json.loads(line)
+                        except ValueError:
+                            continue
+                        self.outbox[message["uid"]] = message
+            except OSError:
+                pass
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        threading.Thread(target=self.write, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        self.outgoing.put(None)
+        with self.send_lock:
+            if self.sock is not None:
+                try:
+                    self.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def run(self):
+        delay = SYNC_RETRY_MIN
+        while self.running:
+            sock = None
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=SYNC_CONNECT_TIMEOUT)
+                sock.settimeout(None)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                with self.send_lock:
+                    hello = {"type": "hello", "station": self.station, "session": self.session, "seq": self.seq, "slot": self.slot}
+                    sock.sendall((journal_line(hello) + "".join(journal_line(message) for message in self.outbox.values())).encode("utf-8"))
+                    self.sock = sock
+                self.status = "connected"
+                delay = SYNC_RETRY_MIN
+                for line in sock.makefile("r", encoding="utf-8"):
+                    self.receive(json.loads(line))
+            except (OSError, ValueError):
+                pass
+            finally:
+                with self.send_lock:
+                    self.sock = None
+                if sock is not None:
+                    sock.close()
+            if self.running:
+                self.status = f"offline, retrying ({len(self.outbox)} waiting)"
+                time.sleep(delay)
+                delay = min(delay * 2, SYNC_RETRY_MAX)
+
+    def receive(self, message):
+        kind = message.get("type")
+        if kind == "welcome":
+            if message["reset"]:
+                self.seq = 0
+            self.session = message["session"]
+            if message.get("slot") is not None:
+                self.slot = message["slot"]
+            sync_events.put(("welcome", message))
+        elif kind == "op":
+            self.seq = message["seq"]
+            sync_events.put(("op", message))
+            if message["uid"] in self.outbox:
+                with self.send_lock:
+                    self.outbox.pop(message["uid"], None)
+                    if not self.outbox:
+                        self.save_outbox()
+        elif kind == "serial":
+            with self.spares_lock:
+                self.spares.append(message["serial"])
+            sync_events.put(("serial", message["serial"]))
+
+    def save_outbox(self):
+        try:
+            with open(SYNC_OUTBOX_FILE, "w", encoding="utf-8") as f:
+                f.writelines(journal_line(message) for message in self.outbox.values())
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError:
+            pass
+
+    def send(self, lines):
+        # Dropped while offline: the outbox is resent and serials renewed after the next welcome
+        if self.sock is not None:
+            self.outgoing.put(lines)
+
+    def write(self):
+        while True:
+            lines = [self.outgoing.get()]
+            while not self.outgoing.empty():
+                lines.append(self.outgoing.get_nowait())
+            if None in lines:
+                return
+            with self.send_lock:
+                sock = self.sock
+            if sock is None:
+                continue
+            try:
+                sock.sendall("".join(lines).encode("utf-8"))
+            except OSError:
+                pass  # The reader sees the link drop and reconnects
+
+    def submit(self, records):
+        messages = [{"type": "op", "uid": f"{self.uid_prefix}-{next(self.uid_counter)}", "station": self.station, "record": record} for record in records]
+        lines = "".join(journal_line(message) for message in messages)
+        with self.send_lock:
+            for message in messages:
+                self.outbox[message["uid"]] = message
+            self.send(lines)
+            try:
+                with open(SYNC_OUTBOX_FILE, "a", encoding="utf-8") as f:
+                    f.write(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError:
+                pass
+
+    def request_serials(self, count):
+        with self.send_lock:
+            self.send(journal_line({"type": "serial"}) * count)
+
+    def take_spare(self):
+        with self.spares_lock:
+            return self.spares.popleft() if self.spares else None
+
+    def next_serial(self):
+        # Called under serial_lock, on the UI thread, so it never waits for the hub: a spare from
+        # the hub, or with none left (offline, or logging faster than the hub answers) one from
+        # this station's block. Either way another spare is asked for.
+        self.request_serials(1)
+        serial = self.take_spare()
+        return serial if serial is not None else self.local_serial()
+
+    def in_block(self, serial):
+        base = SYNC_LOCAL_SERIAL_BASE + self.slot * SYNC_LOCAL_SERIAL_BLOCK
+        return base <= serial < base + SYNC_LOCAL_SERIAL_BLOCK
+
+    def local_serial(self):
+        # One past the highest serial in this station's block, counting QSOs still in the outbox
+        # and the serial being handed out, which is not logged yet
+        with self.send_lock:
+            pending = [message["record"]["qso"].get("serial", 0) for message in self.outbox.values() if message["record"]["op"] in ("add", "edit")]
+        used = [serial for serial in itertools.chain((qso.serial for qso in qso_list), pending, (serial_number,)) if self.in_block(serial)]
+        return max(used, default=SYNC_LOCAL_SERIAL_BASE + self.slot * SYNC_LOCAL_SERIAL_BLOCK) + 1
+
+    def renew_serials(self):
+        with self.spares_lock:
+            self.spares.clear()
+        self.take_current = True
+        self.request_serials(SYNC_SERIAL_PREFETCH + 1)
+
+def apply_sync_record(record):
+    # Stations can be sent a change twice after a reconnect, so adds replace and
+    # edits or deletes of a QSO that is gone are ignored
+    global qso_list, next_qso_id
+    op = record["op"]
+    if op in ("add", "edit"):
+        qso = Qso.from_dict(record["qso"])
+        index = find_qso_index(qso.id)
+        if index is not None:
+            unindex_qso(qso_list[index])
+            qso_list[index] = qso
+        elif op == "edit":
+            return False
+        else:
+            bisect.insort(qso_list, qso, key=lambda qso: qso.id)
+            next_qso_id = max(next_qso_id, qso.id + 1)
+        index_qso(qso)
+    elif op == "delete":
+        index = find_qso_index(record["id"])
+        if index is None:
+            return False
+        unindex_qso(qso_list.pop(index))
+    elif op == "clear":
+        qso_list = []
+        build_log_indexes()
+    return True
+
+def process_sync_events(event=None, applied=None):
+    # Runs on the UI thread, so the log only ever changes there; journal lines for the whole
+    # batch share one fsync. Returns whether the log changed, and adds the op messages that
+    # changed it to applied if given
+    global serial_number
+    records = []
     try:
-        while not frequency_queue.empty():
-            frequency_str = frequency_queue.get_nowait()
-            frequency_var.set(frequency_str)
+        while True:
+            kind, value = event or sync_events.get_nowait()
+            event = None
+            if log_sync is None:
+                continue
+            if kind == "welcome":
+                if value["reset"]:
+                    # Joining a different log: this station's copy is replaced by the master's
+                    apply_sync_record({"op": "clear"})
+                    records.append({"op": "clear"})
+                    log_sync.applied_seq = 0
+                if value["reset"] or log_sync.take_current:
+                    log_sync.renew_serials()
+                else:
+                    # Requests made while offline were never sent
+                    log_sync.request_serials(max(0, SYNC_SERIAL_PREFETCH - len(log_sync.spares)))
+                with serial_lock:
+                    # The hub can grant another block than the one this station started in
+                    if local_serial_range(serial_number) and not log_sync.in_block(serial_number):
+                        serial_number = log_sync.local_serial()
+            elif kind == "op":
+                record = value["record"]
+                if apply_sync_record(record):
+                    records.append(record)
+                    if applied is not None:
+                        applied.append(value)
+                log_sync.applied_seq = value["seq"]
+                if record["op"] == "clear":
+                    log_sync.renew_serials()
+            elif kind == "serial":
+                # The reader thread has already put it with the spares
+                with serial_lock:
+                    if log_sync.take_current:
+                        serial = log_sync.take_spare()
+                        if serial is not None:
+                            serial_number = serial
+                            log_sync.take_current = False
     except queue.Empty:
         pass
-    key_window.after(100, update_frequency)
+    write_journal_batch(records)
+    return bool(records)
 
-def calculate_cw_duration(message, wpm):
-    dit_time = 1200 / wpm / 1000
-    morse_units = {
-        'A': 6, 'B': 10, 'C': 10, 'D': 8, 'E': 2, 'F': 8, 'G': 10, 'H': 6,
-        'I': 4, 'J': 12, 'K': 10, 'L': 8, 'M': 10, 'N': 6, 'O': 12, 'P': 10,
-        'Q': 12, 'R': 6, 'S': 4, 'T': 4, 'U': 6, 'V': 8, 'W': 8, 'X': 10,
-        'Y': 12, 'Z': 10, '0': 14, '1': 12, '2': 10, '3': 8, '4': 6, '5': 4,
-        '6': 6, '7': 8, '8': 10, '9': 12, ' ': 7
-    }
-    total_units = sum(morse_units.get(char.upper(), 3) for char in message)
-    total_units += (len(message) - 1) * 1
-    return total_units * dit_time + 2
+def start_log_sync():
+    global log_sync, sync_hub, serial_number
+    stop_log_sync()
+    role = sync_config["role"]
+    if role == "Off":
+        return
+    port = int(sync_config["port"])
+    if role == "Master":
+        sync_hub = SyncHub(port, qso_list, next_qso_id, serial_number)
+        sync_hub.start()
+        host, session, seq = "127.0.0.1", sync_hub.session, len(sync_hub.history)
+    else:
+        settings = settings_cache or {}
+        host, session, seq = sync_config["host"], settings.get("sync_session", ""), settings.get("sync_seq", 0)
+    log_sync = LogSync(host, port, sync_config["station"], session, seq, (settings_cache or {}).get("sync_slot"))
+    # Until the hub sends one, the serial in the entry fields is from this station's block
+    with serial_lock:
+        serial_number = log_sync.local_serial()
+    log_sync.start()
+
+def stop_log_sync():
+    global log_sync, sync_hub, serial_number
+    if log_sync is not None:
+        log_sync.stop()
+        log_sync = None
+        with serial_lock:
+            if local_serial_range(serial_number):
+                # Back on its own, the station carries on from the shared count, not its offline block
+                serial_number = max([1] + [qso.serial + 1 for qso in qso_list if not local_serial_range(qso.serial)])
+    if sync_hub is not None:
+        sync_hub.stop()
+        sync_hub = None
+    while not sync_events.empty():
+        sync_events.get_nowait()
 
 def log_qso(event=None):
-    global serial_number, log_tree
+    started = time.monotonic() if diagnostics else None
     callsign = callsign_var.get().strip()
     snt = snt_var.get().strip()
     rcv = rcv_var.get().strip()
     exchange_received = exchange_var.get().strip()
-    frequency = frequency_var.get().strip()
     
     if not callsign or not exchange_received:
         messagebox.showwarning("Warning", "Callsign and Exchange are required to log a QSO!")
         return
     
-    exchange_sent = str(serial_number) if contest_config["use_serial_exchange"] else contest_config["exchange"]
+    record_qso(callsign, snt, rcv, exchange_received, current_frequency())
     
-    qso = {
-        "serial": serial_number,
-        "datetime": datetime.now(UTC).strftime("%Y-%m-%d %H:%M:%S"),
-        "callsign": callsign.upper(),
-        "rst_sent": snt,
-        "rst_received": rcv,
-        "exchange_sent": exchange_sent,
-        "exchange_received": exchange_received,
-        "frequency": frequency.split()[0],
-        "mode": "CW"
-    }
-    qso_list.append(qso)
-    
-    if log_tree:
-        log_tree.insert("", "end", values=(len(qso_list), qso["datetime"], qso["callsign"], qso["rst_sent"], qso["rst_received"], qso["exchange_sent"], qso["exchange_received"], qso["frequency"], qso["mode"]))
-        log_tree.yview_moveto(1)
+    if log_view:
+        log_view.scroll_to_end()
     
     if contest_config["send_tu_on_log"]:
-        send_to_serial("TU")
+        send_to_serial(TU_MACRO)
     
-    serial_number += 1
     callsign_var.set("")
     exchange_var.set("")
     callsign_entry.focus_set()
+    if diagnostics and started:
+        diagnostics.record("log_qso", time.monotonic() - started)
+
+class LogView:
+    # Only the rows that fit in the window exist in the Treeview, each keyed by its QSO id,
+    # and the "Nr" column is worked out from the list position when a row is drawn
+    def __init__(self, parent):
+        self.top = 0
+        self.rows = 20
+        self.tree = ttk.Treeview(parent, columns=LOG_COLUMNS, show="headings", height=self.rows)
+        for col, text in zip(LOG_COLUMNS, LOG_HEADINGS):
+            self.tree.heading(col, text=text)
+            self.tree.column(col, width=90, anchor="center")
+        self.scrollbar = ttk.Scrollbar(parent, orient="vertical", command=self.yview)
+        self.tree.bind("<Configure>", self.on_configure)
+        self.tree.bind("<MouseWheel>", lambda event: self.yview("scroll", -event.delta // 120, "units"))
+        self.tree.bind("<Button-4>", lambda event: self.yview("scroll", -1, "units"))
+        self.tree.bind("<Button-5>", lambda event: self.yview("scroll", 1, "units"))
+
+    def on_configure(self, event):
+        try:
+            row_height = int(ttk.Style().lookup("Treeview", "rowheight"))
+        except (ValueError, tk.TclError):
+            row_height = 20
+        rows = max(1, (event.height - row_height) // row_height)
+        if rows != self.rows:
+            at_end = self.top + self.rows >= len(qso_list)
+            self.rows = rows
+            if at_end:
+                self.top = len(qso_list)
+            self.render()
+
+    def yview(self, *args):
+        if args[0] == "moveto":
+            self.top = int(float(args[1]) * len(qso_list))
+        elif args[0] == "scroll":
+            amount = int(args[1])
+            if args[2] == "pages":
+                amount *= self.rows
+            self.top += amount
+        self.render()
+
+    def scroll_to_end(self):
+        self.top = len(qso_list)
+        self.render()
+
+    def render(self):
+        total = len(qso_list)
+        self.top = max(0, min(self.top, total - self.rows))
+        selection = self.tree.selection()
+        self.tree.delete(*self.tree.get_children())
+        for nr, qso in enumerate(qso_list[self.top:self.top + self.rows], self.top + 1):
+            self.tree.insert("", "end", iid=str(qso.id), values=qso_row(nr, qso))
+        self.tree.selection_set([item for item in selection if self.tree.exists(item)])
+        if total:
+            self.scrollbar.set(self.top / total, min(1.0, (self.top + self.rows) / total))
+        else:
+            self.scrollbar.set(0, 1)
+
+    def update_qso(self, qso):
+        item = str(qso.id)
+        if self.tree.exists(item):
+            nr = self.tree.set(item, "Nr")
+            self.tree.item(item, values=qso_row(nr, qso))
+
+    def selected_qso(self):
+        selection = self.tree.selection()
+        if not selection:
+            return None
+        index = find_qso_index(int(selection[0]))
+        return None if index is None else qso_list[index]
+
+def qso_row(nr, qso):
+    return (nr, format_timestamp(qso.timestamp), qso.callsign, qso.rst_sent, qso.rst_received, qso.exchange_sent, qso.exchange_received, frequency_text(qso.frequency_hz), qso.mode)
+
+def find_qso_index(qso_id):
+    # IDs are handed out in logging order, so the list stays sorted by id
+    index = bisect.bisect_left(qso_list, qso_id, key=lambda qso: qso.id)
+    if index < len(qso_list) and qso_list[index].id == qso_id:
+        return index
+    return None
 
 def show_qso_window():
-    global log_tree
+    global log_view
     qso_window = tk.Toplevel(key_window)
     qso_window.title("Logged QSOs")
     settings = load_settings()
@@ -341,32 +2491,15 @@ def show_qso_window():
     tree_frame = tk.Frame(qso_window)
     tree_frame.pack(fill="both", expand=True)
     
-    tree = ttk.Treeview(tree_frame, columns=("Nr", "DateTime", "Callsign", "RST Sent", "RST Rcvd", "Exch Sent", "Exch Rcvd", "Freq", "Mode"), show="headings")
-    tree.heading("Nr", text="Nr")
-    tree.heading("DateTime", text="Date/Time (UTC)")
-    tree.heading("Callsign", text="Callsign")
-    tree.heading("RST Sent", text="RST Sent")
-    tree.heading("RST Rcvd", text="RST Rcvd")
-    tree.heading("Exch Sent", text="Exch Sent")
-    tree.heading("Exch Rcvd", text="Exch Rcvd")
-    tree.heading("Freq", text="Freq")
-    tree.heading("Mode", text="Mode")
-    
-    for col in tree["columns"]:
-        tree.column(col, width=90, anchor="center")
-    
-    scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=tree.yview)
-    tree.configure(yscrollcommand=scrollbar.set)
-    
+    view = LogView(tree_frame)
+    tree = view.tree
     tree.pack(side="left", fill="both", expand=True)
-    scrollbar.pack(side="right", fill="y")
-    
-    for i, qso in enumerate(qso_list, 1):
-        tree.insert("", "end", values=(i, qso["datetime"], qso["callsign"], qso["rst_sent"], qso["rst_received"], qso["exchange_sent"], qso["exchange_received"], qso["frequency"], qso["mode"]))
+    view.scrollbar.pack(side="right", fill="y")
+    view.scroll_to_end()
     
     context_menu = tk.Menu(tree, tearoff=0)
-    context_menu.add_command(label="Delete", command=lambda: delete_qso(tree))
-    context_menu.add_command(label="Edit", command=lambda: edit_qso(tree))
+    context_menu.add_command(label="Delete", command=lambda: delete_qso(view))
+    context_menu.add_command(label="Edit", command=lambda: edit_qso(view))
 
     def show_context_menu(event):
         if tree.identify_row(event.y):
@@ -375,40 +2508,26 @@ def show_qso_window():
 
     tree.bind("<Button-3>", show_context_menu)
 
-    log_tree = tree
+    log_view = view
     return qso_window
 
-def delete_qso(tree):
-    selected_item = tree.selection()
-    if not selected_item:
+def delete_qso(view):
+    qso = view.selected_qso()
+    if qso is None:
         messagebox.showwarning("Warning", "No QSO selected!")
         return
     
     if messagebox.askyesno("Confirm Delete", "Are you sure you want to delete this QSO?"):
-        serial = int(tree.item(selected_item, "values")[0])
-        global qso_list
-        qso_list.pop(serial - 1)
-        tree.delete(*tree.get_children())
-        for i, qso in enumerate(qso_list, 1):
-            tree.insert("", "end", values=(i, qso["datetime"], qso["callsign"], qso["rst_sent"], qso["rst_received"], qso["exchange_sent"], qso["exchange_received"], qso["frequency"], qso["mode"]))
-
-def edit_qso(tree):
-    selected_item = tree.selection()
-    if not selected_item:
+        if remove_qso(qso.id) is not None:
+            view.render()
+
+def edit_qso(view):
+    qso = view.selected_qso()
+    if qso is None:
         messagebox.showwarning("Warning", "No QSO selected!")
         return
-    
-    try:
-        qso_values = tree.item(selected_item, "values")
-        qso_number = int(qso_values[0])
-        qso_index = qso_number - 1
-        qso = qso_list[qso_index]
-    except IndexError as e:
-        messagebox.showerror("Error", f"QSO index out of range: {e}")
-        return
-    except ValueError as e:
-        messagebox.showerror("Error", f"Invalid QSO number: {e}")
-        return
+    qso_number = find_qso_index(qso.id) + 1
+    values = qso.to_dict()
 
     dialog = tk.Toplevel(key_window)
     dialog.title(f"Edit QSO #{qso_number}")
@@ -431,25 +2550,28 @@ def edit_qso(tree):
     for i, (label, key) in enumerate(fields):
         tk.Label(dialog, text=f"{label}:").grid(row=i, column=0, padx=5, pady=5, sticky="e")
         entry = tk.Entry(dialog, width=30)
-        entry.insert(0, qso[key])
+        entry.insert(0, values[key])
         entry.grid(row=i, column=1, padx=5, pady=5)
         entries[key] = entry
 
     def save_changes():
-        nonlocal qso
         try:
+            edited = dict(values)
             for key, entry in entries.items():
-                qso[key] = entry.get()
-            datetime_str = qso["datetime"]
+                edited[key] = entry.get()
+            datetime_str = edited["datetime"]
             datetime.strptime(datetime_str, "%Y-%m-%d %H:%M:%S")
-            qso_list[qso_index] = qso
-            tree.delete(*tree.get_children())
-            for i, qso_item in enumerate(qso_list, 1):
-                tree.insert("", "end", values=(i, qso_item["datetime"], qso_item["callsign"], 
-                                              qso_item["rst_sent"], qso_item["rst_received"], 
-                                              qso_item["exchange_sent"], qso_item["exchange_received"], 
-                                              qso_item["frequency"], qso_item["mode"]))
-            tree.yview_moveto(1)
+            if edited["frequency"].strip().upper() not in ("", "N/A") and not parse_frequency_hz(edited["frequency"]):
+                messagebox.showerror("Error", f"Invalid frequency '{edited['frequency']}'. Use MHz, e.g. 14.025, or N/A.", parent=dialog)
+                return
+            edited = Qso.from_dict(edited)
+            if edited.callsign != qso.callsign:
+                edited.cty = cty_lookup(edited.callsign)
+            if not replace_qso(edited):
+                messagebox.showerror("Error", f"QSO #{qso_number} no longer exists.")
+                dialog.destroy()
+                return
+            view.update_qso(edited)
             messagebox.showinfo("Updated", f"QSO #{qso_number} updated.")
             dialog.destroy()
         except ValueError as e:
@@ -460,82 +2582,766 @@ def edit_qso(tree):
     tk.Button(dialog, text="Save", command=save_changes).grid(row=len(fields), column=0, columnspan=2, pady=10)
     tk.Button(dialog, text="Cancel", command=dialog.destroy).grid(row=len(fields)+1, column=0, columnspan=2, pady=5)
 
-def export_to_adif():
-    if not qso_list:
-        messagebox.showinfo("Info", "No QSOs to export!")
+def parse_adif(f, chunk_size=ADIF_CHUNK_SIZE):
+    # Streams (record, bytes_read) pairs. Values are cut by their declared length rather than
+    # by searching for the next tag, and only the unparsed tail of each chunk is kept.
+    buffer = bytearray()
+    pos = 0
+    bytes_read = 0
+    record = {}
+    eof = False
+    while True:
+        start = buffer.find(b"<", pos)
+        end = -1 if start == -1 else buffer.find(b">", start)
+        if end != -1:
+            name, _, spec = bytes(buffer[start + 1:end]).partition(b":")
+            try:
+                length = int(spec.split(b":")[0]) if spec else 0
+            except ValueError:
+                length = 0
+            value_end = end + 1 + length
+            if value_end <= len(buffer):
+                name = name.strip().upper()
+                if name == b"EOR":
+                    if record:
+                        yield record, bytes_read
+                    record = {}
+                elif name == b"EOH":
+                    record = {}
+                elif name:
+                    record[name.decode("ascii", errors="ignore")] = buffer[end + 1:value_end].decode("utf-8", errors="replace")
+                pos = value_end
+                continue
+        if eof:
+            return
+        del buffer[:len(buffer) if start == -1 else start]
+        pos = 0
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+        bytes_read += len(chunk)
+        buffer += chunk
+
+def adif_to_qso(record):
+    callsign = record.get("CALL", "").strip().upper()
+    date = record.get("QSO_DATE", "").strip()
+    time_on = (record.get("TIME_ON", "").strip() + "0000")[:6]
+    if not callsign or len(date) != 8 or not (date + time_on).isdigit():
+        return None
+    exchange_sent = (record.get("STX_STRING") or record.get("STX", "")).strip()
+    try:
+        timestamp = parse_timestamp(f"{date[:4]}-{date[4:6]}-{date[6:]} {time_on[:2]}:{time_on[2:4]}:{time_on[4:]}")
+    except ValueError:
+        return None
+    return Qso(
+        0,
+        int(exchange_sent) if exchange_sent.isdigit() else 0,
+        timestamp,
+        callsign,
+        record.get("RST_SENT", "").strip(),
+        record.get("RST_RCVD", "").strip(),
+        exchange_sent,
+        (record.get("SRX_STRING") or record.get("SRX", "")).strip(),
+        parse_frequency_hz(record.get("FREQ", "")),
+        record.get("MODE", "CW").strip().upper() or "CW",
+        adif_cty(record) or cty_lookup(callsign)
+    )
+
+def adif_cty(record):
+    try:
+        return cty_record(record["COUNTRY"].strip(), record.get("CONT", "").strip().upper(), record.get("CQZ", "0").strip() or 0, record.get("ITUZ", "0").strip() or 0) if record.get("COUNTRY", "").strip() else None
+    except ValueError:
+        return None
+
+def read_adif_file(filename, batches, cancel):
+    try:
+        total = max(os.path.getsize(filename), 1)
+        batch = []
+        with open(filename, "rb") as f:
+            for record, bytes_read in parse_adif(f):
+                if cancel.is_set():
+                    break
+                qso = adif_to_qso(record)
+                if qso:
+                    batch.append(qso)
+                if len(batch) >= ADIF_BATCH_SIZE:
+                    batches.put(("batch", batch, bytes_read / total))
+                    batch = []
+        if batch:
+            batches.put(("batch", batch, 1.0))
+        batches.put(("done", None, 1.0))
+    except Exception as e:
+        batches.put(("error", str(e), 0.0))
+
+def import_key(qso):
+    return (qso.callsign, qso.timestamp, frequency_hz_to_band(qso.frequency_hz), qso.mode)
+
+def add_qsos(qsos):
+    # Bulk version of the log_qso bookkeeping: one journal write and fsync for the whole batch
+    global next_qso_id, serial_number
+    if log_sync:
+        log_sync.submit([{"op": "add", "qso": qso.to_dict()} for qso in qsos])
         return
-    
-    filename = filedialog.asksaveasfilename(defaultextension=".adi", filetypes=[("ADIF Files", "*.adi"), ("All Files", "*.*")], title="Export to ADIF")
+    records = []
+    for qso in qsos:
+        qso.id = next_qso_id
+        next_qso_id += 1
+        qso_list.append(qso)
+        index_qso(qso)
+        with serial_lock:
+            serial_number = max(serial_number, qso.serial + 1)
+        records.append({"op": "add", "qso": qso.to_dict()})
+    write_journal_batch(records)
+
+def import_adif():
+    filename = filedialog.askopenfilename(filetypes=[("ADIF Files", "*.adi *.adif"), ("All Files", "*.*")], title="Import ADIF")
     if not filename:
         return
-    
-    with open(filename, "w") as f:
-        f.write("Generated by ZS6WAR AEA MM-3 Morse Machine Contest Keyer - v.0.4\n<EOH>\n")
-        for qso in qso_list:
-            f.write(f"<QSO_DATE:8>{qso['datetime'][:10].replace('-', '')}\n")
-            f.write(f"<TIME_ON:6>{qso['datetime'][11:].replace(':', '')}\n")
-            f.write(f"<CALL:{len(qso['callsign'])}>{qso['callsign']}\n")
-            f.write(f"<RST_SENT:{len(qso['rst_sent'])}>{qso['rst_sent']}\n")
-            f.write(f"<RST_RCVD:{len(qso['rst_received'])}>{qso['rst_received']}\n")
-            f.write(f"<STX:{len(qso['exchange_sent'])}>{qso['exchange_sent']}\n")
-            f.write(f"<SRX:{len(qso['exchange_received'])}>{qso['exchange_received']}\n")
-            f.write(f"<FREQ:{len(qso['frequency'])}>{qso['frequency']}\n")
-            f.write("<MODE:2>CW\n")
-            f.write("<EOR>\n")
-    messagebox.showinfo("Success", f"Exported to {filename}")
 
-def export_to_cabrillo():
+    dialog = tk.Toplevel(key_window)
+    dialog.title("Import ADIF")
+    dialog.geometry("360x140")
+    dialog.transient(key_window)
+    status_label = tk.Label(dialog, text=f"Reading {os.path.basename(filename)}...")
+    status_label.pack(pady=10)
+    progress = ttk.Progressbar(dialog, length=300, maximum=100, mode="determinate")
+    progress.pack(pady=5)
+    cancel = threading.Event()
+    cancel_button = tk.Button(dialog, text="Cancel", command=cancel.set)
+    cancel_button.pack(pady=10)
+    dialog.protocol("WM_DELETE_WINDOW", cancel.set)
+
+    batches = queue.Queue(maxsize=ADIF_QUEUE_SIZE)
+    seen = {import_key(qso) for qso in qso_list}
+    counts = {"added": 0, "skipped": 0}
+    # QSOs read but not in the log yet, and how far through the file the reader was
+    pending = collections.deque()
+    state = {"fraction": 0.0}
+    threading.Thread(target=read_adif_file, args=(filename, batches, cancel), daemon=True).start()
+
+    def apply_batches():
+        # Work in short slices so the main window keeps running during a long import. A
+        # reader batch takes too long to index in one go, so it goes in ADIF_APPLY_SIZE at a time.
+        deadline = time.monotonic() + ADIF_SLICE_SECONDS
+        while time.monotonic() < deadline:
+            if cancel.is_set():
+                pending.clear()
+            if pending:
+                new_qsos = []
+                for _ in range(min(ADIF_APPLY_SIZE, len(pending))):
+                    qso = pending.popleft()
+                    key = import_key(qso)
+                    if key in seen:
+                        counts["skipped"] += 1
+                    else:
+                        seen.add(key)
+                        new_qsos.append(qso)
+                if new_qsos:
+                    add_qsos(new_qsos)
+                    counts["added"] += len(new_qsos)
+                continue
+            try:
+                kind, batch, fraction = batches.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "batch":
+                pending.extend(batch)
+                state["fraction"] = fraction
+                continue
+            if log_view:
+                log_view.scroll_to_end()
+            dialog.destroy()
+            if kind == "error":
+                messagebox.showerror("Error", f"ADIF import stopped after {counts['added']} QSOs: {batch}")
+            else:
+                messagebox.showinfo("Import ADIF", f"Imported {counts['added']} QSOs from {filename}" + (f"\nSkipped {counts['skipped']} duplicates" if counts["skipped"] else "") + ("\nImport was cancelled" if cancel.is_set() else ""))
+            return
+        progress["value"] = state["fraction"] * 100
+        status_label.config(text=f"Imported {counts['added']} QSOs, skipped {counts['skipped']} already in the log")
+        dialog.after(ADIF_POLL_MS, apply_batches)
+
+    apply_batches()
+
+def adif_field(name, value):
+    # ADIF lengths count bytes of the file, which is written as UTF-8
+    return f"<{name}:{len(value) if value.isascii() else len(value.encode('utf-8'))}>{value}\n"
+
+def export_row(qso):
+    # Same order as EXPORT_FIELDS
+    return (qso.serial, format_timestamp(qso.timestamp), qso.callsign, qso.rst_sent, qso.rst_received, qso.exchange_sent, qso.exchange_received, frequency_text(qso.frequency_hz), qso.mode)
+
+class AdifFormatter:
+    name = "ADIF"
+    filetypes = [("ADIF Files", "*.adi"), ("All Files", "*.*")]
+    extension = ".adi"
+    newline = None
+
+    def header(self):
+        return "Generated by ZS6WAR AEA MM-3 Morse Machine Contest Keyer - v.0.4\n<EOH>\n"
+
+    def render(self, qsos):
+        parts = []
+        for qso in qsos:
+            day, seconds = divmod(qso.timestamp, 86400)
+            parts.append(f"<QSO_DATE:8>{utc_date(day, '')}\n<TIME_ON:6>{seconds // 3600:02d}{seconds // 60 % 60:02d}{seconds % 60:02d}\n")
+            parts.append(adif_field("CALL", qso.callsign))
+            parts.append(adif_field("RST_SENT", qso.rst_sent))
+            parts.append(adif_field("RST_RCVD", qso.rst_received))
+            parts.append(adif_field("STX", qso.exchange_sent))
+            parts.append(adif_field("SRX", qso.exchange_received))
+            # No frequency means the rig was offline when the QSO was logged; leave FREQ out
+            if qso.frequency_hz >= 1000:
+                parts.append(adif_field("FREQ", frequency_text(qso.frequency_hz)))
+            parts.append(adif_field("MODE", qso.mode))
+            if qso.cty:
+                country, continent, cq_zone, itu_zone = qso.cty
+                parts.append(adif_field("COUNTRY", country))
+                parts.append(adif_field("CONT", continent))
+                parts.append(adif_field("CQZ", str(cq_zone)))
+                parts.append(adif_field("ITUZ", str(itu_zone)))
+            parts.append("<EOR>\n")
+        return "".join(parts)
+
+    def footer(self):
+        return ""
+
+class CabrilloFormatter:
+    name = "Cabrillo"
+    filetypes = [("Cabrillo Files", "*.log"), ("All Files", "*.*")]
+    extension = ".log"
+    newline = None
+
+    def __init__(self):
+        # Taken on the Tk thread so a background export sees one consistent header
+        self.station = dict(my_station)
+        self.contest = dict(contest_config)
+        # Left out when a point table could not score every QSO, rather than claiming a wrong number
+        self.claimed_score = score_engine.score()[2] if score_engine.exact() else None
+
+    def header(self):
+        header = (
+            "START-OF-LOG: 3.0\n"
+            f"CALLSIGN: {self.station['callsign']}\n"
+            f"CONTEST: {self.contest['contest_name']}\n"
+            f"CATEGORY-OPERATOR: {self.contest['operator'].upper().replace(' ', '-')}\n"
+            f"CATEGORY-BAND: {self.contest['band'].upper().replace(' ', '-')}\n"
+            f"CATEGORY-POWER: {self.contest['power'].upper()}\n"
+            f"CATEGORY-TRANSMITTER: {self.contest['transmitter'].upper()}\n"
+        )
+        if self.claimed_score is not None:
+            header += f"CLAIMED-SCORE: {self.claimed_score}\n"
+        return header + "CREATED-BY: ZS6WAR AEA MM-3 Morse Machine Contest Keyer - v.0.4\n"
+
+    def render(self, qsos):
+        mycall = f"{self.station['callsign']:<13}"
+        lines = []
+        for qso in qsos:
+            day, seconds = divmod(qso.timestamp, 86400)
+            date = utc_date(day)  # Keep hyphens, e.g., "2025-03-15"
+            time_str = f"{seconds // 3600:02d}{seconds // 60 % 60:02d}"
+            exchange_sent = qso.exchange_sent
+            if exchange_sent.isdigit():
+                exchange_sent = f"{int(exchange_sent):03d}"
+            mode = CABRILLO_MODES.get(qso.mode, qso.mode)
+            lines.append(f"QSO: {qso.frequency_hz // 1000:5d} {mode} {date} {time_str} {mycall} {qso.rst_sent} {exchange_sent}   {qso.callsign:<13} {qso.rst_received} {qso.exchange_received}\n")
+        return "".join(lines)
+
+    def footer(self):
+        return "END-OF-LOG:\n"
+
+class CsvFormatter:
+    name = "CSV"
+    filetypes = [("CSV Files", "*.csv"), ("All Files", "*.*")]
+    extension = ".csv"
+    newline = ""
+
+    def header(self):
+        return ",".join(EXPORT_FIELDS) + "\n"
+
+    def render(self, qsos):
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerows(map(export_row, qsos))
+        return out.getvalue()
+
+    def footer(self):
+        return ""
+
+class JsonLinesFormatter:
+    name = "JSON Lines"
+    filetypes = [("JSON Lines Files", "*.jsonl"), ("All Files", "*.*")]
+    extension = ".jsonl"
+    newline = "\n"
+
+    def header(self):
+        return ""
+
+    def render(self, qsos):
+        return "".join(json.dumps(dict(zip(EXPORT_FIELDS, row)), separators=(",", ":")) + "\n" for row in map(export_row, qsos))
+
+    def footer(self):
+        return ""
+
+def run_export(formatter, qsos, filename, events, cancel):
+    # Written to a .part file and renamed at the end, so a cancelled or failed export
+    # never leaves half a log behind under the real name
+    part_file = filename + ".part"
+    try:
+        with open(part_file, "w", encoding="utf-8", newline=formatter.newline, buffering=EXPORT_BUFFER_SIZE) as f:
+            f.write(formatter.header())
+            for start in range(0, len(qsos), EXPORT_BATCH_SIZE):
+                if cancel.is_set():
+                    break
+                f.write(formatter.render(qsos[start:start + EXPORT_BATCH_SIZE]))
+                events.put(("progress", min(start + EXPORT_BATCH_SIZE, len(qsos))))
+            f.write(formatter.footer())
+        if cancel.is_set():
+            os.remove(part_file)
+            events.put(("cancelled", None))
+        else:
+            os.replace(part_file, filename)
+            events.put(("done", None))
+    except Exception as e:
+        try:
+            os.remove(part_file)
+        except OSError:
+            pass
+        events.put(("error", str(e)))
+
+def export_log(formatter):
     if not qso_list:
         messagebox.showinfo("Info", "No QSOs to export!")
         return
     
-    filename = filedialog.asksaveasfilename(defaultextension=".log", filetypes=[("Cabrillo Files", "*.log"), ("All Files", "*.*")], title="Export to Cabrillo")
+    filename = filedialog.asksaveasfilename(defaultextension=formatter.extension, filetypes=formatter.filetypes, title=f"Export to {formatter.name}")
     if not filename:
         return
-    
-    with open(filename, "w") as f:
-        f.write("START-OF-LOG: 3.0\n")
-        f.write(f"CALLSIGN: {my_station['callsign']}\n")
-        f.write(f"CONTEST: {contest_config['contest_name']}\n")
-        f.write(f"CATEGORY-OPERATOR: {contest_config['operator'].upper().replace(' ', '-')}\n")
-        f.write(f"CATEGORY-BAND: {contest_config['band'].upper().replace(' ', '-')}\n")
-        f.write(f"CATEGORY-POWER: {contest_config['power'].upper()}\n")
-        f.write(f"CATEGORY-TRANSMITTER: {contest_config['transmitter'].upper()}\n")
-        f.write("CREATED-BY: ZS6WAR AEA MM-3 Morse Machine Contest Keyer - v.0.4\n")
-        for qso in qso_list:
-            freq = int(float(qso["frequency"]) * 1000)
-            date = qso["datetime"][:10]  # Keep hyphens, e.g., "2025-03-15"
-            time_str = qso["datetime"][11:].replace(":", "")[:4]
-            exchange_sent = f"{int(qso['exchange_sent']):03d}" if qso['exchange_sent'].isdigit() else qso['exchange_sent']
-            f.write(f"QSO: {freq:5d} CW {date} {time_str} {my_station['callsign']:<13} {qso['rst_sent']} {exchange_sent}   {qso['callsign']:<13} {qso['rst_received']} {qso['exchange_received']}\n")
-        f.write("END-OF-LOG:\n")
-    messagebox.showinfo("Success", f"Exported to {filename}")
-
-def read_serial():
-    global ser, sent_text, last_sent_complete
-    while True:
+
+    qsos = list(qso_list)
+    dialog = tk.Toplevel(key_window)
+    dialog.title(f"Export to {formatter.name}")
+    dialog.geometry("360x140")
+    dialog.transient(key_window)
+    status_label = tk.Label(dialog, text=f"Writing {len(qsos)} QSOs...")
+    status_label.pack(pady=10)
+    progress = ttk.Progressbar(dialog, length=300, maximum=len(qsos), mode="determinate")
+    progress.pack(pady=5)
+    cancel = threading.Event()
+    tk.Button(dialog, text="Cancel", command=cancel.set).pack(pady=10)
+    dialog.protocol("WM_DELETE_WINDOW", cancel.set)
+
+    events = queue.Queue()
+    threading.Thread(target=run_export, args=(formatter, qsos, filename, events, cancel), daemon=True).start()
+
+    def check_progress():
         try:
-            if ser and ser.is_open:
-                line = ser.readline().decode('ascii', errors='ignore').strip()
-                if line:
-                    sent_text.config(state="normal")
-                    sent_text.delete(1.0, tk.END)
-                    sent_text.insert(tk.END, line)
-                    sent_text.config(state="disabled")
-                    sent_text.see(tk.END)
-                    last_sent_complete.set()
-        except serial.SerialException:
-            break
-        except Exception:
+            while True:
+                kind, value = events.get_nowait()
+                if kind == "progress":
+                    progress["value"] = value
+                    continue
+                dialog.destroy()
+                if kind == "done":
+                    messagebox.showinfo("Success", f"Exported to {filename}")
+                elif kind == "error":
+                    messagebox.showerror("Error", f"Export failed: {value}")
+                return
+        except queue.Empty:
+            pass
+        dialog.after(EXPORT_POLL_MS, check_progress)
+
+    check_progress()
+
+EXPORT_FORMATTERS = {
+    "adif": AdifFormatter,
+    "cabrillo": CabrilloFormatter,
+    "csv": CsvFormatter,
+    "jsonl": JsonLinesFormatter
+}
+
+def export_to_adif():
+    export_log(AdifFormatter())
+
+def export_to_cabrillo():
+    export_log(CabrilloFormatter())
+
+def export_to_csv():
+    export_log(CsvFormatter())
+
+def export_to_json_lines():
+    export_log(JsonLinesFormatter())
+
+class CaptureRing:
+    # One producer thread and the drain thread share it without a lock: the producer only
+    # moves head and the drain only moves tail, each after the bytes are in place. A full
+    # ring drops the record rather than hold up the port thread.
+    def __init__(self, size):
+        self.buffer = bytearray(size)
+        self.size = size
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+
+    def put(self, header, data):
+        position = self.head
+        if position - self.tail + len(header) + len(data) > self.size:
+            self.dropped += 1
+            return
+        for part in (header, data):
+            start = position % self.size
+            first = min(len(part), self.size - start)
+            self.buffer[start:start + first] = part[:first]
+            self.buffer[:len(part) - first] = part[first:]
+            position += len(part)
+        self.head = position
+
+    def take(self):
+        head = self.head
+        start = self.tail % self.size
+        end = start + head - self.tail
+        if end <= self.size:
+            data = bytes(self.buffer[start:end])
+        else:
+            data = bytes(self.buffer[start:]) + bytes(self.buffer[:end - self.size])
+        self.tail = head
+        return data
+
+class SerialCapture:
+    # Every byte written to or read from the MM-3, time-stamped with the engine's monotonic
+    # clock. The writer and reader threads each fill their own ring and a drain thread
+    # appends both to the file, so the port threads only pack a header and copy.
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, "wb")
+        self.file.write(CAPTURE_MAGIC + CAPTURE_HEADER.pack(time.monotonic(), time.time()))
+        self.rings = (CaptureRing(CAPTURE_RING_SIZE), CaptureRing(CAPTURE_RING_SIZE))
+        self.bytes_written = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.drain_loop, daemon=True)
+        self.thread.start()
+
+    def record(self, direction, data, timestamp):
+        # Only ever called from the one thread that owns the direction
+        ring = self.rings[direction]
+        for start in range(0, len(data), 0xFFFF):
+            part = data[start:start + 0xFFFF]
+            ring.put(CAPTURE_RECORD.pack(timestamp, direction, len(part)), part)
+
+    def drain_loop(self):
+        while self.running:
+            time.sleep(CAPTURE_DRAIN_MS / 1000)
+            self.drain()
+
+    def drain(self):
+        # The rings are drained one after the other, so records are in time order per direction only
+        for ring in self.rings:
+            data = ring.take()
+            if data:
+                self.file.write(data)
+                self.bytes_written += len(data)
+        self.file.flush()
+
+    def dropped(self):
+        return sum(ring.dropped for ring in self.rings)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.drain()
+        self.file.close()
+
+def read_capture(filename):
+    # (monotonic start, wall clock start, [(timestamp, direction, data)] in time order)
+    with open(filename, "rb") as f:
+        blob = f.read()
+    if not blob.startswith(CAPTURE_MAGIC):
+        raise ValueError(f"{filename} is not a serial capture")
+    offset = len(CAPTURE_MAGIC)
+    started, wall_clock = CAPTURE_HEADER.unpack_from(blob, offset)
+    offset += CAPTURE_HEADER.size
+    records = []
+    while offset + CAPTURE_RECORD.size <= len(blob):
+        timestamp, direction, length = CAPTURE_RECORD.unpack_from(blob, offset)
+        offset += CAPTURE_RECORD.size
+        if offset + length > len(blob):
+            break  # cut off by a crash
+        records.append((timestamp, direction, blob[offset:offset + length]))
+        offset += length
+    records.sort(key=lambda record: record[0])
+    return started, wall_clock, records
+
+class ReplayPort:
+    # Stands in for the MM-3 port: read_serial gets the received side of a capture at the
+    # recorded pace divided by speed (0 for no waiting), counted from the first read.
+    # Writes are kept in written for comparing with the sent side.
+    def __init__(self, filename, speed=1.0):
+        started, wall_clock, records = read_capture(filename)
+        self.received = [(timestamp - started, data) for timestamp, direction, data in records if direction == CAPTURE_RX]
+        self.sent = [(timestamp - started, data) for timestamp, direction, data in records if direction == CAPTURE_TX]
+        self.speed = speed
+        self.index = 0
+        self.origin = None
+        self.written = bytearray()
+        self.is_open = True
+        self.in_waiting = 0
+        self.closed = threading.Event()
+
+    def read(self, size=1):
+        if self.origin is None:
+            self.origin = time.monotonic()
+        if self.index >= len(self.received):
+            # Played out; stay quiet like an idle port until closed
+            self.closed.wait()
+            raise OSError("port closed")
+        offset, data = self.received[self.index]
+        delay = self.origin + offset / self.speed - time.monotonic() if self.speed else 0.0
+        if self.closed.wait(max(0.0, delay)):
+            raise OSError("port closed")
+        self.index += 1
+        return data
+
+    def write(self, data):
+        self.written += data
+        return len(data)
+
+    def close(self):
+        self.is_open = False
+        self.closed.set()
+
+class SerialEngine:
+    # Owns the port. Whatever bytes are waiting are read at once and split into lines in one
+    # reusable buffer; finished lines go to serial_events for the Tk loop. Writes are queued
+    # and done by a transmit thread so the Tk loop never blocks on the port.
+    def __init__(self, port):
+        self.port = port
+        self.buffer = bytearray()
+        self.running = False
+        self.thread = None
+        self.tx_queue = queue.Queue(maxsize=TX_QUEUE_SIZE)
+        self.tx_thread = None
+        self.queued_bytes = 0
+        self.written_bytes = 0
+        self.last_echo_time = 0.0
+        # Diagnostics only: (queued byte count, key press time) and when the last text went out
+        self.press_times = collections.deque()
+        self.echo_wait_since = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.read_serial, daemon=True)
+        self.thread.start()
+        self.tx_thread = threading.Thread(target=self.write_serial, daemon=True)
+        self.tx_thread.start()
+
+    def stop(self):
+        self.running = False
+        try:
+            self.tx_queue.put_nowait(None)
+        except queue.Full:
             pass
-        time.sleep(0.1)
+
+    def send(self, data, pressed=None):
+        try:
+            self.tx_queue.put_nowait(data)
+        except queue.Full:
+            return False
+        if not isinstance(data, float):
+            self.queued_bytes += len(data)
+            if diagnostics:
+                self.press_times.append((self.queued_bytes, pressed or time.monotonic()))
+        return True
+
+    def pause(self, seconds):
+        # Keeps a gap between two queued writes without sleeping on the Tk thread
+        return self.send(float(seconds))
+
+    def write_serial(self):
+        # Byte items that are already waiting go out in one write; a pause or stop item that
+        # turns up while gathering is held back and handled on the next pass
+        held = False
+        item = None
+        while self.running:
+            if not held:
+                item = self.tx_queue.get()
+            held = False
+            if item is None:
+                break
+            if isinstance(item, float):
+                time.sleep(item)
+                continue
+            data = bytes(item)
+            while len(data) < TX_COALESCE_BYTES:
+                try:
+                    item = self.tx_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None or isinstance(item, float):
+                    held = True
+                    break
+                data += item
+            try:
+                self.port.write(data)
+            except (serial.SerialException, OSError) as e:
+                serial_events.put(("error", str(e), time.monotonic()))
+                break
+            capture = serial_capture
+            if capture:
+                capture.record(CAPTURE_TX, data, time.monotonic())
+            self.written_bytes += len(data)
+            if self.press_times:
+                self.wrote(data)
+
+    def wrote(self, data):
+        now = time.monotonic()
+        while self.press_times and self.press_times[0][0] <= self.written_bytes:
+            pressed = self.press_times.popleft()[1]
+            if diagnostics:
+                diagnostics.record("keypress_to_write", now - pressed)
+        # Commands and aborts are not echoed, anything else is text the MM-3 will send back
+        if self.echo_wait_since is None and any(part[:1] not in (b"", b"*", b"\x03") for part in data.replace(b"\r", b"\n").split(b"\n")):
+            self.echo_wait_since = now
+
+    def read_serial(self):
+        while self.running:
+            try:
+                # Blocks for the first byte only, so a line is seen as soon as its last byte arrives
+                data = self.port.read(self.port.in_waiting or 1)
+            except (serial.SerialException, OSError, TypeError):
+                break
+            if data:
+                timestamp = time.monotonic()
+                capture = serial_capture
+                if capture:
+                    capture.record(CAPTURE_RX, data, timestamp)
+                if self.echo_wait_since is not None:
+                    if diagnostics:
+                        diagnostics.record("echo_round_trip", timestamp - self.echo_wait_since)
+                    self.echo_wait_since = None
+                self.feed(data, timestamp)
+        self.running = False
+
+    def feed(self, data, timestamp):
+        buffer = self.buffer
+        buffer += data
+        while True:
+            end = -1
+            for terminator in b"\r\n":
+                found = buffer.find(terminator)
+                if found != -1 and (end == -1 or found < end):
+                    end = found
+            if end == -1:
+                break
+            line = buffer[:end].decode("ascii", errors="ignore").strip()
+            del buffer[:end + 1]
+            if line:
+                self.echo(line, timestamp)
+
+    def echo(self, line, timestamp):
+        # Repeat CQ and the CW timing calibration poll this from the Tk loop
+        self.last_echo_time = timestamp
+        serial_events.put(("echo", line, timestamp))
+
+class KeyerBuffer:
+    # Type-ahead text for the keyboard keyer. text[:released] has been handed to the serial
+    # engine and ends[i] is the engine byte count at which character i has left the port, so
+    # sent and queued characters are told apart without any callback from the writer thread.
+    # In word mode nothing is released until a space or enter, so the word can still be edited.
+    def __init__(self, engine, word_mode=False):
+        self.engine = engine
+        self.word_mode = word_mode
+        self.text = []
+        self.ends = []
+        self.released = 0
+        self.shown = None
+        self.pressed_at = None
+
+    def type(self, char):
+        self.text.append(char)
+        if diagnostics and self.pressed_at is None:
+            self.pressed_at = time.monotonic()
+
+    def backspace(self):
+        if len(self.text) > self.released:
+            self.text.pop()
+            return True
+        return False
+
+    def clear(self):
+        del self.text[self.released:]
+
+    def releasable(self):
+        if not self.word_mode:
+            return len(self.text)
+        for i in range(len(self.text) - 1, self.released - 1, -1):
+            if self.text[i] in " \r":
+                return i + 1
+        return self.released
+
+    def flush(self):
+        end = self.releasable()
+        if end <= self.released:
+            return True
+        data = "".join(self.text[self.released:end]).encode("ascii")
+        if not self.engine.send(data, self.pressed_at):
+            return False
+        self.pressed_at = None
+        start = self.engine.queued_bytes - len(data)
+        self.ends.extend(range(start + 1, start + len(data) + 1))
+        self.released = end
+        return True
+
+    def sent(self):
+        return bisect.bisect_right(self.ends, self.engine.written_bytes)
+
+    def trim(self):
+        extra = self.sent() - KEYER_HISTORY
+        if extra > 0:
+            del self.text[:extra]
+            del self.ends[:extra]
+            self.released -= extra
+
+    def state(self):
+        return (self.sent(), self.released, len(self.text))
+
+def show_keyer_buffer():
+    keyer_buffer.trim()
+    state = keyer_buffer.state()
+    if state == keyer_buffer.shown or keyboard_keyer.cget("state") == "disabled":
+        return
+    keyer_buffer.shown = state
+    sent, released, _ = state
+    text = "".join(keyer_buffer.text).replace("\r", " ")
+    keyboard_keyer.delete(1.0, tk.END)
+    keyboard_keyer.insert(tk.END, text[:sent], "keyer_sent", text[sent:released], "keyer_queued", text[released:], "keyer_held")
+    keyboard_keyer.see(tk.END)
+
+def process_serial_events():
+    try:
+        while True:
+            kind, value, timestamp = serial_events.get_nowait()
+            if kind == "echo":
+                if diagnostics:
+                    diagnostics.record("echo_display", time.monotonic() - timestamp)
+                sent_text.config(state="normal")
+                sent_text.delete(1.0, tk.END)
+                sent_text.insert(tk.END, value)
+                sent_text.config(state="disabled")
+                sent_text.see(tk.END)
+            elif kind == "error":
+                handle_serial_error(value)
+                return
+    except queue.Empty:
+        pass
+    if keyer_buffer is not None:
+        show_keyer_buffer()
+    key_window.after(SERIAL_POLL_MS, process_serial_events)
 
 def show_contest_setup():
     global tune_state
     if not tune_state.get():
         dialog = tk.Toplevel(key_window)
         dialog.title("Contest Setup")
-        dialog.geometry("300x500")
+        dialog.geometry("300x560")
         dialog.transient(key_window)
         dialog.grab_set()
 
@@ -564,6 +3370,11 @@ def show_contest_setup():
         transmitter_menu = ttk.Combobox(dialog, textvariable=transmitter_var, values=["One", "Two"], state="readonly")
         transmitter_menu.pack(pady=5)
 
+        tk.Label(dialog, text="Scoring Rules:").pack(pady=5)
+        rules_var = tk.StringVar(value=contest_config["rules"])
+        rules_menu = ttk.Combobox(dialog, textvariable=rules_var, values=list(CONTEST_RULES), state="readonly")
+        rules_menu.pack(pady=5)
+
         tk.Label(dialog, text="Exchange:").pack(pady=5)
         
         use_serial_var = tk.BooleanVar(value=contest_config["use_serial_exchange"])
@@ -591,6 +3402,9 @@ def show_contest_setup():
             contest_config["transmitter"] = transmitter_var.get()
             contest_config["exchange"] = exchange_entry.get()
             contest_config["use_serial_exchange"] = use_serial_var.get()
+            if rules_var.get() != contest_config["rules"]:
+                contest_config["rules"] = rules_var.get()
+                build_score()
             messagebox.showinfo("Updated", "Contest configuration saved.")
             dialog.destroy()
 
@@ -598,14 +3412,18 @@ def show_contest_setup():
         tk.Button(dialog, text="Cancel", command=dialog.destroy).pack(pady=5)
 
 def show_function_key_window():
-    global key_window, freq_label, frequency_var, callsign_var, snt_var, rcv_var, exchange_var, speed_var, log_tree, sent_text, tune_state
+    global key_window, freq_label, frequency_var, callsign_var, snt_var, rcv_var, exchange_var, speed_var, log_view, sent_text, tune_state
     global knob_mode, sidetone_enabled, repeat_enabled, repeat_interval, use_5nn, shorten_zeros, log_window, callsign_entry, keyboard_keyer
+    global keyer_buffer, keyer_word_mode
     
     settings = load_settings()
+    log_ready.wait()
     
     key_window = tk.Tk()
     key_window.title("ZS6WAR AEA MM-3 Morse Machine Contest Keyer - v.0.4")
     key_window.geometry(settings.get("main_window_geometry", "900x550+0+0"))
+    if log_error:
+        key_window.after_idle(lambda: messagebox.showerror("Error", log_error))
 
     try:
         key_window.iconbitmap("morse_key.ico")
@@ -618,36 +3436,70 @@ def show_function_key_window():
     rcv_var = tk.StringVar(value="599")
     exchange_var = tk.StringVar(value="")
     tune_state = tk.BooleanVar(value=False)
-    speed_var = tk.StringVar(value=settings.get("speed", "25"))
-    use_5nn = tk.BooleanVar(value=settings.get("use_5nn", False))
-    shorten_zeros = tk.BooleanVar(value=settings.get("shorten_zeros", False))
+    speed_var = tk.StringVar(value=str(keyer_options["speed"]))
+    use_5nn = tk.BooleanVar(value=keyer_options["use_5nn"])
+    shorten_zeros = tk.BooleanVar(value=keyer_options["shorten_zeros"])
+    use_5nn.trace_add("write", lambda *args: keyer_options.update(use_5nn=use_5nn.get()))
+    shorten_zeros.trace_add("write", lambda *args: keyer_options.update(shorten_zeros=shorten_zeros.get()))
     knob_mode = tk.BooleanVar(value=settings.get("knob_mode", False))
     sidetone_enabled = tk.BooleanVar(value=settings.get("sidetone_enabled", True))
     repeat_enabled = tk.BooleanVar(value=settings.get("repeat_enabled", False))
     repeat_interval = tk.StringVar(value=settings.get("repeat_interval", "2.5"))
+    keyer_word_mode = tk.BooleanVar(value=settings.get("keyer_word_mode", False))
+    keyer_buffer = KeyerBuffer(serial_engine, keyer_word_mode.get())
 
     ui_elements = []
+    compile_all_macros()
 
     log_window = show_qso_window()
     log_window.protocol("WM_DELETE_WINDOW", lambda: None)
     
+    keyer_job = None
+
+    # Typed characters only go into the buffer; a short after() delay lets a burst of typing
+    # leave as one write instead of one write per keypress
     def send_keyer_text(event):
-        char = event.char
-        if char and ser and ser.is_open and not tune_state.get():
-            try:
-                ser.write(char.upper().encode('ascii'))
-                stop_repeat()
-            except Exception:
-                pass
+        if event.keysym == "BackSpace":
+            keyer_buffer.backspace()
+            show_keyer_buffer()
+            return "break"
+        char = "\r" if event.keysym in ("Return", "KP_Enter") else event.char
+        if not char or not (char == "\r" or " " <= char <= "~"):
+            return None
+        if ser and ser.is_open and not tune_state.get():
+            keyer_buffer.type(char.upper())
+            stop_repeat()
+            schedule_keyer_flush()
+            show_keyer_buffer()
+        return "break"
+
+    def schedule_keyer_flush():
+        nonlocal keyer_job
+        if keyer_job is None:
+            keyer_job = key_window.after(KEYER_FLUSH_MS, flush_keyer)
+
+    def flush_keyer():
+        nonlocal keyer_job
+        keyer_job = None
+        if not keyer_buffer.flush():
+            schedule_keyer_flush()
+        show_keyer_buffer()
+
+    def set_keyer_mode():
+        keyer_buffer.word_mode = keyer_word_mode.get()
+        schedule_keyer_flush()
+
+    def clear_keyer():
+        keyer_buffer.clear()
+        show_keyer_buffer()
 
     def send_command(command, include_terminator=True, tune_command=False):
-        global ser
         try:
-            ser.write("\x03".encode('ascii') + b'\n')
-            ser.write(command.upper().encode('ascii') + b'\n')
+            terminator = None
             if include_terminator:
                 terminator = "*9" if tune_command else "*C709"
-                ser.write(terminator.encode('ascii') + b'\n')
+            if not mm3_command(command, terminator):
+                messagebox.showerror("Error", "Failed to send command: transmit queue is full")
         except Exception as e:
             messagebox.showerror("Error", f"Failed to send command: {e}")
 
@@ -661,12 +3513,8 @@ def show_function_key_window():
     def set_speed():
         if not tune_state.get() and not knob_mode.get():
             try:
-                speed = int(speed_var.get())
-                if 1 <= speed <= 99:
-                    command = f"*6{speed:02d}"
-                    send_command(command)
-                else:
-                    speed_var.set("25")
+                if not set_keyer_speed(int(speed_var.get())):
+                    messagebox.showerror("Error", "Failed to send command: transmit queue is full")
             except ValueError:
                 speed_var.set("25")
 
@@ -686,7 +3534,7 @@ def show_function_key_window():
             tune_state.set(False)
             knob_mode.set(True)
             set_knob_mode()
-            time.sleep(0.1)
+            serial_engine.pause(0.1)
             knob_mode.set(False)
             set_knob_mode()
         else:
@@ -719,36 +3567,48 @@ def show_function_key_window():
                 set_speed()
 
     repeating = False
-    last_sent_complete = threading.Event()
+    repeat_job = None
 
+    # The repeat runs as a chain of after() callbacks so the macro is always expanded on the Tk thread
     def repeat_cq():
-        nonlocal repeating
-        while repeating and not tune_state.get() and not knob_mode.get():
-            last_sent_complete.clear()
-            duration = send_to_serial(macros["F1"])
-            time.sleep(duration)
-            last_sent_complete.set()
+        nonlocal repeating, repeat_job
+        repeat_job = None
+        if not repeating or tune_state.get() or knob_mode.get() or compiled_macros.get("F1") is None:
+            repeating = False
+            return
+        sent_at = time.monotonic()
+        duration = send_to_serial(compiled_macros["F1"])
+        wait_for_repeat(sent_at, sent_at + duration)
+
+    def wait_for_repeat(sent_at, deadline):
+        nonlocal repeat_job
+        # The MM-3 echoes the line once it has been keyed; the estimate is only a fallback
+        if serial_engine.last_echo_time > sent_at or time.monotonic() >= deadline:
             try:
                 interval = float(repeat_interval.get())
                 if interval <= 0:
                     interval = 2.5
             except ValueError:
                 interval = 2.5
-            time.sleep(interval)
-        repeating = False
+            repeat_job = key_window.after(int(interval * 1000), repeat_cq)
+        else:
+            repeat_job = key_window.after(REPEAT_POLL_MS, wait_for_repeat, sent_at, deadline)
 
     def start_repeat():
         nonlocal repeating
         if not tune_state.get() and not knob_mode.get() and not repeating:
             repeating = True
-            threading.Thread(target=repeat_cq, daemon=True).start()
+            repeat_cq()
         elif knob_mode.get():
             messagebox.showwarning("Warning", "Repeat function is disabled when Knob mode is selected.")
             repeating = False
 
     def stop_repeat():
-        nonlocal repeating
+        nonlocal repeating, repeat_job
         repeating = False
+        if repeat_job is not None:
+            key_window.after_cancel(repeat_job)
+            repeat_job = None
 
     def create_action(f_key):
         def action():
@@ -764,7 +3624,10 @@ def show_function_key_window():
                         if not rcv_var.get().strip():
                             rcv_var.set("599")
                         exchange_entry.focus_set()
-                    send_to_serial(message)
+                    if compiled_macros.get(f_key) is None:
+                        messagebox.showerror("Error", f"The {f_key} macro has an invalid placeholder. Right click the button to fix it.")
+                        return
+                    send_to_serial(compiled_macros[f_key])
         return action
 
     def lookup_qrz():
@@ -773,6 +3636,7 @@ def show_function_key_window():
             messagebox.showwarning("Warning", "Please enter a callsign to look up!")
             return
         url = f"https://www.qrz.com/db/{callsign.upper()}"
+        import webbrowser
         webbrowser.open(url)
 
     def edit_macro_and_label(f_key):
@@ -795,14 +3659,8 @@ def show_function_key_window():
 
             tk.Label(dialog, text="Insert Placeholder:").pack(pady=5)
             placeholder_var = tk.StringVar()
-            placeholders = {
-                "hiscall": "{callsign}",
-                "mycall": "{mycall}",
-                "hisrst": "{rst}",
-                "myrst": "599",
-                "exchange": "{exchange}",
-                "serial": "{serial}"
-            }
+            placeholders = {label: f"{{{field}}}" for field, label in MACRO_FIELDS.items()}
+            placeholders["myrst"] = "599"
             placeholder_menu = ttk.Combobox(dialog, textvariable=placeholder_var, values=list(placeholders.keys()), state="readonly")
             placeholder_menu.pack(pady=5)
 
@@ -820,6 +3678,11 @@ def show_function_key_window():
                 new_macro = macro_entry.get()
                 new_label = label_entry.get()
                 if new_macro is not None and new_label is not None:
+                    try:
+                        compiled_macros[f_key] = compile_macro(new_macro)
+                    except ValueError as e:
+                        messagebox.showerror("Invalid Macro", str(e), parent=dialog)
+                        return
                     macros[f_key] = new_macro
                     button_labels[f_key] = new_label
                     buttons[f_key].config(text=f"{f_key}\n{new_label}")
@@ -873,7 +3736,7 @@ def show_function_key_window():
         if not tune_state.get():
             settings_window = tk.Toplevel(key_window)
             settings_window.title("Exchange Settings")
-            settings_window.geometry("300x200")
+            settings_window.geometry("300x240")
             tk.Label(settings_window, text="RST Format:").pack(pady=5)
             tk.Radiobutton(settings_window, text="599", variable=use_5nn, value=False).pack()
             tk.Radiobutton(settings_window, text="5NN", variable=use_5nn, value=True).pack()
@@ -881,24 +3744,231 @@ def show_function_key_window():
             tk.Checkbutton(settings_window, text="Shorten 0 to T", variable=shorten_zeros).pack()
             send_tu_var = tk.BooleanVar(value=contest_config["send_tu_on_log"])
             tk.Checkbutton(settings_window, text="Send TU on Log", variable=send_tu_var, command=lambda: contest_config.update({"send_tu_on_log": send_tu_var.get()})).pack(pady=5)
+            nplus1_var = tk.BooleanVar(value=contest_config["nplus1_use_scp"])
+
+            def toggle_nplus1_reference():
+                contest_config["nplus1_use_scp"] = nplus1_var.get()
+                if nplus1_var.get() and reference_fuzzy is None:
+                    threading.Thread(target=build_reference_fuzzy, daemon=True).start()
+
+            tk.Checkbutton(settings_window, text="N+1 Suggestions from SCP File", variable=nplus1_var, command=toggle_nplus1_reference).pack()
             tk.Button(settings_window, text="Close", command=settings_window.destroy).pack(pady=10)
 
+    def show_cw_calibration():
+        if tune_state.get() or repeating:
+            return
+        dialog = tk.Toplevel(key_window)
+        dialog.title("CW Timing Calibration")
+        dialog.geometry("360x260")
+        dialog.transient(key_window)
+
+        tk.Label(dialog, text="Farnsworth WPM (0 = off):").pack(pady=5)
+        farnsworth_entry = tk.Entry(dialog, width=5)
+        farnsworth_entry.insert(0, str(cw_timing_config["farnsworth_wpm"]))
+        farnsworth_entry.pack()
+        status_label = tk.Label(dialog, text=f"Scale {cw_timing_config['scale']:.3f}, offset {cw_timing_config['offset']:+.2f} s", justify="left")
+        status_label.pack(pady=10)
+        samples = []
+        state = {"index": 0, "sent_at": 0.0, "estimate": 0.0, "job": None}
+
+        def send_next():
+            if state["index"] >= len(CW_CALIBRATION_MESSAGES):
+                state["job"] = None
+                start_button.config(state="normal")
+                fit = fit_cw_calibration(samples)
+                if fit is None:
+                    status_label.config(text=f"Only {len(samples)} of {len(CW_CALIBRATION_MESSAGES)} messages echoed, nothing saved")
+                    messagebox.showwarning("Warning", "Too few echoes from the keyer to calibrate. Check that the MM-3 is on and connected to this port.", parent=dialog)
+                    return
+                scale, offset = fit
+                if not cw_calibration_plausible(scale, offset):
+                    status_label.config(text=f"Rejected: scale {scale:.3f}, offset {offset:+.2f} s\nfrom {len(samples)} echoes, nothing saved")
+                    messagebox.showwarning("Warning", "The measured timing does not match the keyer speed, the old calibration is kept. Try again without typing or other sending.", parent=dialog)
+                    return
+                cw_timing_config["scale"] = scale
+                cw_timing_config["offset"] = offset
+                status_label.config(text=f"Done: scale {scale:.3f}, offset {offset:+.2f} s\nfrom {len(samples)} echoes")
+                return
+            message = CW_CALIBRATION_MESSAGES[state["index"]]
+            wpm = keyer_options["speed"]
+            state["estimate"] = cw_timing(message, wpm, cw_timing_config["farnsworth_wpm"])
+            state["sent_at"] = time.monotonic()
+            serial_engine.send(message.encode('ascii') + b'\n')
+            status_label.config(text=f"Sending {state['index'] + 1}/{len(CW_CALIBRATION_MESSAGES)}: {message}")
+            state["job"] = dialog.after(REPEAT_POLL_MS, wait_for_echo)
+
+        def wait_for_echo():
+            elapsed = time.monotonic() - state["sent_at"]
+            if serial_engine.last_echo_time > state["sent_at"]:
+                samples.append((state["estimate"], serial_engine.last_echo_time - state["sent_at"]))
+            elif elapsed < state["estimate"] * 2 + 5:
+                state["job"] = dialog.after(REPEAT_POLL_MS, wait_for_echo)
+                return
+            state["index"] += 1
+            # Leave the keyer idle for a moment so each echo belongs to its own message
+            state["job"] = dialog.after(500, send_next)
+
+        def start():
+            try:
+                cw_timing_config["farnsworth_wpm"] = max(0, int(farnsworth_entry.get() or 0))
+            except ValueError:
+                messagebox.showerror("Error", "Farnsworth WPM must be a whole number.", parent=dialog)
+                return
+            samples.clear()
+            state["index"] = 0
+            start_button.config(state="disabled")
+            send_next()
+
+        def close():
+            if state["job"] is not None:
+                dialog.after_cancel(state["job"])
+            dialog.destroy()
+
+        start_button = tk.Button(dialog, text="Start Calibration", command=start)
+        start_button.pack(pady=5)
+        tk.Button(dialog, text="Close", command=close).pack(pady=5)
+        dialog.protocol("WM_DELETE_WINDOW", close)
+
+    def show_rig_control():
+        dialog = tk.Toplevel(key_window)
+        dialog.title("Rig Control")
+        dialog.geometry("320x320")
+        dialog.transient(key_window)
+
+        tk.Label(dialog, text="Backend:").pack(pady=5)
+        backend_var = tk.StringVar(value=rig_config["backend"])
+        ttk.Combobox(dialog, textvariable=backend_var, values=["OmniRig", "rigctld", "Fake"], state="readonly").pack(pady=5)
+        tk.Label(dialog, text="rigctld Host:").pack(pady=5)
+        host_entry = tk.Entry(dialog, width=25)
+        host_entry.insert(0, rig_config["host"])
+        host_entry.pack()
+        tk.Label(dialog, text="rigctld Port:").pack(pady=5)
+        port_entry = tk.Entry(dialog, width=8)
+        port_entry.insert(0, str(rig_config["port"]))
+        port_entry.pack()
+        stats_label = tk.Label(dialog, text="", justify="left", font=("Courier", 9))
+        stats_label.pack(pady=10)
+
+        def refresh_stats():
+            if not dialog.winfo_exists():
+                return
+            if rig_backend is not None:
+                stats = rig_backend.stats()
+                stats_label.config(text=f"{stats['backend']}: {stats['polls']} polls, {stats['errors']} errors\n"
+                                        f"latency {stats['last_latency_ms']:.2f} ms (mean {stats['mean_latency_ms']:.2f} ms)\n"
+                                        f"{stats['polls_per_second']:.1f} polls/s")
+            dialog.after(500, refresh_stats)
+
+        def save_rig_config():
+            try:
+                port = int(port_entry.get())
+            except ValueError:
+                messagebox.showerror("Error", "Port must be a number.", parent=dialog)
+                return
+            rig_config["backend"] = backend_var.get()
+            rig_config["host"] = host_entry.get().strip() or "localhost"
+            rig_config["port"] = port
+            start_rig_polling()
+
+        tk.Button(dialog, text="Apply", command=save_rig_config).pack(pady=5)
+        tk.Button(dialog, text="Close", command=dialog.destroy).pack(pady=5)
+        refresh_stats()
+
+    def show_log_sync():
+        dialog = tk.Toplevel(key_window)
+        dialog.title("Log Sync")
+        dialog.geometry("320x340")
+        dialog.transient(key_window)
+
+        tk.Label(dialog, text="Role:").pack(pady=5)
+        role_var = tk.StringVar(value=sync_config["role"])
+        ttk.Combobox(dialog, textvariable=role_var, values=["Off", "Master", "Station"], state="readonly").pack(pady=5)
+        tk.Label(dialog, text="Master Host (Station role):").pack(pady=5)
+        host_entry = tk.Entry(dialog, width=25)
+        host_entry.insert(0, sync_config["host"])
+        host_entry.pack()
+        tk.Label(dialog, text="Port:").pack(pady=5)
+        port_entry = tk.Entry(dialog, width=8)
+        port_entry.insert(0, str(sync_config["port"]))
+        port_entry.pack()
+        tk.Label(dialog, text="Station Name:").pack(pady=5)
+        station_entry = tk.Entry(dialog, width=25)
+        station_entry.insert(0, sync_config["station"])
+        station_entry.pack()
+        status_label = tk.Label(dialog, text="", font=("Courier", 9))
+        status_label.pack(pady=10)
+
+        def refresh_status():
+            if not dialog.winfo_exists():
+                return
+            status_label.config(text=f"{log_sync.status}, seq {log_sync.applied_seq}" if log_sync else "off")
+            dialog.after(500, refresh_status)
+
+        def save_sync_config():
+            try:
+                port = int(port_entry.get())
+            except ValueError:
+                messagebox.showerror("Error", "Port must be a number.", parent=dialog)
+                return
+            if role_var.get() == "Station" and not host_entry.get().strip():
+                messagebox.showerror("Error", "Enter the master's host name or address.", parent=dialog)
+                return
+            sync_config["role"] = role_var.get()
+            sync_config["host"] = host_entry.get().strip()
+            sync_config["port"] = port
+            sync_config["station"] = station_entry.get().strip() or socket.gethostname()
+            try:
+                start_log_sync()
+            except OSError as e:
+                messagebox.showerror("Error", f"Failed to start log sync: {e}", parent=dialog)
+
+        tk.Button(dialog, text="Apply", command=save_sync_config).pack(pady=5)
+        tk.Button(dialog, text="Close", command=dialog.destroy).pack(pady=5)
+        refresh_status()
+
     def start_new_contest():
         if messagebox.askyesno("New Contest", "Are you sure you want to start a new contest?\nThis will delete the current log."):
-            global qso_list, serial_number, log_tree
-            qso_list = []
-            serial_number = 1
-            if log_tree:
-                for item in log_tree.get_children():
-                    log_tree.delete(item)
+            clear_log()
+            if log_view:
+                log_view.render()
             messagebox.showinfo("New Contest", "New contest started. Log has been cleared.")
             save_settings()
 
+    def choose_scp_file():
+        global scp_file
+        filename = filedialog.askopenfilename(filetypes=[("SCP Files", "*.scp"), ("All Files", "*.*")], title="Load Super Check Partial File")
+        if filename:
+            scp_file = filename
+            threading.Thread(target=load_scp, args=(scp_file,), daemon=True).start()
+
+    def choose_cty_file():
+        global cty_file
+        filename = filedialog.askopenfilename(filetypes=[("Country Files", "*.dat"), ("All Files", "*.*")], title="Load cty.dat Country File")
+        if filename:
+            cty_file = filename
+            threading.Thread(target=load_cty, args=(cty_file,), daemon=True).start()
+
+    def toggle_serial_capture():
+        if serial_capture:
+            capture = stop_serial_capture()
+            messagebox.showinfo("Serial Capture", f"Capture saved to {capture.filename} ({capture.bytes_written} bytes, {capture.dropped()} records dropped).")
+            return
+        filename = filedialog.asksaveasfilename(defaultextension=".mm3cap", filetypes=[("Serial Captures", "*.mm3cap"), ("All Files", "*.*")], title="Start Serial Capture")
+        if filename:
+            try:
+                start_serial_capture(filename)
+            except OSError as e:
+                messagebox.showerror("Error", f"Failed to start serial capture: {e}")
+
     def on_closing():
         global ser
         nonlocal repeating
         repeating = False
         save_settings()
+        stop_log_sync()
+        stop_serial_capture()
+        if serial_engine:
+            serial_engine.stop()
         if ser is not None and ser.is_open:
             ser.close()
         key_window.destroy()
@@ -910,8 +3980,14 @@ def show_function_key_window():
     file_menu.add_command(label="New Contest", command=start_new_contest)
     file_menu.add_command(label="My Station", command=show_my_station)
     file_menu.add_command(label="Show QSOs", command=show_qso_window)
+    file_menu.add_command(label="Import ADIF", command=import_adif)
     file_menu.add_command(label="Export to ADIF", command=export_to_adif)
     file_menu.add_command(label="Export to Cabrillo", command=export_to_cabrillo)
+    file_menu.add_command(label="Export to CSV", command=export_to_csv)
+    file_menu.add_command(label="Export to JSON Lines", command=export_to_json_lines)
+    file_menu.add_command(label="Load SCP File", command=choose_scp_file)
+    file_menu.add_command(label="Load cty.dat", command=choose_cty_file)
+    file_menu.add_command(label="Start/Stop Serial Capture", command=toggle_serial_capture)
     file_menu.add_separator()
     file_menu.add_command(label="Exit", command=on_closing)
 
@@ -923,6 +3999,9 @@ def show_function_key_window():
     for f_key in macros.keys():
         macros_menu.add_command(label=f"Edit {f_key}", command=lambda k=f_key: edit_macro_and_label(k))
     contesting_menu.add_command(label="Exchange Settings", command=show_exchange_settings)
+    contesting_menu.add_command(label="CW Timing Calibration", command=show_cw_calibration)
+    contesting_menu.add_command(label="Rig Control", command=show_rig_control)
+    contesting_menu.add_command(label="Log Sync", command=show_log_sync)
 
     freq_frame = tk.Frame(key_window)
     freq_frame.grid(row=0, column=0, columnspan=4, pady=5, sticky="w")
@@ -935,10 +4014,20 @@ def show_function_key_window():
     time_label = tk.Label(time_frame, text="UTC: --:--:--", font=("Arial", 18))
     time_label.pack(side="right", padx=5)
     ui_elements.append(time_label)
+    rate_label = tk.Label(time_frame, text="", justify="right")
+    rate_label.pack(side="right", padx=10)
 
     def update_time():
         utc_time = datetime.now(UTC).strftime("%H:%M:%S")
         time_label.config(text=f"UTC: {utc_time}")
+        last_10, last_60, projected, best = rate_meter.rates(time.time())
+        refresh_score_home()
+        points, mults, score = score_engine.score()
+        score_text = f"{points} x {mults} = {score}" if score_engine.rules["multiplier"] else str(score)
+        if not score_engine.exact():
+            score_text += " (approx., needs cty.dat)"
+        sync_text = f"\nLog sync: {log_sync.status}" if log_sync else ""
+        rate_label.config(text=f"Rate 10 min: {last_10} ({projected}/hr)  60 min: {last_60}\nBest 60 min: {best}  Score: {score_text}{sync_text}")
         key_window.after(1000, update_time)
 
     callsign_label = tk.Label(key_window, text="Callsign:")
@@ -958,10 +4047,89 @@ def show_function_key_window():
 
     callsign_entry.bind('<KeyPress>', lambda event: stop_repeat())
 
+    check_frame = tk.Frame(key_window)
+    check_frame.grid(row=2, column=0, columnspan=8, padx=5, sticky="w")
+    dupe_label = tk.Label(check_frame, text="", fg="red", font=("Arial", 12, "bold"))
+    dupe_label.pack(side="left", padx=5)
+    mult_label = tk.Label(check_frame, text="", fg="dark green", font=("Arial", 12, "bold"))
+    mult_label.pack(side="left", padx=5)
+    cty_label = tk.Label(check_frame, text="", font=("Arial", 10))
+    cty_label.pack(side="left", padx=5)
+    callsign_bg = callsign_entry.cget("bg")
+
+    def check_callsign(*args):
+        callsign = callsign_var.get().strip()
+        band = frequency_to_band(frequency_var.get())
+        if callsign and is_dupe(callsign, band):
+            station = dupe_station(callsign, band) if log_sync else ""
+            dupe_label.config(text=f"DUPE: {callsign.upper()} ({station})" if station else f"DUPE: {callsign.upper()}")
+            callsign_entry.config(bg="#ffcccc")
+        else:
+            dupe_label.config(text="")
+            callsign_entry.config(bg=callsign_bg)
+
+    callsign_var.trace_add("write", check_callsign)
+    frequency_var.trace_add("write", check_callsign)
+
+    def check_multiplier(*args):
+        callsign = callsign_var.get().strip()
+        new, mult = score_engine.is_new_multiplier(callsign, frequency_to_band(frequency_var.get()), exchange_var.get()) if callsign else (False, None)
+        mult_label.config(text=f"NEW MULT: {mult[1]}" if new else "")
+
+    callsign_var.trace_add("write", check_multiplier)
+
+    def poll_log_sync():
+        # Another station's QSO can make the call being typed here a dupe or no longer a mult
+        at_end = log_view is not None and log_view.top + log_view.rows >= len(qso_list)
+        if process_sync_events():
+            if log_view:
+                if at_end:
+                    log_view.scroll_to_end()
+                else:
+                    log_view.render()
+            check_callsign()
+            check_multiplier()
+        key_window.after(SYNC_POLL_MS, poll_log_sync)
+
+    def show_cty(*args):
+        record = cty_lookup(callsign_var.get()) if callsign_var.get().strip() else None
+        cty_label.config(text=format_cty(record) if record else "")
+
+    callsign_var.trace_add("write", show_cty)
+    exchange_var.trace_add("write", check_multiplier)
+    frequency_var.trace_add("write", check_multiplier)
+
+    match_frame = tk.Frame(check_frame)
+    match_frame.pack(side="left", padx=5)
+    scp_text = tk.Text(match_frame, height=2, width=70, wrap="word", state="disabled", font=("Courier", 10))
+    scp_text.pack(side="top", anchor="w")
+    nplus1_label = tk.Label(match_frame, text="", fg="blue", font=("Courier", 10), anchor="w")
+    nplus1_label.pack(side="top", anchor="w")
+    scp_text.tag_configure("worked", foreground="gray")
+
+    def update_scp(*args):
+        matches = scp_index.search(callsign_var.get().strip()) if scp_index else []
+        scp_text.config(state="normal")
+        scp_text.delete(1.0, tk.END)
+        band = frequency_to_band(frequency_var.get())
+        for call in matches[:SCP_MAX_SHOWN]:
+            scp_text.insert(tk.END, call + " ", "worked" if is_dupe(call, band) else ())
+        if len(matches) > SCP_MAX_SHOWN:
+            scp_text.insert(tk.END, f"(+{len(matches) - SCP_MAX_SHOWN} more)")
+        scp_text.config(state="disabled")
+
+    callsign_var.trace_add("write", update_scp)
+
+    def update_nplus1(*args):
+        suggestions = busted_call_suggestions(callsign_var.get().strip()) if log_fuzzy else []
+        nplus1_label.config(text=f"N+1: {' '.join(suggestions)}" if suggestions else "")
+
+    callsign_var.trace_add("write", update_nplus1)
+
     buttons = {}
     for i in range(1, 13):
         f_key = f"F{i}"
-        row = 2 if i <= 6 else 3
+        row = 3 if i <= 6 else 4
         col = (i-1) % 6
         btn = tk.Button(key_window, text=f"{f_key}\n{button_labels[f_key]}", command=create_action(f_key), width=8, height=2)
         btn.grid(row=row, column=col, padx=10, pady=10)
@@ -973,11 +4141,11 @@ def show_function_key_window():
         btn.bind("<Button-3>", lambda event, menu=context_menu: menu.post(event.x_root, event.y_root))
 
     qrz_button = tk.Button(key_window, text="QRZ", command=lookup_qrz, width=8, height=2)
-    qrz_button.grid(row=2, column=6, padx=10, pady=10, rowspan=2)
+    qrz_button.grid(row=3, column=6, padx=10, pady=10, rowspan=2)
     ui_elements.append(qrz_button)
 
     control_panel = tk.Frame(key_window)
-    control_panel.grid(row=4, column=0, columnspan=8, pady=5)
+    control_panel.grid(row=5, column=0, columnspan=8, pady=5)
 
     speed_frame = tk.Frame(control_panel)
     speed_frame.pack(side="left", padx=5, pady=5)
@@ -1012,24 +4180,31 @@ def show_function_key_window():
     tk.Label(repeat_frame, text="sec").pack(side="left", padx=2, pady=5)
 
     sent_frame = tk.Frame(key_window)
-    sent_frame.grid(row=5, column=0, columnspan=8, pady=5, sticky="ew")
+    sent_frame.grid(row=6, column=0, columnspan=8, pady=5, sticky="ew")
     tk.Label(sent_frame, text="Sent:").pack(side="left", padx=5)
     sent_text = tk.Text(sent_frame, height=1, width=50, state="disabled")
     sent_text.pack(side="left", fill="x", expand=True, padx=5)
     ui_elements.append(sent_text)
 
     keyer_frame = tk.Frame(key_window)
-    keyer_frame.grid(row=6, column=0, columnspan=8, pady=5, sticky="ew")
+    keyer_frame.grid(row=7, column=0, columnspan=8, pady=5, sticky="ew")
     tk.Label(keyer_frame, text="Keyboard Keyer:").pack(side="left", padx=5)
     keyboard_keyer = tk.Text(keyer_frame, height=1, width=50)
     keyboard_keyer.pack(side="left", fill="x", expand=True, padx=5)
+    keyboard_keyer.tag_config("keyer_sent", foreground="gray")
+    keyboard_keyer.tag_config("keyer_queued", foreground="black")
+    keyboard_keyer.tag_config("keyer_held", foreground="blue", underline=True)
     keyboard_keyer.bind("<KeyPress>", send_keyer_text)
     ui_elements.append(keyboard_keyer)
+    word_mode_check = tk.Checkbutton(keyer_frame, text="Word", variable=keyer_word_mode, command=set_keyer_mode)
+    word_mode_check.pack(side="left", padx=5)
+    ui_elements.append(word_mode_check)
 
     key_window.bind('<Prior>', increase_speed)
     key_window.bind('<Next>', decrease_speed)
     key_window.bind('<Return>', log_qso)
-    key_window.bind('<Escape>', lambda event: stop_repeat())
+    key_window.bind('<Escape>', lambda event: (stop_repeat(), clear_keyer()))
+    key_window.bind('<Control-D>', show_diagnostics)
 
     for col in range(8):
         key_window.grid_columnconfigure(col, weight=1, uniform="btn_group")
@@ -1038,18 +4213,234 @@ def show_function_key_window():
         f_key = f"F{i}"
         key_window.bind(f'<F{i}>', lambda e, k=f_key: create_action(k)())
 
-    threading.Thread(target=get_omnirig_data, daemon=True).start()
-    threading.Thread(target=read_serial, daemon=True).start()
+    start_rig_polling()
+    serial_engine.start()
+    threading.Thread(target=load_scp, args=(scp_file,), daemon=True).start()
+    threading.Thread(target=load_cty, args=(cty_file,), daemon=True).start()
 
     set_knob_mode()
     set_speed()
     set_sidetone()
     update_frequency()
+    process_serial_events()
+    try:
+        start_log_sync()
+    except OSError as e:
+        messagebox.showerror("Error", f"Failed to start log sync: {e}")
+    poll_log_sync()
     update_time()
 
     key_window.protocol("WM_DELETE_WINDOW", on_closing)
+    key_window.after_idle(lambda: (mark_startup("main window shown"), print_startup_report()))
     key_window.mainloop()
 
+HEADLESS_HELP = """Commands (one per line):
+  F1 .. F12          send a macro using the current entry fields
+  send TEXT          send TEXT, placeholders such as {mycall} are allowed
+  call CALL          set the callsign field (also snt, rcv, exch)
+  log                log the QSO in the entry fields
+  dupe CALL          check CALL against the log on the current band
+  score              print QSO points, multipliers and claimed score, "approximate" without cty.dat data
+  speed WPM          set the keyer speed
+  stop               clear the MM-3 buffer
+  export FORMAT FILE write the log as adif, cabrillo, csv or jsonl
+  sync               print the log sync state; changes to the shared log print as
+                     sync SEQ OP CALL|ID STATION
+  diag [on|off]      start or stop recording latencies, or print them as JSON
+  capture FILE|off   record all serial traffic to FILE, or stop recording
+  quit"""
+
+def headless_print(text):
+    # Replies, serial events and log sync changes come from different threads; keep each on a line of its own
+    with headless_output_lock:
+        print(text, flush=True)
+
+def print_serial_events():
+    while True:
+        try:
+            kind, value, timestamp = serial_events.get(timeout=FREQUENCY_POLL_MS / 1000)
+            headless_print(f"{kind} {value}")
+        except queue.Empty:
+            pass
+        # Nobody displays the frequency without a window, so just keep the queue short
+        while not frequency_queue.empty():
+            frequency_queue.get_nowait()
+
+def headless_command(line, entry):
+    verb, _, argument = line.strip().partition(" ")
+    verb = verb.lower()
+    argument = argument.strip()
+    if verb.upper() in macros:
+        tokens = compiled_macros.get(verb.upper())
+        if tokens is None:
+            return f"error {verb.upper()} has an invalid placeholder"
+        return f"ok {transmit(expand_macro(tokens, macro_values(entry['call'], entry['snt'], entry['exch']))):.1f}"
+    if verb == "send":
+        return f"ok {transmit(expand_macro(compile_macro(argument), macro_values(entry['call'], entry['snt'], entry['exch']))):.1f}"
+    if verb in entry:
+        entry[verb] = argument
+        return "ok"
+    if verb == "log":
+        if not entry["call"] or not entry["exch"]:
+            return "error callsign and exchange are required"
+        qso = record_qso(entry["call"], entry["snt"], entry["rcv"], entry["exch"], current_frequency())
+        entry["call"] = entry["exch"] = ""
+        return f"ok {qso.serial} {qso.callsign}"
+    if verb == "dupe":
+        return "ok dupe" if is_dupe(argument, frequency_to_band(current_frequency())) else "ok new"
+    if verb == "score":
+        points, mults, score = score_engine.score()
+        return f"ok {points} {mults} {score}" + ("" if score_engine.exact() else " approximate")
+    if verb == "speed":
+        if not set_keyer_speed(int(argument)):
+            return "error transmit queue is full, speed not changed"
+        return "ok"
+    if verb == "stop":
+        if not mm3_command("", None):
+            return "error transmit queue is full"
+        return "ok"
+    if verb == "export":
+        name, _, filename = argument.partition(" ")
+        if name.lower() not in EXPORT_FORMATTERS or not filename:
+            return f"error use: export {'|'.join(EXPORT_FORMATTERS)} FILE"
+        events = queue.Queue()
+        run_export(EXPORT_FORMATTERS[name.lower()](), list(qso_list), filename.strip(), events, threading.Event())
+        while True:
+            kind, value = events.get()
+            if kind == "done":
+                return f"ok {len(qso_list)}"
+            if kind == "error":
+                return f"error {value}"
+    if verb == "sync":
+        if not log_sync:
+            return "ok off"
+        return f"ok {log_sync.status}, seq {log_sync.applied_seq}, serial {serial_number}, {len(qso_list)} QSOs"
+    if verb == "diag":
+        if argument.lower() in ("on", "off"):
+            set_diagnostics(argument.lower() == "on")
+            return "ok"
+        if diagnostics is None:
+            return "error diagnostics are off, use diag on"
+        return f"ok {json.dumps(diagnostics.snapshot(), separators=(',', ':'))}"
+    if verb == "capture":
+        if not argument:
+            return f"ok {serial_capture.filename}" if serial_capture else "ok off"
+        if argument.lower() == "off":
+            capture = stop_serial_capture()
+            return f"ok {capture.bytes_written} bytes, {capture.dropped()} dropped" if capture else "ok off"
+        start_serial_capture(argument)
+        return "ok"
+    if verb == "help":
+        return HEADLESS_HELP
+    return f"error unknown command {verb}, try help"
+
+def apply_sync_events(lock):
+    while True:
+        event = sync_events.get()
+        applied = []
+        with lock:
+            process_sync_events(event, applied)
+        # Scripts see the shared log change as it happens, e.g. "sync 12 add DL1ABC B"
+        for message in applied:
+            record = message["record"]
+            subject = record["qso"]["callsign"] if "qso" in record else record.get("id", "")
+            headless_print(f"sync {message['seq']} {record['op']} {subject} {message.get('station', '')}".rstrip())
+
+def run_headless(port_name):
+    # The same keyer and log services as the window, driven by lines on stdin, so the keyer
+    # can run on a shack PC without a display or be scripted through a pipe
+    if serial_engine is None:
+        if not port_name:
+            print("--headless needs --port or --replay", file=sys.stderr)
+            return 2
+        try:
+            open_keyer_port(port_name)
+        except serial.SerialException as e:
+            print(f"Failed to open port {port_name}: {e}", file=sys.stderr)
+            return 1
+    compile_all_macros()
+    load_cty(cty_file)
+    log_ready.wait()
+    if log_error:
+        print(log_error, file=sys.stderr)
+    refresh_score_home()
+    start_rig_polling()
+    serial_engine.start()
+    threading.Thread(target=print_serial_events, daemon=True).start()
+    set_keyer_speed(keyer_options["speed"])
+    try:
+        start_log_sync()
+    except OSError as e:
+        print(f"Failed to start log sync: {e}", file=sys.stderr)
+        return 1
+    # Commands and log sync changes take turns with the log
+    log_lock = threading.Lock()
+    threading.Thread(target=apply_sync_events, args=(log_lock,), daemon=True).start()
+    entry = {"call": "", "snt": "599", "rcv": "599", "exch": ""}
+    mark_startup("headless ready")
+    print_startup_report()
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        if line.strip().lower() == "quit":
+            break
+        try:
+            with log_lock:
+                reply = headless_command(line, entry)
+            headless_print(reply)
+        except queue.Full:
+            headless_print("error transmit queue is full")
+        except Exception as e:
+            headless_print(f"error {e}")
+    stop_log_sync()
+    stop_serial_capture()
+    serial_engine.stop()
+    return 0
+
 if __name__ == "__main__":
-    load_settings()
-    show_port_selection()
+    parser = argparse.ArgumentParser(description="ZS6WAR AEA MM-3 Morse Machine Contest Keyer")
+    parser.add_argument("--headless", action="store_true", help="run without a window, reading commands from stdin")
+    parser.add_argument("--port", help="serial port of the MM-3, skips the port dialog (--headless needs this or --replay)")
+    parser.add_argument("--startup-report", action="store_true", help="print how long each startup step took")
+    parser.add_argument("--sync", choices=["Off", "Master", "Station"], help="log sync role, overriding the saved setting")
+    parser.add_argument("--sync-host", help="master address for --sync Station")
+    parser.add_argument("--sync-port", type=int, help=f"log sync TCP port (default {SYNC_PORT})")
+    parser.add_argument("--station", help="this station's name in a shared log")
+    parser.add_argument("--capture", metavar="FILE", help="record all serial traffic to FILE")
+    parser.add_argument("--replay", metavar="FILE", help="play the received side of a capture instead of opening a port")
+    parser.add_argument("--replay-speed", type=float, default=1.0, help="replay this many times faster than recorded, 0 for no waiting")
+    args = parser.parse_args()
+    startup_report_enabled = args.startup_report
+    settings = load_settings()
+    for key, value in (("role", args.sync), ("host", args.sync_host), ("port", args.sync_port), ("station", args.station)):
+        if value is not None:
+            sync_config[key] = value
+    mark_startup("settings loaded")
+    load_log_in_background(settings.get("qso_list"))
+    port_opened = False
+    if args.replay:
+        try:
+            open_replay_port(args.replay, args.replay_speed)
+            port_opened = True
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Failed to read capture {args.replay}: {e}", file=sys.stderr)
+            sys.exit(1)
+    if args.capture:
+        try:
+            start_serial_capture(args.capture)
+        except OSError as e:
+            print(f"Failed to start serial capture: {e}", file=sys.stderr)
+            sys.exit(1)
+    if args.headless:
+        sys.exit(run_headless(args.port))
+    if args.port and not port_opened:
+        # Also how the window is pointed at a port the dialog does not list, such as mm3_emulator.py's pty
+        try:
+            open_keyer_port(args.port)
+            port_opened = True
+        except serial.SerialException as e:
+            print(f"Failed to open port {args.port}: {e}", file=sys.stderr)
+    if port_opened:
+        show_function_key_window()
+    else:
+        show_port_selection()
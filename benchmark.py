@@ -0,0 +1,305 @@
+import argparse
+import gc
+import importlib.util
+import json
+import os
+import platform
+import queue
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+# Times the paths that run on every keypress or QSO against synthetic logs, headless, with a
+# fake MM-3 and a fake rig. Results are JSON; with a baseline file the run exits 1 when any
+# path got slower than the baseline by more than the tolerance. A size that looks slower is
+# timed again first, and only a slowdown that every attempt shows counts.
+#   python benchmark.py                         run 1k, 10k and 100k QSO logs; the first run stores the baseline
+#   python benchmark.py --save-baseline         run and store the results as the new baseline
+#   python benchmark.py --sizes 1000 --output results.json
+# Each size also reports the memory held by the log as Qso records against the dicts the
+# keyer used to keep, measured with tracemalloc.
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "CW Keyer.py")
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_BASELINE = "benchmark_baseline.json"
+# Medians below this many microseconds apart are noise, whatever the ratio; the shortest paths
+# differ by 2-3 us between runs of the same code
+NOISE_FLOOR_US = 5.0
+ROUNDS = 5
+# Whole-log paths take long enough that fewer rounds do, but each still needs a few samples
+WHOLE_LOG_ROUNDS = 3
+# These wait on an fsync, read a file or walk the whole log, so they time the disk and memory as
+# much as the code and vary far more between runs; they get --wide-tolerance
+WIDE_TOLERANCE_PATHS = {"log_qso", "settings_save", "settings_load", "export_adif", "export_cabrillo", "journal_replay", "journal_compact"}
+RECHECKS = 2
+CALL_PREFIXES = ("K", "W", "N", "AA", "DL", "G", "F", "I", "JA", "VE", "PA", "OH", "SP", "UA", "ZS", "VK", "LU", "PY")
+BAND_FREQUENCIES = (3525000, 7025000, 14025000, 21025000, 28025000)
+
+class FakeSerial:
+    # Swallows writes like a 1200 baud port with an empty receive side
+    def __init__(self):
+        self.is_open = True
+        self.in_waiting = 0
+        self.written = 0
+        self.closed = threading.Event()
+
+    def write(self, data):
+        self.written += len(data)
+        return len(data)
+
+    def read(self, size=1):
+        if self.closed.wait(0.05):
+            raise OSError("port closed")
+        return b""
+
+    def close(self):
+        self.is_open = False
+        self.closed.set()
+
+def load_app():
+    spec = importlib.util.spec_from_file_location("cw_keyer", APP_FILE)
+    app = importlib.util.module_from_spec(spec)
+    sys.modules["cw_keyer"] = app
+    spec.loader.exec_module(app)
+    return app
+
+def synthetic_qsos(app, count, seed=1):
+    rng = random.Random(seed)
+    start = 1_700_000_000
+    qsos = []
+    for n in range(1, count + 1):
+        call = f"{rng.choice(CALL_PREFIXES)}{rng.randint(0, 9)}{''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(rng.randint(1, 3)))}"
+        qsos.append(app.Qso(n, n, start + n * 2, call, "599", "599", str(n), str(rng.randint(1, 40)), rng.choice(BAND_FREQUENCIES), "CW"))
+    return qsos
+
+def set_log(app, qsos):
+    app.qso_list = qsos
+    app.next_qso_id = len(qsos) + 1
+    app.serial_number = len(qsos) + 1
+    app.build_log_indexes()
+    # The N+1 index is built in the background; let it finish so it does not skew the timings
+    while app.log_fuzzy is None:
+        time.sleep(0.01)
+
+def timed(function, iterations, rounds=ROUNDS):
+    # Split into rounds so a burst of other load on the machine spoils one round, not the result
+    samples = []
+    for _ in range(rounds):
+        round_samples = []
+        for _ in range(max(1, iterations // rounds)):
+            start = time.perf_counter()
+            function()
+            round_samples.append(time.perf_counter() - start)
+        samples.append(round_samples)
+    return samples
+
+def summary(rounds):
+    samples = sorted(sample for round_samples in rounds for sample in round_samples)
+    return {
+        "median_us": round(min(statistics.median(round_samples) for round_samples in rounds) * 1e6, 3),
+        "p95_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1e6, 3),
+        "runs": len(samples)
+    }
+
+def transmit_waiting(app, message):
+    # A tight loop can outrun the writer thread; wait for room the way a second F-key press would
+    while True:
+        try:
+            return app.transmit(message)
+        except queue.Full:
+            time.sleep(0)
+
+def run_size(app, size, iterations, tk_root):
+    results = {}
+    set_log(app, synthetic_qsos(app, size))
+    app.compact_journal()
+    tokens = app.compiled_macros["F2"]
+    rng = random.Random(size)
+    calls = [qso.callsign for qso in rng.sample(app.qso_list, min(iterations, size))]
+
+    results["format_output"] = timed(lambda: app.format_output("DL1ABC", "599", "0123", app.my_station["callsign"]), iterations)
+    results["macro_expand"] = timed(lambda: app.expand_macro(tokens, app.macro_values("DL1ABC", "599", "0123")), iterations)
+    results["macro_send"] = timed(lambda: transmit_waiting(app, app.expand_macro(tokens, app.macro_values("DL1ABC", "599", "0123"))), iterations)
+    results["cw_duration"] = timed(lambda: app.calculate_cw_duration("DL1ABC 5NN 0123 TU ZS6WAR", app.keyer_options["speed"]), iterations)
+    call_iter = iter(calls * (iterations // len(calls) + 1))
+    results["dupe_check"] = timed(lambda: app.is_dupe(next(call_iter), "20M"), iterations)
+    # Every logged QSO is a journal write with an fsync, so fewer of these
+    qso_iterations = max(ROUNDS, iterations // 10)
+    results["log_qso"] = timed(lambda: app.record_qso("DL1ABC", "599", "599", "15", "14.025"), qso_iterations)
+
+    if tk_root is not None:
+        view = app.LogView(tk_root)
+        view.scroll_to_end()
+
+        def refresh():
+            view.render()
+            tk_root.update_idletasks()
+
+        results["log_view_render"] = timed(refresh, max(ROUNDS, iterations // 10))
+        view.tree.destroy()
+        view.scrollbar.destroy()
+
+    # Whole-log paths run a few times only, their cost grows with the log
+    whole_runs = WHOLE_LOG_ROUNDS * (3 if size >= 100000 else 5)
+    qsos = list(app.qso_list)
+    for name, formatter in (("export_adif", app.AdifFormatter), ("export_cabrillo", app.CabrilloFormatter)):
+        def export():
+            events = queue.Queue()
+            app.run_export(formatter(), qsos, f"export_{name}.txt", events, threading.Event())
+            kind, value = events.get()
+            while kind == "progress":
+                kind, value = events.get()
+            if kind != "done":
+                raise RuntimeError(f"{name} failed: {value}")
+        results[name] = timed(export, whole_runs, WHOLE_LOG_ROUNDS)
+    results["settings_save"] = timed(app.save_settings, max(ROUNDS, iterations // 10))
+
+    def load_settings():
+        app.settings_cache = None
+        app.load_settings()
+
+    results["settings_load"] = timed(load_settings, max(ROUNDS, iterations // 10))
+    results["journal_replay"] = timed(app.replay_journal, whole_runs, WHOLE_LOG_ROUNDS)
+    results["journal_compact"] = timed(app.compact_journal, whole_runs, WHOLE_LOG_ROUNDS)
+    return {f"{name}@{size}": summary(samples) for name, samples in results.items()}
+
+def traced_bytes(build):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        value = build()
+        gc.collect()
+        return value, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+def measure_memory(app, size):
+    # Two baselines: dicts as json.load made them from settings.json, which is what the log
+    # used to be, and dicts sharing their strings with the records, the least a dict can cost
+    # A seed of its own, so the callsigns are not already interned by the timed log
+    lines = [json.dumps(qso.to_dict()) for qso in synthetic_qsos(app, size, seed=size + 1)]
+    dicts, json_bytes = traced_bytes(lambda: [json.loads(line) for line in lines])
+    # Bound as a default, so the del frees the dicts before the shared ones are measured
+    records, record_bytes = traced_bytes(lambda dicts=dicts: [app.Qso.from_dict(qso) for qso in dicts])
+    del dicts
+    shared, shared_bytes = traced_bytes(lambda: [qso.to_dict() for qso in records])
+    return {
+        "record_bytes_per_qso": round(record_bytes / size, 1),
+        "json_dict_bytes_per_qso": round(json_bytes / size, 1),
+        "shared_dict_bytes_per_qso": round(shared_bytes / size, 1),
+        "ratio_to_json_dicts": round(record_bytes / json_bytes, 3),
+        "ratio_to_shared_dicts": round(record_bytes / shared_bytes, 3)
+    }
+
+def compare(results, baseline, tolerance, wide_tolerance):
+    # Returns the keys of the paths slower than the baseline allows
+    regressions = []
+    for key, result in results.items():
+        before = baseline.get(key)
+        if before is None:
+            continue
+        limit = before["median_us"] * (1 + (wide_tolerance if key.split("@")[0] in WIDE_TOLERANCE_PATHS else tolerance))
+        if result["median_us"] > limit and result["median_us"] - before["median_us"] > NOISE_FLOOR_US:
+            regressions.append(key)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the keyer's hot paths")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="log sizes in QSOs")
+    parser.add_argument("--iterations", type=int, default=2000, help="calls per per-keypress path")
+    parser.add_argument("--output", help="write the results JSON here as well as to stdout")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline, 0.25 = 25%%")
+    parser.add_argument("--wide-tolerance", type=float, default=1.0, help="allowed slowdown for the whole-log and fsync paths")
+    parser.add_argument("--no-tk", action="store_true", help="skip the log window refresh even if a display is available")
+    args = parser.parse_args()
+    baseline_file = os.path.abspath(args.baseline)
+    output_file = os.path.abspath(args.output) if args.output else None
+    # Timings only compare on the same machine, so the first run there becomes the baseline
+    baseline = None
+    if not args.save_baseline and os.path.exists(baseline_file):
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+
+    app = load_app()
+    # Settings, journal and exports all use relative names, so keep them out of the real ones
+    workdir = tempfile.mkdtemp(prefix="cw_keyer_bench_")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        app.rig_config["backend"] = "Fake"
+        app.start_rig_polling()
+        port = FakeSerial()
+        app.ser = port
+        app.serial_engine = app.SerialEngine(port)
+        app.serial_engine.start()
+        app.compile_all_macros()
+        while app.rig_frequency[0] == 0:
+            time.sleep(0.01)
+
+        tk_root = None
+        if not args.no_tk:
+            try:
+                tk_root = app.tk.Tk()
+                tk_root.withdraw()
+            except app.tk.TclError:
+                print("No display, skipping log_view_render", file=sys.stderr)
+
+        results = {}
+        memory = {}
+        for size in args.sizes:
+            print(f"Benchmarking {size} QSOs", file=sys.stderr)
+            results.update(run_size(app, size, args.iterations, tk_root))
+            memory[f"qso_records@{size}"] = measure_memory(app, size)
+        for _ in range(RECHECKS if baseline else 0):
+            slow_sizes = sorted({int(key.split("@")[1]) for key in compare(results, baseline["results"], args.tolerance, args.wide_tolerance)})
+            for size in slow_sizes:
+                print(f"Benchmarking {size} QSOs again, slower than the baseline", file=sys.stderr)
+                for key, result in run_size(app, size, args.iterations, tk_root).items():
+                    if result["median_us"] < results[key]["median_us"]:
+                        results[key] = result
+
+        app.serial_engine.stop()
+        port.close()
+        app.rig_backend = None
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "results": results,
+        "memory": memory
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if output_file:
+        with open(output_file, "w") as f:
+            f.write(text + "\n")
+    if baseline is None:
+        with open(baseline_file, "w") as f:
+            f.write(text + "\n")
+        print(f"{'Baseline' if args.save_baseline else 'No baseline yet, this run'} saved to {baseline_file}; later runs are compared against it", file=sys.stderr)
+        return 0
+    regressions = []
+    for key in compare(results, baseline["results"], args.tolerance, args.wide_tolerance):
+        result, before = results[key], baseline["results"][key]
+        regressions.append(f"{key}: {result['median_us']:.1f} us, baseline {before['median_us']:.1f} us (+{(result['median_us'] / before['median_us'] - 1) * 100:.0f}%)")
+    for key, usage in memory.items():
+        before = baseline.get("memory", {}).get(key)
+        if before and usage["record_bytes_per_qso"] > before["record_bytes_per_qso"] * (1 + args.tolerance):
+            regressions.append(f"{key}: {usage['record_bytes_per_qso']:.0f} bytes per QSO, baseline {before['record_bytes_per_qso']:.0f}")
+    for line in regressions:
+        print(f"REGRESSION {line}", file=sys.stderr)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+import argparse
+import collections
+import json
+import os
+import pty
+import queue
+import statistics
+import sys
+import threading
+import time
+import tty
+
+from benchmark import load_app
+
+# A software AEA MM-3 on a Linux pseudo-terminal, for testing the keyer without the hardware.
+# Lines starting with * are commands (*6NN speed, *A6/*B6 knob, *A1/*B1 sidetone), \x03 aborts,
+# anything else is keyed as it arrives, the way the keyboard keyer types into it, and echoed
+# back one character at a time at the real CW timing. The code and prosign tables are the
+# keyer's own, so a prosign such as <AR> is keyed as one character, as the timing estimate has it.
+# Every byte in or out is time-stamped with time.monotonic(), the clock SerialEngine uses,
+# so latencies can be taken straight from the two sides.
+#   python mm3_emulator.py                     print the port to open and run until Ctrl+C
+#   python mm3_emulator.py --log events.jsonl  also write every event as a JSON line
+#   python mm3_emulator.py --measure 10        F-key to wire to echo latency through the keyer
+
+EVENT_HISTORY = 100000
+MEASURE_TIMEOUT = 60.0
+
+class Mm3Emulator:
+    def __init__(self, app, wpm=25, log_file=None):
+        self.master, self.slave = pty.openpty()
+        # Raw, so the line discipline neither echoes nor turns \n into \r\n
+        tty.setraw(self.slave)
+        self.port_name = os.ttyname(self.slave)
+        self.wpm = wpm
+        # Units of each character or prosign, from the keyer; 3 more between characters and 7 between words
+        self.units = {**app.CHARACTER_UNITS, **app.PROSIGN_UNITS}
+        self.prosign_length = max(len(prosign) for prosign in app.PROSIGN_UNITS)
+        self.knob = False
+        self.sidetone = True
+        # A * at the start of a line begins a command, which is collected up to the line end
+        self.command_buffer = None
+        self.at_line_start = True
+        self.characters = queue.Queue()
+        # Bumped by every abort; the keyer drops whatever it was sending for an older one
+        self.generation = 0
+        self.events = collections.deque(maxlen=EVENT_HISTORY)
+        self.event_lock = threading.Lock()
+        self.log = open(log_file, "w", encoding="utf-8") if log_file else None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.read, daemon=True).start()
+        threading.Thread(target=self.key, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        self.characters.put(None)
+        os.close(self.slave)
+        os.close(self.master)
+        if self.log:
+            self.log.close()
+
+    def record(self, kind, data, timestamp=None):
+        event = (timestamp or time.monotonic(), kind, data)
+        with self.event_lock:
+            self.events.append(event)
+            if self.log:
+                self.log.write(json.dumps({"t": event[0], "event": kind, "data": data}) + "\n")
+
+    def events_since(self, since, kind=None):
+        with self.event_lock:
+            return [event for event in self.events if event[0] >= since and (kind is None or event[1] == kind)]
+
+    def read(self):
+        while self.running:
+            try:
+                data = os.read(self.master, 1024)
+            except OSError:
+                return
+            timestamp = time.monotonic()
+            self.record("rx", data.decode("ascii", errors="replace"), timestamp)
+            for char in data.decode("ascii", errors="ignore").upper():
+                if char == "\x03":
+                    self.generation += 1
+                    self.command_buffer = None
+                    self.record("abort", "", timestamp)
+                    # Ends the echo line of whatever was cut off
+                    self.characters.put((self.generation, "\n"))
+                    self.at_line_start = True
+                elif self.command_buffer is not None:
+                    if char in "\r\n":
+                        self.command(self.command_buffer.strip(), timestamp)
+                        self.command_buffer = None
+                    else:
+                        self.command_buffer += char
+                elif char == "*" and self.at_line_start:
+                    self.command_buffer = "*"
+                else:
+                    self.characters.put((self.generation, "\n" if char == "\r" else char))
+                    self.at_line_start = char in "\r\n"
+
+    def command(self, command, timestamp):
+        if command[1:2] == "6" and command[2:].isdigit():
+            self.wpm = max(1, int(command[2:]))
+        elif command == "*A6":
+            self.knob = False
+        elif command == "*B6":
+            self.knob = True
+        elif command == "*A1":
+            self.sidetone = True
+        elif command == "*B1":
+            self.sidetone = False
+        self.record("command", command, timestamp)
+
+    def write(self, text):
+        try:
+            os.write(self.master, text.encode("ascii"))
+        except OSError:
+            return
+        self.record("tx", text)
+
+    def key(self):
+        # Each character is echoed once its last element has been keyed; sleeping to absolute
+        # deadlines keeps small sleep overshoots from adding up over a long message
+        deadline = 0.0
+        line_open = False
+        prosign = ""
+        while self.running:
+            item = self.characters.get()
+            if item is None:
+                return
+            generation, char = item
+            if generation != self.generation:
+                prosign = ""
+                continue
+            # A prosign is held back until it is complete; anything else after the < is keyed letter by letter
+            if char == "<" and not prosign:
+                prosign = char
+                continue
+            if prosign:
+                prosign += char
+                if char.isalpha() and len(prosign) < self.prosign_length:
+                    continue
+                symbols = [prosign] if prosign in self.units else list(prosign)
+                prosign = ""
+            else:
+                symbols = [char]
+            for symbol in symbols:
+                if symbol == "\n":
+                    if line_open:
+                        self.write("\r\n")
+                        line_open = False
+                    continue
+                # Idle since the last character: start keying now
+                deadline = max(deadline, time.monotonic())
+                if symbol == " ":
+                    deadline += 4 * 1.2 / self.wpm  # 7 units between words, 3 of them already waited
+                elif symbol in self.units:
+                    deadline += self.units[symbol] * 1.2 / self.wpm
+                else:
+                    continue
+                self.sleep_until(deadline)
+                if generation != self.generation:
+                    break
+                self.write(symbol)
+                line_open = True
+                if symbol != " ":
+                    deadline += 3 * 1.2 / self.wpm
+
+    def sleep_until(self, deadline):
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+def percentiles(values):
+    values = sorted(values)
+    return {
+        "min": round(values[0], 3),
+        "median": round(statistics.median(values), 3),
+        "p95": round(values[min(len(values) - 1, int(len(values) * 0.95))], 3),
+        "max": round(values[-1], 3)
+    }
+
+def measure(emulator, app, trials, key):
+    # Drives the keyer module the way an F-key press does (macro expansion, then transmit
+    # through SerialEngine) and times each step in milliseconds. The window shows the echo
+    # from serial_events at its next poll, up to SERIAL_POLL_MS after the "queued" time.
+    app.open_keyer_port(emulator.port_name)
+    app.serial_engine.start()
+    app.compile_all_macros()
+    app.set_keyer_speed(emulator.wpm)
+    time.sleep(0.2)
+    tokens = app.compiled_macros[key]
+    samples = collections.defaultdict(list)
+    for _ in range(trials):
+        while not app.serial_events.empty():
+            app.serial_events.get_nowait()
+        message = app.expand_macro(tokens, app.macro_values("DL1ABC", "599", "0123"))
+        pressed = time.monotonic()
+        app.transmit(message)
+        while True:
+            kind, line, echoed = app.serial_events.get(timeout=MEASURE_TIMEOUT)
+            if kind == "error":
+                raise RuntimeError(line)
+            if kind == "echo":
+                break
+        queued = time.monotonic()
+        wire = emulator.events_since(pressed, "rx")[0][0]
+        echo = emulator.events_since(pressed, "tx")
+        samples["press_to_wire"].append((wire - pressed) * 1000)
+        samples["wire_to_first_echo"].append((echo[0][0] - wire) * 1000)
+        samples["press_to_echo_line"].append((echoed - pressed) * 1000)
+        samples["echo_line_to_queued"].append((queued - echoed) * 1000)
+        # How far the timing estimate is from the keying, the same thing CW Timing Calibration fits
+        samples["estimate_error"].append((app.calculate_cw_duration(message, emulator.wpm) - (echo[-1][0] - wire)) * 1000)
+    app.serial_engine.stop()
+    return {
+        "key": key,
+        "message": message,
+        "wpm": emulator.wpm,
+        "trials": trials,
+        "ms": {name: percentiles(values) for name, values in samples.items()}
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="AEA MM-3 emulator on a pseudo-terminal")
+    parser.add_argument("--wpm", type=int, default=25, help="speed until the keyer sends *6NN")
+    parser.add_argument("--log", help="write every event to this file as JSON lines")
+    parser.add_argument("--measure", type=int, metavar="TRIALS", help="run the keyer against the emulator and print latencies as JSON")
+    parser.add_argument("--key", default="F1", help="macro to send with --measure")
+    args = parser.parse_args()
+    app = load_app()
+    emulator = Mm3Emulator(app, args.wpm, args.log)
+    emulator.start()
+    try:
+        if args.measure:
+            print(json.dumps(measure(emulator, app, args.measure, args.key.upper()), indent=2))
+            return 0
+        print(f"MM-3 emulator on {emulator.port_name}", flush=True)
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        emulator.stop()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+import json
+import os
+import queue
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+# Runs a master and stations as separate headless keyers on localhost, each on an empty
+# serial capture instead of an MM-3, and checks the shared log, the serials they hand out
+# and how long a QSO takes to reach the other stations.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_FILE = os.path.join(ROOT, "CW Keyer.py")
+QSOS_PER_STATION = 5
+# More than the current serial and the spares a station holds, so it runs into its own block
+OFFLINE_QSOS = 7
+TIMEOUT = 30.0
+LOCAL_SERIAL_BASE = 10000
+LOCAL_SERIAL_BLOCK = 1000
+STATIONS = 10
+LATENCY_ROUNDS = 3
+LATENCY_LIMIT = 0.05
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class Station:
+    def __init__(self, workdir, role, port, name):
+        self.name = name
+        self.workdir = workdir
+        os.makedirs(workdir)
+        capture = os.path.join(workdir, "idle.mm3cap")
+        with open(capture, "wb") as f:
+            f.write(b"MM3CAP1\n" + struct.pack("<dd", 0.0, 0.0))
+        self.stderr = open(os.path.join(workdir, "stderr.txt"), "w")
+        self.process = subprocess.Popen(
+            [sys.executable, APP_FILE, "--headless", "--replay", capture, "--sync", role,
+             "--sync-host", "127.0.0.1", "--sync-port", str(port), "--station", name],
+            cwd=workdir, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=self.stderr, text=True, bufsize=1)
+        self.replies = queue.Queue()
+        # (arrival time, line) for every "sync SEQ OP CALL STATION" change the station applied
+        self.changes = queue.Queue()
+        self.logged_at = {}
+        threading.Thread(target=self.read, daemon=True).start()
+
+    def read(self):
+        for line in self.process.stdout:
+            if line.startswith(("ok", "error")):
+                self.replies.put(line.strip())
+            elif line.startswith("sync "):
+                self.changes.put((time.monotonic(), line.split()))
+
+    def command(self, line):
+        self.process.stdin.write(line + "\n")
+        self.process.stdin.flush()
+        return self.replies.get(timeout=TIMEOUT)
+
+    def log(self, call):
+        self.command(f"call {call}")
+        self.command("exch 1")
+        self.logged_at[call] = time.monotonic()
+        reply = self.command("log").split()
+        if reply[0] != "ok":
+            raise AssertionError(f"{self.name} could not log {call}: {reply}")
+        return int(reply[1])
+
+    def wait_for(self, text):
+        deadline = time.monotonic() + TIMEOUT
+        while time.monotonic() < deadline:
+            reply = self.command("sync")
+            if text in reply:
+                return reply
+            time.sleep(0.05)
+        raise AssertionError(f"{self.name} never reported {text!r}, last reply {reply!r}")
+
+    def wait_for_hub_serial(self):
+        # Until the first serial from the hub arrives the entry serial is from the station's own block
+        deadline = time.monotonic() + TIMEOUT
+        while time.monotonic() < deadline:
+            reply = self.wait_for("connected")
+            if int(reply.split("serial ")[1].split(",")[0]) < LOCAL_SERIAL_BASE:
+                return
+            time.sleep(0.05)
+        raise AssertionError(f"{self.name} never got a serial from the hub")
+
+    def added(self, count):
+        # Arrival time of each added call, for the next count changes
+        arrivals = {}
+        while len(arrivals) < count:
+            arrived, fields = self.changes.get(timeout=TIMEOUT)
+            if fields[2] == "add":
+                arrivals[fields[3]] = arrived
+        return arrivals
+
+    def export(self):
+        filename = os.path.join(self.workdir, "log.jsonl")
+        self.command(f"export jsonl {filename}")
+        with open(filename, encoding="utf-8") as f:
+            return f.read().splitlines()
+
+    def stop(self):
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.write("quit\n")
+                self.process.stdin.flush()
+                self.process.wait(TIMEOUT)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+        self.stderr.close()
+
+class LogSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="cw_keyer_sync_")
+        self.port = free_port()
+        self.stations = []
+
+    def tearDown(self):
+        for station in self.stations:
+            station.stop()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def start(self, role, name, hub_serial=True):
+        station = Station(os.path.join(self.workdir, name), role, self.port, name)
+        self.stations.append(station)
+        if hub_serial:
+            station.wait_for_hub_serial()
+        return station
+
+    def log_concurrently(self, stations, count, tag):
+        serials = {}
+
+        def run(station):
+            serials[station.name] = [station.log(f"{station.name}{tag}{n}X") for n in range(count)]
+
+        threads = [threading.Thread(target=run, args=(station,)) for station in stations]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(TIMEOUT)
+        self.assertEqual(sorted(serials), sorted(station.name for station in stations))
+        return serials
+
+    def test_shared_log_and_unique_serials(self):
+        master = self.start("Master", "M")
+        stations = [master, self.start("Station", "A"), self.start("Station", "B")]
+
+        # Faster than the hub round trip, which is where made-up serials used to clash
+        serials = self.log_concurrently(stations, QSOS_PER_STATION, "")
+        online = [serial for station_serials in serials.values() for serial in station_serials]
+        self.assertEqual(len(online), len(set(online)), serials)
+        self.assertTrue(all(serial < LOCAL_SERIAL_BASE for serial in online), serials)
+
+        total = QSOS_PER_STATION * len(stations)
+        for station in stations:
+            station.wait_for(f"{total} QSOs")
+        logs = [station.export() for station in stations]
+        self.assertEqual(len(logs[0]), total)
+        for log in logs[1:]:
+            self.assertEqual(log, logs[0])
+
+        # With the master gone each station uses up the serials the hub already gave it, then
+        # numbers from its own block
+        master.stop()
+        self.stations.remove(master)
+        for station in stations[1:]:
+            station.wait_for("offline")
+        offline = self.log_concurrently(stations[1:], OFFLINE_QSOS, "OFF")
+        every = online + offline["A"] + offline["B"]
+        self.assertEqual(len(every), len(set(every)), offline)
+        self.assertTrue(offline["A"][-1] >= LOCAL_SERIAL_BASE and offline["B"][-1] >= LOCAL_SERIAL_BASE, offline)
+
+    def test_ten_stations_sync_latency(self):
+        stations = [self.start("Master", "M")] + [self.start("Station", f"S{n}") for n in range(1, STATIONS)]
+        latencies = []
+        log_times = []
+        for round_number in range(LATENCY_ROUNDS):
+            for station in stations:
+                call = f"{station.name}L{round_number}X"
+                station.log(call)
+                log_times.append(time.monotonic() - station.logged_at[call])
+        total = LATENCY_ROUNDS * STATIONS
+        for receiver in stations:
+            arrivals = receiver.added(total)
+            for sender in stations:
+                if sender is not receiver:
+                    latencies.extend(arrivals[call] - logged for call, logged in sender.logged_at.items())
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95)]
+        self.assertLess(p95, LATENCY_LIMIT, f"p95 {p95 * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms")
+        self.assertLess(max(log_times), LATENCY_LIMIT * 4, log_times)
+        logs = [station.export() for station in stations]
+        self.assertEqual(len(logs[0]), total)
+        for log in logs[1:]:
+            self.assertEqual(log, logs[0])
+
+    def test_logging_does_not_wait_for_a_stuck_hub(self):
+        # A hub that welcomes the station and then never answers, with the connection left up
+        server = socket.create_server(("127.0.0.1", self.port))
+        done = threading.Event()
+
+        def hub():
+            conn, _ = server.accept()
+            with conn, conn.makefile("r", encoding="utf-8") as reader:
+                reader.readline()
+                conn.sendall((json.dumps({"type": "welcome", "session": "stuck", "seq": 0, "reset": False, "slot": 3}) + "\n").encode("utf-8"))
+                done.wait(TIMEOUT)
+
+        threading.Thread(target=hub, daemon=True).start()
+        try:
+            station = self.start("Station", "S", hub_serial=False)
+            # The station moves to the block the hub granted
+            block = LOCAL_SERIAL_BASE + 3 * LOCAL_SERIAL_BLOCK
+            station.wait_for(f"serial {block + 1},")
+            serials = []
+            for n in range(QSOS_PER_STATION):
+                call = f"SX{n}X"
+                serials.append(station.log(call))
+                self.assertLess(time.monotonic() - station.logged_at[call], 0.5)
+            self.assertEqual(serials, list(range(block + 1, block + 1 + QSOS_PER_STATION)))
+        finally:
+            done.set()
+            server.close()
+
+if __name__ == "__main__":
+    unittest.main()
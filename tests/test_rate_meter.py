@@ -0,0 +1,63 @@
+import os
+import random
+import sys
+import unittest
+
+# The incremental best-60-minute window against a brute-force count after every add and remove
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmark import load_app
+
+app = load_app()
+START = 1_700_000_000
+OPERATIONS = 3000
+
+def brute_force(timestamps, now):
+    minutes = [timestamp // 60 for timestamp in timestamps]
+    minute = int(now) // 60
+    last_10 = sum(1 for m in minutes if minute - 9 <= m <= minute)
+    last_60 = sum(1 for m in minutes if minute - 59 <= m <= minute)
+    best = max((sum(1 for m in minutes if start <= m < start + 60) for start in set(minutes)), default=0)
+    return last_10, last_60, last_10 * 6, best
+
+class RateMeterTest(unittest.TestCase):
+    def check(self, meter, timestamps, rng):
+        now = rng.choice(timestamps) if timestamps else START
+        self.assertEqual(meter.rates(now), brute_force(timestamps, now))
+
+    def test_matches_brute_force_under_adds_and_removes(self):
+        for seed in range(5):
+            rng = random.Random(seed)
+            # A few hours, with bursts so several windows tie and the best moves both ways
+            span = rng.choice((3600, 4 * 3600, 12 * 3600))
+            timestamps = [START + rng.randrange(span) for _ in range(rng.randrange(0, 200))]
+            meter = app.RateMeter.from_timestamps(timestamps)
+            self.check(meter, timestamps, rng)
+            for _ in range(OPERATIONS // 5):
+                if timestamps and rng.random() < 0.45:
+                    timestamp = timestamps.pop(rng.randrange(len(timestamps)))
+                    meter.remove(timestamp)
+                else:
+                    timestamp = START + rng.randrange(span) if rng.random() < 0.7 else rng.choice(timestamps or [START])
+                    timestamps.append(timestamp)
+                    meter.add(timestamp)
+                self.check(meter, timestamps, rng)
+
+    def test_remove_of_unknown_minute_is_ignored(self):
+        meter = app.RateMeter.from_timestamps([START])
+        meter.remove(START + 3600)
+        self.assertEqual(meter.rates(START), (1, 1, 6, 1))
+
+    def test_rebuild_matches_incremental(self):
+        rng = random.Random(42)
+        timestamps = [START + rng.randrange(6 * 3600) for _ in range(500)]
+        meter = app.RateMeter()
+        for timestamp in timestamps:
+            meter.add(timestamp)
+        rebuilt = app.RateMeter.from_timestamps(timestamps)
+        self.assertEqual(meter.minutes, rebuilt.minutes)
+        self.assertEqual(meter.hour_sums, rebuilt.hour_sums)
+        self.assertEqual(meter.best, rebuilt.best)
+
+if __name__ == "__main__":
+    unittest.main()
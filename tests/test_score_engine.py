@@ -0,0 +1,154 @@
+import os
+import random
+import sys
+import unittest
+
+# The running score kept by index_qso/unindex_qso against a full recompute from the log,
+# through adds, edits, deletes and rules changes
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmark import load_app
+
+app = load_app()
+START = 1_700_000_000
+CALLS = ["K1AA", "W2BB", "N3CC", "DL1ABC", "DL2XY", "G4ZZ", "JA1YAA", "VE3/K1AA", "PA0ABC/P", "OH2BH", "ZS6WAR", "K1AA/4", "4U1ITU"]
+USA = ("United States", "NA", 5, 8)
+GERMANY = ("Fed. Rep. of Germany", "EU", 14, 28)
+# Stands in for cty.dat; 4U1ITU is left out to have a QSO without an entity
+CTY = {
+    "K1AA": USA, "W2BB": USA, "N3CC": USA, "K1AA/4": USA, "DL1ABC": GERMANY, "DL2XY": GERMANY,
+    "G4ZZ": ("England", "EU", 14, 27), "JA1YAA": ("Japan", "AS", 25, 45), "VE3/K1AA": ("Canada", "NA", 4, 4),
+    "PA0ABC/P": ("Netherlands", "EU", 14, 27), "OH2BH": ("Finland", "EU", 15, 18), "ZS6WAR": ("South Africa", "AF", 38, 57)
+}
+EXCHANGES = ["5", "14", "15", "25", "1", "A 72 CT", "B 10 WMA", "Q 60 CT", ""]
+FREQUENCIES = [3525000, 7025000, 14025000, 21025000, 28025000]
+OPERATIONS = 1500
+
+def full_recompute(qsos, rules):
+    # Each dupe key scores its best QSO
+    engine = app.ScoreEngine(rules, CTY["ZS6WAR"])
+    best = {}
+    mults = set()
+    for qso in qsos:
+        key = app.dupe_key(qso)
+        best[key] = max(best.get(key, 0), engine.qso_points(qso, key[1]) or 0)
+        mults.update(engine.multipliers(qso.callsign, key[1], qso.exchange_received, qso.cty))
+    points = sum(best.values())
+    return points, len(mults), points * len(mults) if rules["multiplier"] else points
+
+def logged_multipliers():
+    mults = set()
+    for qso in app.qso_list:
+        mults.update(app.score_engine.multipliers(qso.callsign, app.frequency_hz_to_band(qso.frequency_hz), qso.exchange_received, qso.cty))
+    return mults
+
+def make_qso(callsign, frequency_hz, exchange="14"):
+    return app.Qso(1, 1, START, callsign, "599", "599", "1", exchange, frequency_hz, "CW", CTY.get(callsign))
+
+class ScoreEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(7)
+        self.next_id = 1
+        self.cty_lookup = app.cty_lookup
+        self.my_callsign = app.my_station["callsign"]
+        app.cty_lookup = lambda callsign: CTY.get(callsign.upper())
+        app.my_station["callsign"] = "ZS6WAR"
+
+    def tearDown(self):
+        app.cty_lookup = self.cty_lookup
+        app.my_station["callsign"] = self.my_callsign
+
+    def random_qso(self, qso_id=None):
+        if qso_id is None:
+            qso_id = self.next_id
+            self.next_id += 1
+        callsign = self.rng.choice(CALLS)
+        return app.Qso(qso_id, qso_id, START + self.rng.randrange(86400), callsign, "599", "599", str(qso_id), self.rng.choice(EXCHANGES), self.rng.choice(FREQUENCIES), "CW", CTY.get(callsign))
+
+    def check(self, rules_name):
+        rules = app.CONTEST_RULES[rules_name]
+        self.assertEqual(app.score_engine.score(), full_recompute(app.qso_list, rules), rules_name)
+        self.assertEqual(app.score_engine.exact(), rules["points"].__class__ is int or all(qso.cty for qso in app.qso_list), rules_name)
+        logged = logged_multipliers()
+        for call in CALLS:
+            for exchange in EXCHANGES:
+                new, mult = app.score_engine.is_new_multiplier(call, "20M", exchange)
+                missing = [m for m in app.score_engine.multipliers(call, "20M", exchange, CTY.get(call)) if m not in logged]
+                self.assertEqual(new, bool(missing), (rules_name, call, exchange))
+                self.assertEqual(mult, missing[0] if missing else None, (rules_name, call, exchange))
+
+    def test_incremental_matches_full_recompute(self):
+        app.qso_list = [self.random_qso() for _ in range(50)]
+        for rules_name in app.CONTEST_RULES:
+            # A rules change rebuilds the score from the log, then it runs incrementally again
+            app.contest_config["rules"] = rules_name
+            app.build_log_indexes()
+            self.check(rules_name)
+            for _ in range(OPERATIONS // len(app.CONTEST_RULES)):
+                action = self.rng.random()
+                if action < 0.5 or not app.qso_list:
+                    qso = self.random_qso()
+                    app.qso_list.append(qso)
+                    app.index_qso(qso)
+                elif action < 0.75:
+                    index = self.rng.randrange(len(app.qso_list))
+                    app.unindex_qso(app.qso_list[index])
+                    edited = self.random_qso(app.qso_list[index].id)
+                    app.qso_list[index] = edited
+                    app.index_qso(edited)
+                else:
+                    app.unindex_qso(app.qso_list.pop(self.rng.randrange(len(app.qso_list))))
+                self.assertEqual(app.score_engine.score(), full_recompute(app.qso_list, app.CONTEST_RULES[rules_name]), rules_name)
+            self.check(rules_name)
+
+    def test_deleting_everything_leaves_zero(self):
+        app.contest_config["rules"] = "CQ WPX CW"
+        app.qso_list = [self.random_qso() for _ in range(30)]
+        app.build_log_indexes()
+        while app.qso_list:
+            app.unindex_qso(app.qso_list.pop())
+        self.assertEqual(app.score_engine.score(), (0, 0, 0))
+        self.assertEqual(app.score_engine.mult_counts, {})
+        self.assertEqual(app.score_engine.key_points, {})
+        self.assertEqual(app.score_engine.unknown, 0)
+
+    def test_point_tables(self):
+        # Points seen from South Africa, then from the USA for the North America exceptions
+        cases = [
+            ("CQ WPX CW", CTY["ZS6WAR"], "ZS6WAR", 14025000, 1),
+            ("CQ WPX CW", CTY["ZS6WAR"], "DL1ABC", 14025000, 3),
+            ("CQ WPX CW", CTY["ZS6WAR"], "DL1ABC", 7025000, 6),
+            ("CQ WPX CW", USA, "VE3/K1AA", 14025000, 2),
+            ("CQ WPX CW", USA, "VE3/K1AA", 3525000, 4),
+            ("CQ WPX CW", USA, "K1AA", 3525000, 1),
+            ("CQ WPX CW", CTY["G4ZZ"], "DL1ABC", 7025000, 2),
+            ("CQ WW CW", CTY["ZS6WAR"], "ZS6WAR", 14025000, 0),
+            ("CQ WW CW", CTY["ZS6WAR"], "JA1YAA", 7025000, 3),
+            ("CQ WW CW", CTY["G4ZZ"], "DL1ABC", 14025000, 1),
+            ("CQ WW CW", USA, "VE3/K1AA", 14025000, 2),
+            ("IARU HF", CTY["G4ZZ"], "PA0ABC/P", 14025000, 1),
+            ("IARU HF", CTY["G4ZZ"], "DL1ABC", 14025000, 3),
+            ("IARU HF", CTY["G4ZZ"], "K1AA", 14025000, 5),
+        ]
+        for rules_name, home, callsign, frequency_hz, points in cases:
+            engine = app.ScoreEngine(app.CONTEST_RULES[rules_name], home)
+            exchange = str(CTY[callsign][3]) if rules_name == "IARU HF" else "14"
+            self.assertEqual(engine.qso_points(make_qso(callsign, frequency_hz, exchange), app.frequency_hz_to_band(frequency_hz)), points, (rules_name, home, callsign))
+        iaru = app.ScoreEngine(app.CONTEST_RULES["IARU HF"], CTY["G4ZZ"])
+        self.assertEqual(iaru.qso_points(make_qso("K1AA", 14025000, "ARRL"), "20M"), 1)
+        self.assertIsNone(iaru.qso_points(make_qso("4U1ITU", 14025000), "20M"))
+        self.assertIsNone(app.ScoreEngine(app.CONTEST_RULES["IARU HF"]).qso_points(make_qso("K1AA", 14025000), "20M"))
+
+    def test_cq_ww_counts_zones_and_countries(self):
+        app.contest_config["rules"] = "CQ WW CW"
+        app.qso_list = [make_qso("DL1ABC", 14025000, "14"), make_qso("DL2XY", 14025000, "14"), make_qso("G4ZZ", 14025000, "14"), make_qso("DL1ABC", 7025000, "14")]
+        app.build_log_indexes()
+        # 3 points each from South Africa; zone 14 and two countries on 20 m, zone 14 and one
+        # country on 40 m, so DL2XY adds points but no mult
+        self.assertEqual(app.score_engine.score(), (12, 5, 60))
+        self.assertEqual(app.score_engine.is_new_multiplier("OH2BH", "20M", "15"), (True, ("20M", "15")))
+        self.assertEqual(app.score_engine.is_new_multiplier("OH2BH", "20M", "14"), (True, ("20M", "Finland")))
+        self.assertEqual(app.score_engine.is_new_multiplier("DL2XY", "20M", "14"), (False, None))
+
+if __name__ == "__main__":
+    unittest.main()